@@ -0,0 +1,241 @@
+"""
+Admission control for the API
+Requests are grouped in route classes (export, dashboard, auth, crud), each
+with its own concurrency limit and bounded wait queue, so a burst of PDF
+exports can only take the export slots and never starves logins or
+inventory reads. Limits are "class=concurrency/queue" pairs:
+
+    ADMISSION_LIMITS="export=2/4,dashboard=8/32,auth=16/64,crud=64/256"
+    ADMISSION_PER_USER="export=1,dashboard=4,auth=4,crud=16"
+
+A user (the token subject, or the client address before login) may hold at
+most ADMISSION_PER_USER requests of a class, running or queued; beyond that
+the request gets 429. When a slot frees up it goes to the next user in
+round-robin order rather than to the oldest request, so one user's queue
+does not delay everyone else. A full queue, or a wait longer than
+ADMISSION_QUEUE_TIMEOUT_SECONDS, gets 503. Both carry Retry-After.
+"""
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+from urllib.parse import parse_qs
+import asyncio
+import os
+import time
+
+from starlette.responses import JSONResponse
+
+import metrics
+
+DEFAULT_LIMITS = "export=2/4,dashboard=8/32,auth=16/64,crud=64/256"
+DEFAULT_PER_USER = "export=1,dashboard=4,auth=4,crud=16"
+ADMISSION_CONTROL = os.environ.get("ADMISSION_CONTROL", "true").lower() == "true"
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", "5"))
+
+# First matching prefix wins; paths matching none (/, /health, /metrics) are not limited
+ROUTE_CLASSES: Tuple[Tuple[str, Optional[str]], ...] = (
+    ("/api/changes/stream", None),  # long-lived connections would hold a slot for hours
+    ("/api/health", None),
+    ("/api/equipment/export/", "export"),
+    ("/api/dashboard/", "dashboard"),
+    ("/api/batch", None),  # each item is admitted in its own class (see batch.py)
+    ("/api/auth/", "auth"),
+    ("/api/", "crud"),
+)
+# Paths that stream an export when called with an "export" query parameter
+EXPORT_QUERY_PATHS = ("/api/history",)
+
+WAIT_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+admission_in_flight = metrics.REGISTRY.gauge(
+    "siriu_admission_in_flight", "Requests holding an admission slot by route class", ("route_class",))
+admission_queued = metrics.REGISTRY.gauge(
+    "siriu_admission_queued", "Requests waiting for an admission slot by route class", ("route_class",))
+admission_wait = metrics.REGISTRY.histogram(
+    "siriu_admission_queue_wait_seconds", "Time admitted requests waited for a slot", ("route_class",), WAIT_BUCKETS)
+admission_rejections_total = metrics.REGISTRY.counter(
+    "siriu_admission_rejections_total", "Requests turned away by route class and reason", ("route_class", "reason"))
+
+
+def parse_limits(text: str) -> Dict[str, Tuple[int, int]]:
+    """"export=2/4,crud=64/256" -> {"export": (2, 4), "crud": (64, 256)}"""
+    limits = {}
+    for part in filter(None, (piece.strip() for piece in text.split(","))):
+        name, _, values = part.partition("=")
+        concurrency, _, queue = values.partition("/")
+        limits[name.strip()] = (int(concurrency), int(queue or 0))
+    return limits
+
+
+def parse_per_user(text: str) -> Dict[str, int]:
+    return {name.strip(): int(value) for name, _, value in
+            (part.partition("=") for part in text.split(",") if part.strip())}
+
+
+def build_limiters(limits: Optional[Dict[str, Tuple[int, int]]] = None, per_user: Optional[Dict[str, int]] = None,
+                   queue_timeout: float = ADMISSION_QUEUE_TIMEOUT) -> Dict[str, "RouteClassLimiter"]:
+    """One limiter per route class, from ADMISSION_LIMITS / ADMISSION_PER_USER unless given"""
+    limits = parse_limits(os.environ.get("ADMISSION_LIMITS", DEFAULT_LIMITS)) if limits is None else limits
+    per_user = parse_per_user(os.environ.get("ADMISSION_PER_USER", DEFAULT_PER_USER)) \
+        if per_user is None else per_user
+    return {name: RouteClassLimiter(name, concurrency, queue, per_user.get(name, 0), queue_timeout)
+            for name, (concurrency, queue) in limits.items()}
+
+
+def route_class(path: str, query_string: bytes = b"") -> Optional[str]:
+    if path in EXPORT_QUERY_PATHS and "export" in parse_qs(query_string.decode("latin-1")):
+        return "export"
+    for prefix, name in ROUTE_CLASSES:
+        if path.startswith(prefix):
+            return name
+    return None
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+
+
+class RouteClassLimiter:
+    """Concurrency slots of one route class, handed to waiting users in round-robin order"""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, per_user: int = 0,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.per_user = per_user
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self.held: Dict[str, int] = {}
+        self.waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    async def acquire(self, user: str):
+        if self.per_user and self.held.get(user, 0) >= self.per_user:
+            raise Rejected(429, "user_limit")
+        started = time.perf_counter()
+        if self.active < self.concurrency and not self.queued:
+            self.active += 1
+            self._hold(user, 1)
+        elif self.queued >= self.queue_size:
+            raise Rejected(503, "queue_full")
+        else:
+            # Queued requests count against the user's share too
+            self._hold(user, 1)
+            try:
+                await self._wait(user)
+            except BaseException:
+                self._hold(user, -1)
+                raise
+        admission_wait.observe((self.name,), time.perf_counter() - started)
+        self._report()
+
+    def release(self, user: str):
+        self._hold(user, -1)
+        self._hand_off()
+
+    def _hold(self, user: str, delta: int):
+        held = self.held.get(user, 0) + delta
+        if held > 0:
+            self.held[user] = held
+        else:
+            self.held.pop(user, None)
+
+    def _hand_off(self):
+        """Pass a freed slot to the user at the head of the rotation, who then goes to the back"""
+        if self.waiters:
+            next_user, queue = next(iter(self.waiters.items()))
+            waiter = queue.popleft()
+            if queue:
+                self.waiters.move_to_end(next_user)
+            else:
+                del self.waiters[next_user]
+            self.queued -= 1
+            waiter.set_result(None)
+        else:
+            self.active -= 1
+        self._report()
+
+    async def _wait(self, user: str):
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(user, deque()).append(waiter)
+        self.queued += 1
+        self._report()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            if waiter.done():
+                # Granted a slot just as the wait ended: pass it on
+                self._hand_off()
+            else:
+                self._forget(user, waiter)
+            if isinstance(error, asyncio.TimeoutError):
+                raise Rejected(503, "timeout")
+            raise
+
+    def _forget(self, user: str, waiter: asyncio.Future):
+        queue = self.waiters.get(user)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.queued -= 1
+            if not queue:
+                del self.waiters[user]
+        self._report()
+
+    def _report(self):
+        admission_in_flight.set((self.name,), self.active)
+        admission_queued.set((self.name,), self.queued)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the route class limits (inside CORS, so rejections carry its headers)
+
+    Instances built with the same ``limiters`` share the slots, so batched
+    sub-requests wrapped in a second instance count against the same limits.
+    """
+
+    def __init__(self, app, identify: Optional[Callable[[dict], str]] = None,
+                 limits: Optional[Dict[str, Tuple[int, int]]] = None, per_user: Optional[Dict[str, int]] = None,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, retry_after: int = ADMISSION_RETRY_AFTER,
+                 enabled: bool = ADMISSION_CONTROL, limiters: Optional[Dict[str, RouteClassLimiter]] = None):
+        self.app = app
+        self.identify = identify or _client_address
+        self.limiters = build_limiters(limits, per_user, queue_timeout) if limiters is None else limiters
+        self.retry_after = retry_after
+        self.enabled = enabled
+
+    def limiter(self, scope) -> Optional[RouteClassLimiter]:
+        """Limiter a request is admitted by (None when it is not limited)"""
+        if not self.enabled or scope["type"] != "http" or scope["method"] == "OPTIONS":
+            return None
+        return self.limiters.get(route_class(scope["path"], scope.get("query_string", b"")))
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiter(scope)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        user = self.identify(scope)
+        try:
+            await limiter.acquire(user)
+        except Rejected as rejection:
+            admission_rejections_total.inc((limiter.name, rejection.reason))
+            detail = ("Demasiadas solicitudes simultáneas; intente de nuevo en unos segundos"
+                      if rejection.status_code == 429 else "Servidor ocupado; intente de nuevo más tarde")
+            response = JSONResponse({"detail": detail}, status_code=rejection.status_code,
+                                    headers={"Retry-After": str(self.retry_after)})
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(user)
+
+
+def _client_address(scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else "anonymous"
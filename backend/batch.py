@@ -0,0 +1,116 @@
+"""
+Batched GET requests (/api/batch)
+Pages that fire several small requests on mount send them as one POST:
+
+    {"requests": [{"id": "stats", "path": "/api/dashboard/stats"},
+                  {"id": "eq", "path": "/api/equipment", "params": {"limit": 20}}]}
+
+The batch is authenticated once; every sub-request is dispatched in-process
+to the application's router (no HTTP, CORS or metrics middleware per item),
+concurrently, and carries the already authenticated user in its scope so
+get_current_user does not look it up again. The response lists one
+{"id", "status", "headers", "body"} per request, in request order; a failed
+sub-request does not fail the batch.
+
+The batch itself takes no admission slot: each item is admitted in its own
+route class (admission.py), and at most the user's share of a class runs
+at once, so a batch of dashboards queues like the same requests sent one
+by one and an item over the limits gets its own 429/503. Exports (any
+"export" parameter) stream large bodies and are not accepted.
+"""
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlencode
+import asyncio
+import json
+import logging
+import os
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_REQUESTS = int(os.environ.get("BATCH_MAX_REQUESTS", "20"))
+# Streaming endpoints never finish (change feed) or are not JSON (exports)
+BATCH_EXCLUDED_PREFIXES = ("/api/batch", "/api/changes/stream", "/api/equipment/export/")
+# Response headers passed through to the item
+FORWARDED_HEADERS = ("etag", "x-next-cursor", "retry-after")
+SCOPE_USER = "siriu.batch_user"
+
+batch_items_total = metrics.REGISTRY.counter(
+    "siriu_batch_items_total", "Batched sub-requests by status", ("status",))
+
+
+def authenticated_user(scope: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """User of the batch a sub-request belongs to (None for ordinary requests)"""
+    return scope.get(SCOPE_USER)
+
+
+def _item(item_id, status: int, body: Any, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    batch_items_total.inc((str(status),))
+    return {"id": item_id, "status": status, "headers": headers or {}, "body": body}
+
+
+async def dispatch(app, parent_scope: Dict[str, Any], user: Dict[str, Any], item: Dict[str, Any],
+                   lanes: Dict[str, asyncio.Semaphore]) -> Dict[str, Any]:
+    """Run one GET sub-request against the app (the router behind admission control) and collect its response"""
+    path, _, query = item["path"].partition("?")
+    params = urlencode(item.get("params") or {}, doseq=True)
+    query_string = "&".join(part for part in (query, params) if part)
+    if (not path.startswith("/api/") or path.startswith(BATCH_EXCLUDED_PREFIXES)
+            or "export" in parse_qs(query_string)):
+        return _item(item.get("id"), 400, {"detail": f"Ruta no disponible en lote: {path}"})
+
+    scope = {key: value for key, value in parent_scope.items() if key not in ("route", "endpoint", "path_params")}
+    scope.update({
+        "method": "GET",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string.encode(),
+        "headers": [(name, value) for name, value in parent_scope["headers"]
+                    if name not in (b"content-length", b"content-type")],
+        SCOPE_USER: user,
+    })
+    status = 500
+    headers: Dict[str, str] = {}
+    chunks: List[bytes] = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for name, value in message.get("headers", []):
+                headers[name.decode("latin-1").lower()] = value.decode("latin-1")
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    limiter = app.limiter(scope) if hasattr(app, "limiter") else None
+    lane = None
+    if limiter is not None:
+        lane = lanes.setdefault(limiter.name, asyncio.Semaphore(limiter.per_user or limiter.concurrency))
+    try:
+        if lane is None:
+            await app(scope, receive, send)
+        else:
+            async with lane:
+                await app(scope, receive, send)
+    except Exception:
+        logger.exception(f"Batched request failed: GET {path}")
+        return _item(item.get("id"), 500, {"detail": "Error interno del servidor"})
+
+    raw = b"".join(chunks)
+    try:
+        body = json.loads(raw) if raw else None
+    except ValueError:
+        body = raw.decode("utf-8", errors="replace")
+    forwarded = {name: headers[name] for name in FORWARDED_HEADERS if name in headers}
+    return _item(item.get("id"), status, body, forwarded)
+
+
+async def run_batch(app, parent_scope: Dict[str, Any], user: Dict[str, Any],
+                    items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Route class -> how many of this batch's items may hold its slots at once
+    lanes: Dict[str, asyncio.Semaphore] = {}
+    return list(await asyncio.gather(*(dispatch(app, parent_scope, user, item, lanes) for item in items)))
@@ -0,0 +1,308 @@
+"""
+Live change feed (Server-Sent Events)
+Equipment and catalog changes are pushed to clients as
+{"token", "collection", "operation", "id", "changed_fields", "timestamp"}
+events so open pages can patch their local state instead of polling.
+
+Connections read from an in-process hub: every connection has a bounded
+queue, and one that falls behind catches up from the hub's ring buffer, or
+gets a "reset" event when the events it missed are gone (it must then
+refetch). Two sources feed the hub:
+- "changestream": one MongoDB change stream per process (replica set
+  required), watched by a background task. It sees writes from every API
+  process and event tokens are the change stream resume tokens; a token
+  that is no longer in this process' buffer (or came from another process)
+  resets the connection. Pre-images, which let delete events report the
+  document id, are enabled once by init_mongodb.js.
+- "inprocess": handlers publish their own writes (memory and Firestore
+  backends, standalone MongoDB). Tokens are "<boot id>-<sequence>" and only
+  this process' writes are seen.
+"""
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterable, List, Optional, Set
+import asyncio
+import base64
+import json
+import logging
+import os
+import uuid
+
+from bson import json_util
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FEED_SOURCE = os.environ.get("CHANGE_FEED_SOURCE", "auto")
+CHANGE_FEED_BUFFER = int(os.environ.get("CHANGE_FEED_BUFFER", "1000"))
+CHANGE_FEED_QUEUE_SIZE = int(os.environ.get("CHANGE_FEED_QUEUE_SIZE", "100"))
+CHANGE_FEED_HEARTBEAT = float(os.environ.get("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+CHANGE_STREAM_RETRY = float(os.environ.get("CHANGE_STREAM_RETRY_SECONDS", "5"))
+FEED_COLLECTIONS = ("equipment", "locations", "departments", "tipos_bien", "marcas", "edificios")
+
+CHANGE_STREAM_OPERATIONS = {"insert": "insert", "update": "update", "replace": "update", "delete": "delete"}
+
+subscribers = metrics.REGISTRY.gauge("siriu_change_feed_subscribers", "Open change feed connections")
+events_total = metrics.REGISTRY.counter(
+    "siriu_change_feed_events_total", "Change events published by collection", ("collection",))
+lagging_total = metrics.REGISTRY.counter(
+    "siriu_change_feed_lagging_total", "Connections that overflowed their queue, by outcome", ("outcome",))
+
+
+def _event(collection: str, operation: str, document_id: str, changed_fields: Iterable[str] = (),
+           token: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "token": token,
+        "collection": collection,
+        "operation": operation,
+        "id": document_id,
+        "changed_fields": sorted(field for field in changed_fields if field not in ("updated_at", "version")),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+class ChangeHub:
+    """In-process publisher keeping the last CHANGE_FEED_BUFFER events for resumption"""
+
+    def __init__(self, buffer_size: int = CHANGE_FEED_BUFFER, queue_size: int = CHANGE_FEED_QUEUE_SIZE):
+        self.boot_id = uuid.uuid4().hex[:8]
+        self.queue_size = queue_size
+        self._sequence = 0
+        self._latest_token: Optional[str] = None
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=buffer_size)
+        self._subscriptions: Set["Subscription"] = set()
+
+    @property
+    def latest_token(self) -> str:
+        return self._latest_token or f"{self.boot_id}-{self._sequence}"
+
+    def publish(self, collection: str, operation: str, document_id: str, changed_fields: Iterable[str] = (),
+                token: Optional[str] = None):
+        """Buffer and fan out an event; ``token`` replaces the sequence token (change stream resume tokens)"""
+        self._sequence += 1
+        self._latest_token = token
+        event = _event(collection, operation, document_id, changed_fields, token=self.latest_token)
+        event["sequence"] = self._sequence
+        self._recent.append(event)
+        events_total.inc((collection,))
+        for subscription in list(self._subscriptions):
+            subscription.offer(event)
+
+    def sequence_of(self, token: Optional[str]) -> Optional[int]:
+        """Sequence number of a token issued by this process (None for foreign or malformed tokens)"""
+        boot_id, _, sequence = (token or "").partition("-")
+        if boot_id == self.boot_id and sequence.isdigit():
+            return int(sequence)
+        # Resume tokens are only known while their event is buffered
+        for event in reversed(self._recent):
+            if event["token"] == token:
+                return event["sequence"]
+        return None
+
+    def events_after(self, sequence: int) -> Optional[List[Dict[str, Any]]]:
+        """Buffered events after a sequence number, or None when some of them were already evicted"""
+        if sequence > self._sequence:
+            return None
+        oldest = self._recent[0]["sequence"] if self._recent else self._sequence + 1
+        if sequence + 1 < oldest:
+            return None
+        return [event for event in self._recent if event["sequence"] > sequence]
+
+    def subscribe(self, collections: Iterable[str], last_token: Optional[str] = None) -> "Subscription":
+        subscription = Subscription(self, set(collections), last_token)
+        self._subscriptions.add(subscription)
+        subscribers.inc()
+        return subscription
+
+    def unsubscribe(self, subscription: "Subscription"):
+        if subscription in self._subscriptions:
+            self._subscriptions.discard(subscription)
+            subscribers.dec()
+
+
+class Subscription:
+    """One connection's view of the hub: a bounded queue plus catch-up from the ring buffer"""
+
+    def __init__(self, hub: ChangeHub, collections: Set[str], last_token: Optional[str]):
+        self.hub = hub
+        self.collections = collections
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=hub.queue_size)
+        self.delivered = hub._sequence
+        # Resuming: replay what was missed, or reset when it cannot be replayed
+        self.lagging = False
+        self.reset = False
+        if last_token is not None:
+            sequence = hub.sequence_of(last_token)
+            if sequence is None or hub.events_after(sequence) is None:
+                self.reset = True
+            else:
+                self.delivered = sequence
+                self.lagging = True
+
+    def offer(self, event: Dict[str, Any]):
+        if self.lagging or event["collection"] not in self.collections:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Never block the publisher: stop queueing and catch up from the buffer once drained
+            self.lagging = True
+            lagging_total.inc(("overflow",))
+
+    async def next(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Next event, a {"reset": token} marker, or None after ``timeout`` seconds without events"""
+        while True:
+            if self.reset:
+                self.reset = False
+                self.delivered = self.hub._sequence
+                return {"reset": self.hub.latest_token}
+            if self.lagging and self.queue.empty():
+                self._catch_up()
+                continue
+            try:
+                event = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    return None
+            if event["sequence"] <= self.delivered:
+                continue
+            self.delivered = event["sequence"]
+            return event
+
+    def _catch_up(self):
+        self.lagging = False
+        missed = self.hub.events_after(self.delivered)
+        if missed is None:
+            self.reset = True
+            lagging_total.inc(("reset",))
+            return
+        for event in missed:
+            if event["collection"] not in self.collections:
+                continue
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Still more than a queue behind: deliver what fits and come back for the rest
+                self.lagging = True
+                return
+
+
+hub = ChangeHub()
+_source = "inprocess"
+_watcher: Optional[asyncio.Task] = None
+_listeners: List[Callable[[str, str, str], None]] = []
+
+
+async def configure(db, backend: str, source: str = CHANGE_FEED_SOURCE) -> str:
+    """Pick the event source; "auto" uses change streams when MongoDB runs as a replica set"""
+    global _source, _watcher
+    if source == "auto":
+        source = "inprocess"
+        if backend == "mongodb":
+            try:
+                hello = await db.command("hello")
+                if hello.get("setName") or hello.get("msg") == "isdbgrid":
+                    source = "changestream"
+            except Exception as e:
+                logger.warning(f"Could not detect MongoDB topology, using the in-process change feed: {e}")
+    if source == "changestream" and _watcher is None:
+        _watcher = asyncio.create_task(_watch(db))
+    _source = source
+    logger.info(f"Change feed source: {source}")
+    return source
+
+
+async def stop():
+    """Close the shared change stream"""
+    global _watcher
+    if _watcher is not None:
+        _watcher.cancel()
+        try:
+            await _watcher
+        except asyncio.CancelledError:
+            pass
+        _watcher = None
+
+
+def add_listener(listener: Callable[[str, str, str], None]):
+    """Call listener(collection, operation, document_id) for every write published by this process"""
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def publish(collection: str, operation: str, document_id: str, changed_fields: Iterable[str] = ()):
+    """Announce a write made by this process (the change stream source reports it instead)"""
+    if _source != "changestream":
+        hub.publish(collection, operation, document_id, changed_fields)
+    for listener in _listeners:
+        listener(collection, operation, document_id)
+
+
+def encode_resume_token(token: Dict[str, Any]) -> str:
+    return "cs-" + base64.urlsafe_b64encode(json_util.dumps(token).encode()).decode()
+
+
+def _sse(event: Dict[str, Any]) -> str:
+    if "reset" in event:
+        return f"id: {event['reset']}\nevent: reset\ndata: {{}}\n\n"
+    payload = {key: value for key, value in event.items() if key != "sequence"}
+    return f"id: {event['token']}\nevent: change\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+async def _hub_stream(collections: List[str], last_token: Optional[str],
+                            heartbeat: float) -> AsyncIterator[str]:
+    subscription = hub.subscribe(collections, last_token)
+    try:
+        yield f"retry: 3000\nid: {last_token or hub.latest_token}\n\n"
+        while True:
+            event = await subscription.next(heartbeat)
+            yield ": keepalive\n\n" if event is None else _sse(event)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def _change_event(change: Dict[str, Any]) -> Dict[str, Any]:
+    document = change.get("fullDocument") or change.get("fullDocumentBeforeChange") or {}
+    description = change.get("updateDescription") or {}
+    fields = list(description.get("updatedFields") or {}) + list(description.get("removedFields") or [])
+    if change["operationType"] == "replace":
+        fields = [key for key in document if key != "_id"]
+    return _event(change["ns"]["coll"], CHANGE_STREAM_OPERATIONS[change["operationType"]],
+                  document.get("id") or str(change["documentKey"]["_id"]), fields,
+                  token=encode_resume_token(change["_id"]))
+
+
+async def _watch(db):
+    """Feed the hub from one change stream over every feed collection, reopening it after errors"""
+    pipeline = [
+        {"$match": {"ns.coll": {"$in": list(FEED_COLLECTIONS)},
+                    "operationType": {"$in": list(CHANGE_STREAM_OPERATIONS)}}},
+        # Only the id of the documents is needed, not the whole post/pre-image
+        {"$project": {"fullDocument": {"id": 1}, "fullDocumentBeforeChange": {"id": 1},
+                      "ns": 1, "documentKey": 1, "operationType": 1, "updateDescription": 1}},
+    ]
+    resume_after = None
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup", full_document_before_change="whenAvailable",
+                                resume_after=resume_after) as stream:
+                async for change in stream:
+                    resume_after = change["_id"]
+                    event = _change_event(change)
+                    hub.publish(event["collection"], event["operation"], event["id"], event["changed_fields"],
+                                token=event["token"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Change stream interrupted, reopening in {CHANGE_STREAM_RETRY}s: {e}")
+            await asyncio.sleep(CHANGE_STREAM_RETRY)
+
+
+def event_stream(db, collections: Optional[Iterable[str]] = None, last_token: Optional[str] = None,
+                 heartbeat: float = CHANGE_FEED_HEARTBEAT) -> AsyncIterator[str]:
+    """SSE-formatted event stream for one connection"""
+    collections = [c for c in (collections or FEED_COLLECTIONS) if c in FEED_COLLECTIONS]
+    return _hub_stream(collections, last_token, heartbeat)
@@ -0,0 +1,62 @@
+"""
+Datetime codec
+Timestamps are stored as native dates: BSON dates in MongoDB and the memory
+engine, Timestamp values in Firestore. Values read back are normalized to
+timezone-aware UTC datetimes, and ISO strings written before the migration
+(migrate_datetimes.py) are still understood wherever timestamps are read or
+compared. Documents embedded in compressed blobs (history archives, inventory
+snapshots) use Extended JSON so their dates survive the round trip.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable
+
+from bson import json_util
+from bson.json_util import JSONMode, JSONOptions
+
+# Document fields holding timestamps, in every collection
+TIMESTAMP_FIELDS = ("created_at", "updated_at", "timestamp", "deleted_at", "taken_at")
+
+JSON_OPTIONS = JSONOptions(json_mode=JSONMode.RELAXED, tz_aware=True, tzinfo=timezone.utc)
+
+
+def to_utc(value: Any) -> Any:
+    """Aware UTC datetime for a datetime or an ISO string; other values are returned unchanged"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+    return value
+
+
+def decode(document: Dict[str, Any], fields: Iterable[str] = TIMESTAMP_FIELDS) -> Dict[str, Any]:
+    """Normalize the timestamp fields of a document read from storage (in place)"""
+    for field in fields:
+        if document.get(field) is not None:
+            document[field] = to_utc(document[field])
+    return document
+
+
+def encode_firestore(value: Any) -> Any:
+    """Firestore stores datetimes as Timestamps (UTC); nested documents are walked"""
+    if isinstance(value, dict):
+        return {key: encode_firestore(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [encode_firestore(item) for item in value]
+    if isinstance(value, datetime):
+        return to_utc(value)
+    return value
+
+
+def dumps(value: Any, **kwargs) -> str:
+    """Extended JSON keeping datetimes as {"$date": ...}"""
+    return json_util.dumps(value, json_options=JSON_OPTIONS, **kwargs)
+
+
+def loads(text) -> Any:
+    """Parse Extended JSON (plain JSON written by older versions parses unchanged)"""
+    return json_util.loads(text, json_options=JSON_OPTIONS)
@@ -0,0 +1,130 @@
+"""
+Database operation events shared by every storage backend
+MongoDB reports through a pymongo CommandListener, Firestore and the
+in-memory engine report through the same publish() hook
+"""
+from typing import Any, Callable, Dict, List, Optional
+import functools
+import threading
+import time
+
+from pymongo import monitoring
+
+# Callables invoked as listener(collection, operation, duration, succeeded, command)
+# where duration is in seconds and command is the query filter (or aggregation
+# pipeline) the operation ran with, when known
+_listeners: List[Callable[..., None]] = []
+
+
+def add_listener(listener: Callable[..., None]):
+    """Subscribe to database operation events"""
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[..., None]):
+    """Unsubscribe from database operation events"""
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def publish(collection: str, operation: str, duration: float, succeeded: bool = True,
+            command: Optional[Dict[str, Any]] = None):
+    """Notify listeners about a finished database operation"""
+    for listener in _listeners:
+        listener(collection, operation, duration, succeeded, command)
+
+
+def instrumented(operation: str, command_arg=0):
+    """Decorator timing an async storage method and publishing it as an operation
+
+    The wrapped object must expose the collection name as ``collection_name``.
+    ``command_arg`` is the position of the filter argument, the name of an
+    attribute holding it, or None to report none.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            if not _listeners:
+                return await func(self, *args, **kwargs)
+            started = time.perf_counter()
+            succeeded = False
+            try:
+                result = await func(self, *args, **kwargs)
+                succeeded = True
+                return result
+            finally:
+                command = None
+                if isinstance(command_arg, str):
+                    command = getattr(self, command_arg, None)
+                elif command_arg is not None and len(args) > command_arg:
+                    command = args[command_arg]
+                publish(self.collection_name, operation, time.perf_counter() - started, succeeded, command)
+        return wrapper
+    return decorator
+
+
+# Commands whose first field is not the collection they act on
+_UNSCOPED_COMMANDS = {"ping", "hello", "ismaster", "isMaster", "endSessions", "listCollections",
+                      "listDatabases", "buildInfo", "serverStatus", "killCursors"}
+
+
+def _command_filter(name: str, command: Dict[str, Any]):
+    """Extract the filter (or aggregation pipeline) a command runs with"""
+    if name == "find":
+        return command.get("filter", {})
+    if name == "aggregate":
+        return command.get("pipeline")
+    if name in ("distinct", "findAndModify", "count"):
+        return command.get("query", {})
+    if name in ("update", "delete"):
+        statements = command.get("updates" if name == "update" else "deletes") or []
+        if len(statements) == 1:
+            return statements[0].get("q", {})
+    return None
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Translate pymongo command events into database operation events
+
+    Motor runs commands on worker threads, so started events are kept per
+    (connection, request id) under a lock until the matching reply arrives.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Any, tuple] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _describe(event) -> tuple:
+        command = event.command
+        name = event.command_name
+        if name == "getMore":
+            collection = command.get("collection", "")
+        elif name in _UNSCOPED_COMMANDS:
+            collection = ""
+        else:
+            collection = command.get(name, "")
+        if not isinstance(collection, str):
+            collection = ""
+        return collection, _command_filter(name, command)
+
+    def started(self, event):
+        if not _listeners:
+            return
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = self._describe(event)
+
+    def _finish(self, event, succeeded: bool):
+        with self._lock:
+            described = self._pending.pop((event.connection_id, event.request_id), None)
+        if described is None:
+            return
+        collection, command = described
+        publish(collection, event.command_name, event.duration_micros / 1e6, succeeded, command)
+
+    def succeeded(self, event):
+        self._finish(event, True)
+
+    def failed(self, event):
+        self._finish(event, False)
@@ -0,0 +1,67 @@
+"""
+Fast-path JSON for list endpoints
+With response_model, FastAPI validates every returned dict into the model
+and serializes the models again, which dominates CPU for lists of 1000+
+rows. Documents read from the database are trusted output, so list endpoints
+project the model's fields in the query, fill the defaults of fields older
+documents lack, and encode the dicts directly with pydantic-core's JSON
+serializer. Dates come out in the same format as through response_model.
+The response_model stays on the route for the OpenAPI schema only.
+"""
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Type
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic_core import PydanticUndefined, to_json
+
+MAX_CACHED_SUBSETS = 256
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered by pydantic-core (datetimes, UUIDs and bytes included)"""
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+class RowShape:
+    """Precomputed projection and defaults of a response model"""
+
+    def __init__(self, model: Type[BaseModel], exclude: Iterable[str] = (), include: Optional[Iterable[str]] = None):
+        excluded = set(exclude)
+        included = set(include) if include is not None else set(model.model_fields)
+        self.model = model
+        self.fields = [name for name in model.model_fields if name in included and name not in excluded]
+        self.projection: Dict[str, int] = {"_id": 0, **{name: 1 for name in self.fields}}
+        self._defaults = {
+            name: info for name, info in model.model_fields.items()
+            if name in self.fields and (info.default is not PydanticUndefined or info.default_factory is not None)
+        }
+        self._subsets: Dict[FrozenSet[str], "RowShape"] = {}
+
+    def subset(self, fields: Iterable[str]) -> "RowShape":
+        """Shape restricted to some of the fields (sparse fieldsets), cached per field set"""
+        key = frozenset(fields)
+        shape = self._subsets.get(key)
+        if shape is None:
+            shape = RowShape(self.model, include=key)
+            if len(self._subsets) < MAX_CACHED_SUBSETS:
+                self._subsets[key] = shape
+        return shape
+
+    def project(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The projection applied in Python, for documents that were not read with it"""
+        return [{name: document[name] for name in self.fields if name in document} for document in documents]
+
+    def conform(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Add defaults for missing fields (rows read with ``projection`` have no extra fields)"""
+        size = len(self.fields)
+        for document in documents:
+            if len(document) < size:
+                for name, info in self._defaults.items():
+                    if name not in document:
+                        document[name] = info.get_default(call_default_factory=True)
+        return documents
+
+    def response(self, documents: List[Dict[str, Any]]) -> FastJSONResponse:
+        return FastJSONResponse(self.conform(documents))
@@ -7,6 +7,84 @@ from typing import List, Dict, Any, Optional
 import os
 from datetime import datetime
 
+import datetime_codec
+from db_monitoring import instrumented
+
+
+def _parse_projection(projection: Optional[Dict]):
+    """Split a MongoDB-style projection into a Firestore field mask.
+
+    Returns a tuple ``(fields, excluded, include_id)``. ``fields`` is the list
+    of field paths for ``select()`` (``None`` when the whole document is
+    needed), ``excluded`` holds field paths to drop after the read and
+    ``include_id`` tells whether ``_id`` should be added to the result.
+    """
+    if not projection:
+        return None, set(), True
+
+    include_id = bool(projection.get('_id', 1))
+    included = [k for k, v in projection.items() if k != '_id' and v]
+    excluded = {k for k, v in projection.items() if k != '_id' and not v}
+
+    if included and excluded:
+        raise ValueError("Cannot mix inclusion and exclusion in a projection")
+
+    # Firestore field masks only support inclusion, so exclusions are
+    # stripped from the snapshot once it has been read.
+    return (included or None), excluded, include_id
+
+
+def _remove_path(data: Dict[str, Any], path: str):
+    """Remove a dotted field path from a document in place"""
+    parts = path.split('.')
+    for part in parts[:-1]:
+        data = data.get(part)
+        if not isinstance(data, dict):
+            return
+    data.pop(parts[-1], None)
+
+
+def _keep_paths(data: Dict[str, Any], paths: List[str]) -> Dict[str, Any]:
+    """Return a copy of a document restricted to the given dotted field paths"""
+    result = {}
+    for path in paths:
+        parts = path.split('.')
+        source, target = data, result
+        for part in parts[:-1]:
+            source = source.get(part) if isinstance(source, dict) else None
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(part, {})
+        else:
+            if isinstance(source, dict) and parts[-1] in source:
+                target[parts[-1]] = source[parts[-1]]
+    return result
+
+
+def _query_fields(query: Dict[str, Any]) -> List[str]:
+    """Collect the field paths referenced by a query, including inside $or"""
+    fields = []
+    for key, value in query.items():
+        if key == '$or':
+            for condition in value:
+                fields.extend(_query_fields(condition))
+        elif not key.startswith('$'):
+            fields.append(key)
+    return fields
+
+
+def _project_document(data: Dict[str, Any], doc_id: str, fields: Optional[List[str]],
+                      excluded, include_id: bool) -> Dict[str, Any]:
+    """Apply a parsed projection to a document read from Firestore"""
+    if fields is not None:
+        data = _keep_paths(data, fields)
+    for path in excluded:
+        _remove_path(data, path)
+    if include_id:
+        data['_id'] = doc_id
+    return data
+
+
 class FirestoreDB:
     """Firestore database wrapper with MongoDB-like interface"""
     
@@ -18,6 +96,12 @@ class FirestoreDB:
         """Get collection reference"""
         return FirestoreCollection(self.db.collection(collection_name))
 
+    def __getattr__(self, collection_name: str):
+        """Allow db.<collection> access like a Motor database"""
+        if collection_name.startswith('_'):
+            raise AttributeError(collection_name)
+        return self.collection(collection_name)
+
 
 class FirestoreCollection:
     """Collection wrapper with MongoDB-like methods"""
@@ -25,29 +109,36 @@ class FirestoreCollection:
     def __init__(self, collection_ref):
         self.collection_ref = collection_ref
     
+    @property
+    def collection_name(self) -> str:
+        return self.collection_ref.id
+    
+    @instrumented("find")
     async def find_one(self, query: Dict[str, Any], projection: Optional[Dict] = None) -> Optional[Dict]:
         """Find single document"""
         try:
+            fields, excluded, include_id = _parse_projection(projection)
             # Handle simple queries
             if len(query) == 1:
                 key, value = list(query.items())[0]
-                docs = self.collection_ref.where(key, '==', value).limit(1).stream()
+                query_ref = self.collection_ref.where(key, '==', value)
+                if fields is not None:
+                    query_ref = query_ref.select(fields)
+                docs = query_ref.limit(1).stream()
                 for doc in docs:
-                    data = doc.to_dict()
-                    data['_id'] = doc.id
-                    return data
+                    return _project_document(doc.to_dict() or {}, doc.id, fields, excluded, include_id)
             return None
         except Exception as e:
             print(f"Firestore find_one error: {e}")
             return None
     
-    async def find(self, query: Dict[str, Any] = None, projection: Optional[Dict] = None):
+    def find(self, query: Dict[str, Any] = None, projection: Optional[Dict] = None):
         """Find multiple documents"""
-        return FirestoreCursor(self.collection_ref, query or {})
+        return FirestoreCursor(self.collection_ref, query or {}, projection)
     
+    @instrumented("insert", None)
     async def insert_one(self, document: Dict[str, Any]) -> Any:
         """Insert single document"""
-        # Convert datetime objects to strings
         doc = self._serialize_document(document)
         doc_id = doc.get('id', None)
         
@@ -57,6 +148,7 @@ class FirestoreCollection:
             self.collection_ref.add(doc)
         return type('Result', (), {'inserted_id': doc_id})()
     
+    @instrumented("update")
     async def update_one(self, query: Dict[str, Any], update: Dict[str, Any]) -> Any:
         """Update single document"""
         if len(query) == 1:
@@ -71,6 +163,45 @@ class FirestoreCollection:
         
         return type('Result', (), {'modified_count': 0})()
     
+    @instrumented("findAndModify")
+    async def find_one_and_update(self, query: Dict[str, Any], update: Dict[str, Any],
+                                  projection: Optional[Dict] = None, return_document: bool = False) -> Optional[Dict]:
+        """Atomically apply $set/$inc to the first matching document in a transaction
+
+        Returns the document before the update, or after it when
+        return_document is true (pymongo's ReturnDocument.AFTER).
+        """
+        fields, excluded, include_id = _parse_projection(projection)
+        equality = [(k, v) for k, v in query.items() if not k.startswith('$') and not isinstance(v, dict)]
+        if not equality:
+            return None
+        key, value = equality[0]
+
+        @firestore.transactional
+        def apply(transaction):
+            if key == 'id':
+                snapshots = [self.collection_ref.document(value).get(transaction=transaction)]
+            else:
+                snapshots = list(self.collection_ref.where(key, '==', value).stream(transaction=transaction))
+            for snapshot in snapshots:
+                before = snapshot.to_dict() if snapshot.exists else None
+                if before is None or not all(_match_field(before.get(k), v) for k, v in query.items()):
+                    continue
+                after = dict(before)
+                after.update(self._serialize_document(update.get('$set', {})))
+                for path, amount in update.get('$inc', {}).items():
+                    after[path] = (after.get(path) or 0) + amount
+                transaction.set(snapshot.reference, after)
+                return snapshot.id, after if return_document else before
+            return None
+
+        result = apply(self.collection_ref._client.transaction())
+        if result is None:
+            return None
+        doc_id, data = result
+        return _project_document(data, doc_id, fields, excluded, include_id)
+
+    @instrumented("delete")
     async def delete_one(self, query: Dict[str, Any]) -> Any:
         """Delete single document"""
         if len(query) == 1:
@@ -83,6 +214,7 @@ class FirestoreCollection:
         
         return type('Result', (), {'deleted_count': 0})()
     
+    @instrumented("aggregate")
     async def count_documents(self, query: Dict[str, Any] = None) -> int:
         """Count documents matching query"""
         try:
@@ -101,6 +233,7 @@ class FirestoreCollection:
             print(f"Firestore count error: {e}")
             return 0
     
+    @instrumented("distinct", None)
     async def distinct(self, field: str) -> List[Any]:
         """Get distinct values for a field"""
         try:
@@ -116,64 +249,105 @@ class FirestoreCollection:
             return []
     
     def _serialize_document(self, doc: Dict[str, Any]) -> Dict[str, Any]:
-        """Convert datetime objects to ISO strings for Firestore"""
-        serialized = {}
-        for key, value in doc.items():
-            if isinstance(value, datetime):
-                serialized[key] = value.isoformat()
-            elif isinstance(value, dict):
-                serialized[key] = self._serialize_document(value)
-            else:
-                serialized[key] = value
-        return serialized
+        """Prepare a document for Firestore (datetimes are kept as native UTC Timestamps)"""
+        return datetime_codec.encode_firestore(doc)
 
 
 class FirestoreCursor:
     """Cursor wrapper for query results"""
     
-    def __init__(self, collection_ref, query: Dict[str, Any]):
+    def __init__(self, collection_ref, query: Dict[str, Any], projection: Optional[Dict] = None):
         self.collection_ref = collection_ref
         self.query = query
+        self.projection = projection
         self._limit = None
+        self._skip = 0
+        self._sort: List[tuple] = []
+    
+    @property
+    def collection_name(self) -> str:
+        return self.collection_ref.id
     
     def limit(self, count: int):
         """Limit results"""
         self._limit = count
         return self
     
+    def skip(self, count: int):
+        """Skip the first results"""
+        self._skip = count
+        return self
+    
+    def sort(self, key_or_list, direction: int = 1):
+        """Sort results (pymongo-style key or list of (key, direction))"""
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction)]
+        self._sort = list(key_or_list)
+        return self
+    
+    def _sort_results(self, results: List[Dict]) -> List[Dict]:
+        # Stable sorts applied from the last key to the first
+        for key, direction in reversed(self._sort):
+            results.sort(key=lambda doc: (doc.get(key) is not None, doc.get(key)), reverse=direction < 0)
+        return results
+    
+    @instrumented("find", "query")
     async def to_list(self, length: int) -> List[Dict]:
         """Convert to list"""
         try:
             results = []
+            fields, excluded, include_id = _parse_projection(self.projection)
+            mask = fields
             
             # Build query
+            pushed_down = True
             if len(self.query) == 0:
                 query_ref = self.collection_ref
-            elif len(self.query) == 1 and '$or' not in self.query:
+            elif len(self.query) == 1 and '$or' not in self.query and not isinstance(list(self.query.values())[0], dict):
                 key, value = list(self.query.items())[0]
                 query_ref = self.collection_ref.where(key, '==', value)
             else:
+                pushed_down = False
                 # For complex queries, fetch all and filter in memory
                 query_ref = self.collection_ref
+                if mask is not None:
+                    # The in-memory filter needs the queried fields too
+                    mask = list(dict.fromkeys(mask + _query_fields(self.query)))
             
-            # Apply limit
-            if self._limit:
-                query_ref = query_ref.limit(self._limit)
-            else:
-                query_ref = query_ref.limit(length)
+            # Apply field mask
+            if mask is not None:
+                query_ref = query_ref.select(mask)
+            
+            # Sorting is pushed down only when the whole filter was (needs a composite index)
+            if self._sort and pushed_down:
+                for key, direction in self._sort:
+                    query_ref = query_ref.order_by(
+                        key, direction=firestore.Query.DESCENDING if direction < 0 else firestore.Query.ASCENDING)
+            
+            # Apply offset and limit (sorted in-memory filters need every candidate first)
+            in_memory_page = not pushed_down and (self._sort or self._skip)
+            if self._skip and not in_memory_page:
+                query_ref = query_ref.offset(self._skip)
+            if not in_memory_page and (self._limit or length):
+                query_ref = query_ref.limit(self._limit or length)
             
             # Execute query
             docs = query_ref.stream()
             
             for doc in docs:
-                data = doc.to_dict()
-                data['_id'] = doc.id
+                data = doc.to_dict() or {}
                 
                 # Apply complex filters if needed
                 if self._matches_query(data, self.query):
-                    results.append(data)
+                    results.append(_project_document(data, doc.id, fields, excluded, include_id))
             
-            return results[:length]
+            if in_memory_page:
+                if self._sort:
+                    results = self._sort_results(results)
+                results = results[self._skip:]
+                if self._limit:
+                    results = results[:self._limit]
+            return results[:length] if length else results
         except Exception as e:
             print(f"Firestore to_list error: {e}")
             return []
@@ -185,14 +359,43 @@ class FirestoreCursor:
         
         # Handle $or queries
         if '$or' in query:
-            for condition in query['$or']:
-                if all(doc.get(k, '').lower().find(v.get('$regex', '').lower()) >= 0 
-                       for k, v in condition.items() if isinstance(v, dict) and '$regex' in v):
-                    return True
-            return False
+            if not any(self._matches_query(doc, condition) for condition in query['$or']):
+                return False
         
-        # Simple equality check
-        return all(doc.get(k) == v for k, v in query.items())
+        return all(_match_field(doc.get(k), v) for k, v in query.items() if k != '$or')
+
+
+def _match_field(value: Any, condition: Any) -> bool:
+    """Evaluate equality, comparison and $regex conditions on a single field"""
+    if isinstance(value, str) and (isinstance(condition, datetime) or isinstance(condition, dict) and any(
+            isinstance(operand, datetime) for operand in condition.values())):
+        # Timestamps written as ISO strings before the datetime migration
+        value = datetime_codec.to_utc(value)
+    if not isinstance(condition, dict) or not any(str(k).startswith('$') for k in condition):
+        return value == condition
+    for operator, operand in condition.items():
+        if operator == '$regex':
+            if (value or '').lower().find(operand.lower()) < 0:
+                return False
+        elif operator == '$options':
+            continue
+        elif operator == '$ne':
+            if value == operand:
+                return False
+        elif operator == '$in':
+            if value not in operand:
+                return False
+        elif value is None:
+            return False
+        elif operator == '$lt' and not value < operand:
+            return False
+        elif operator == '$lte' and not value <= operand:
+            return False
+        elif operator == '$gt' and not value > operand:
+            return False
+        elif operator == '$gte' and not value >= operand:
+            return False
+    return True
 
 
 def get_database():
@@ -206,6 +409,6 @@ def get_database():
         # Return MongoDB client (existing implementation)
         from motor.motor_asyncio import AsyncIOMotorClient
         mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-        client = AsyncIOMotorClient(mongo_url)
+        client = AsyncIOMotorClient(mongo_url, tz_aware=True)
         db_name = os.environ.get('DB_NAME', 'test_database')
         return client[db_name]
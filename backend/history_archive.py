@@ -0,0 +1,258 @@
+"""
+Cold storage for old equipment history
+History entries older than HISTORY_ARCHIVE_AFTER_DAYS are moved into
+zlib-compressed segments in the history_archive collection, one segment per
+run of up to ARCHIVE_SEGMENT_SIZE entries of the same equipment. Segments
+only index their equipment and time range (a sparse index), which is enough
+to page into them from the history endpoint and to replay them for as-of
+queries.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+import asyncio
+import json
+import logging
+import os
+import uuid
+import zlib
+
+import datetime_codec
+from history_store import apply_entry, flush_pending, reconstruct
+
+logger = logging.getLogger(__name__)
+
+HISTORY_ARCHIVE_AFTER_DAYS = float(os.environ.get("HISTORY_ARCHIVE_AFTER_DAYS", "1095"))
+ARCHIVE_SEGMENT_SIZE = 200
+ARCHIVE_INDEXES = ([("equipment_id", 1), ("last_timestamp", -1)], [("last_timestamp", 1)])
+
+
+def _encode(entries: List[Dict[str, Any]]) -> bytes:
+    return zlib.compress(datetime_codec.dumps(entries, separators=(",", ":")).encode(), 9)
+
+
+def _decode(data: bytes) -> List[Dict[str, Any]]:
+    # Segments written before the datetime migration hold ISO string timestamps
+    return [datetime_codec.decode(entry) for entry in datetime_codec.loads(zlib.decompress(bytes(data)))]
+
+
+def _size(entry: Dict[str, Any]) -> int:
+    return len(datetime_codec.dumps(entry, separators=(",", ":")))
+
+
+def _order(entry: Dict[str, Any]) -> tuple:
+    return entry["timestamp"], entry["id"]
+
+
+def _utc_order(entry: Dict[str, Any]) -> tuple:
+    return datetime_codec.to_utc(entry["timestamp"]), entry["id"]
+
+
+async def _archived_upto(db, equipment_id: str) -> Optional[tuple]:
+    """Order key of the newest archived entry of an equipment (None when nothing is archived)
+
+    Archival always moves the oldest entries, so everything up to this key is archived.
+    """
+    segments = await db.history_archive.find({"equipment_id": equipment_id}, {"_id": 0}).sort(
+        "last_timestamp", -1).limit(1).to_list(1)
+    if not segments:
+        return None
+    return max(_utc_order(entry) for entry in _decode(segments[0]["data"]))
+
+
+async def _keep_replayable(db, equipment_id: str, first_kept: Dict[str, Any]):
+    """Turn the oldest entry left in the hot collection into a checkpoint
+
+    Its diff would otherwise depend on entries that are about to be archived.
+    """
+    if first_kept.get("checkpoint") or first_kept.get("version") is None or first_kept.get("action") == "deleted":
+        return
+    rebuilt = await reconstruct(db, equipment_id, version=first_kept["version"])
+    if rebuilt and rebuilt["document"] is not None:
+        await db.history.update_one({"id": first_kept["id"]},
+                                    {"$set": {"checkpoint": True, "snapshot": rebuilt["document"]}})
+
+
+async def archive_history(db, older_than_days: float = HISTORY_ARCHIVE_AFTER_DAYS,
+                          segment_size: int = ARCHIVE_SEGMENT_SIZE) -> Dict[str, int]:
+    """Move history older than the cutoff into compressed archive segments
+
+    The newest entry of every equipment always stays in the hot collection.
+    Returns counts and the (uncompressed JSON) bytes removed versus stored.
+    """
+    await flush_pending()
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    report = {"equipment": 0, "entries": 0, "segments": 0, "bytes_before": 0, "bytes_after": 0}
+    equipment_ids = await db.history.distinct("equipment_id", {"timestamp": {"$lt": cutoff}})
+    for equipment_id in equipment_ids:
+        entries = await db.history.find({"equipment_id": equipment_id}, {"_id": 0}).sort(
+            [("timestamp", 1), ("id", 1)]).to_list(None)
+        old = [entry for entry in entries[:-1] if datetime_codec.to_utc(entry["timestamp"]) < cutoff]
+        if not old:
+            continue
+        await _keep_replayable(db, equipment_id, entries[len(old)])
+
+        # A run that stopped between writing segments and deleting entries left them in both places
+        archived_upto = await _archived_upto(db, equipment_id)
+        if archived_upto is not None:
+            stored = [entry["id"] for entry in old if _utc_order(entry) <= archived_upto]
+            if stored:
+                await db.history.delete_many({"id": {"$in": stored}})
+            old = [entry for entry in old if _utc_order(entry) > archived_upto]
+            if not old:
+                continue
+
+        segments = []
+        for start in range(0, len(old), segment_size):
+            chunk = old[start:start + segment_size]
+            data = _encode(chunk)
+            segments.append({
+                "id": str(uuid.uuid4()),
+                "equipment_id": equipment_id,
+                "first_timestamp": chunk[0]["timestamp"],
+                "last_timestamp": chunk[-1]["timestamp"],
+                "first_version": chunk[0].get("version"),
+                "last_version": chunk[-1].get("version"),
+                "count": len(chunk),
+                "data": data,
+            })
+            report["bytes_before"] += sum(_size(entry) for entry in chunk)
+            report["bytes_after"] += len(data)
+        # Segments are written before the entries are removed, so a crash leaves duplicates, never gaps
+        await db.history_archive.insert_many(segments)
+        await db.history.delete_many({"id": {"$in": [entry["id"] for entry in old]}})
+
+        report["equipment"] += 1
+        report["entries"] += len(old)
+        report["segments"] += len(segments)
+    report["bytes_reclaimed"] = report["bytes_before"] - report["bytes_after"]
+    return report
+
+
+async def iter_archived(db, equipment_id: str, before: Optional[datetime] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Archived entries of an equipment, newest first, optionally only up to a timestamp"""
+    query: Dict[str, Any] = {"equipment_id": equipment_id}
+    if before is not None:
+        query["first_timestamp"] = {"$lte": before}
+    segments = await db.history_archive.find(query, {"_id": 0, "data": 0}).sort("last_timestamp", -1).to_list(None)
+    for segment in segments:
+        stored = await db.history_archive.find_one({"id": segment["id"]}, {"_id": 0, "data": 1})
+        for entry in sorted(_decode(stored["data"]), key=_order, reverse=True):
+            yield entry
+
+
+async def page_archived(db, equipment_id: str, count: int, predicate: Callable[[Dict[str, Any]], bool],
+                        before: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Up to ``count`` archived entries matching predicate, newest first"""
+    page = []
+    async for entry in iter_archived(db, equipment_id, before):
+        if predicate(entry):
+            page.append(entry)
+            if len(page) >= count:
+                break
+    return page
+
+
+async def archived_in_range(db, since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Archived entries of every equipment with since <= timestamp <= until (None is unbounded)"""
+    query: Dict[str, Any] = {}
+    if until is not None:
+        query["first_timestamp"] = {"$lte": until}
+    if since is not None:
+        query["last_timestamp"] = {"$gte": since}
+    segments = await db.history_archive.find(query, {"_id": 0}).to_list(None)
+    return [
+        entry
+        for segment in segments
+        for entry in _decode(segment["data"])
+        if (since is None or entry["timestamp"] >= since) and (until is None or entry["timestamp"] <= until)
+    ]
+
+
+async def iter_archived_range(db, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                              predicate: Optional[Callable[[Dict[str, Any]], bool]] = None
+                              ) -> AsyncIterator[Dict[str, Any]]:
+    """Archived entries of every equipment in [since, until] matching predicate, newest first
+
+    Segments are read in last_timestamp order and one is only decompressed
+    once it may hold the next entry, so a caller that stops early never
+    touches the older segments.
+    """
+    query: Dict[str, Any] = {}
+    if until is not None:
+        query["first_timestamp"] = {"$lte": until}
+    if since is not None:
+        query["last_timestamp"] = {"$gte": since}
+    segments = db.history_archive.find(query, {"_id": 0, "data": 0}).sort("last_timestamp", -1)
+    segment = await anext(segments, None)
+    # Decoded entries not yet yielded, oldest first
+    pending: List[Dict[str, Any]] = []
+    while segment is not None or pending:
+        while segment is not None and (not pending or segment["last_timestamp"] >= pending[-1]["timestamp"]):
+            stored = await db.history_archive.find_one({"id": segment["id"]}, {"_id": 0, "data": 1})
+            pending.extend(
+                entry for entry in _decode(stored["data"])
+                if (since is None or entry["timestamp"] >= since) and (until is None or entry["timestamp"] <= until)
+                and (predicate is None or predicate(entry)))
+            pending.sort(key=_order)
+            segment = await anext(segments, None)
+        if pending:
+            yield pending.pop()
+
+
+async def reconstruct_archived(db, equipment_id: str, version: int) -> Optional[Dict[str, Any]]:
+    """Rebuild a version moved to the archive, like history_store.reconstruct does for the hot collection
+
+    Segments are read newest first until a checkpoint at or before the version is found.
+    """
+    segments = db.history_archive.find(
+        {"equipment_id": equipment_id, "first_version": {"$lte": version}}, {"_id": 0}).sort("last_timestamp", -1)
+    entries: List[Dict[str, Any]] = []
+    async for segment in segments:
+        entries.extend(entry for entry in _decode(segment["data"])
+                       if entry.get("version") is not None and entry["version"] <= version)
+        if any(entry.get("checkpoint") for entry in entries):
+            break
+    entries.sort(key=lambda entry: entry["version"])
+    if not entries or entries[-1]["version"] != version:
+        return None
+    start = max((i for i, entry in enumerate(entries) if entry.get("checkpoint")), default=0)
+    state = None
+    for entry in entries[start:]:
+        state = apply_entry(state, entry)
+    return {
+        "version": version,
+        "timestamp": entries[-1]["timestamp"],
+        "deleted": state is None,
+        "document": state,
+    }
+
+
+async def archived_between(db, after: Optional[datetime], until: datetime) -> List[Dict[str, Any]]:
+    """Archived entries of every equipment with after < timestamp <= until"""
+    entries = await archived_in_range(db, after, until)
+    return [entry for entry in entries if after is None or entry["timestamp"] > after]
+
+
+async def _main():
+    import argparse
+    from dotenv import load_dotenv
+    from pathlib import Path
+    from storage import get_database
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Move old history entries into compressed archive segments")
+    parser.add_argument("--older-than-days", type=float, default=HISTORY_ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--segment-size", type=int, default=ARCHIVE_SEGMENT_SIZE)
+    args = parser.parse_args()
+
+    db = get_database()
+    for keys in ARCHIVE_INDEXES:
+        await db.history_archive.create_index(keys)
+    report = await archive_history(db, args.older_than_days, args.segment_size)
+    logger.info(f"History archival finished: {report}")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
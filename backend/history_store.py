@@ -0,0 +1,257 @@
+"""
+Diff-based equipment history
+Each history entry stores only the fields an action changed (old_values /
+new_values) and a per-equipment version number. "created" entries hold the
+full document and every HISTORY_CHECKPOINT_INTERVAL versions an entry also
+carries a full snapshot, so any version is rebuilt from the closest
+checkpoint plus a bounded number of diffs.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+HISTORY_CHECKPOINT_INTERVAL = int(os.environ.get("HISTORY_CHECKPOINT_INTERVAL", "20"))
+HISTORY_VERSION_INDEX = [("equipment_id", 1), ("version", -1)]
+HISTORY_ORDER = [("timestamp", 1), ("id", 1)]
+
+# Write-behind queue (history_writer.HistoryWriter) used instead of direct inserts when set
+_writer = None
+
+
+def set_writer(writer):
+    global _writer
+    _writer = writer
+
+
+async def flush_pending():
+    """Write queued history entries so reads see every recorded change
+
+    The depth counts entries of a flush in progress too: flush() waits for
+    it on the writer's lock before writing what is left.
+    """
+    if _writer is not None and _writer.depth:
+        await _writer.flush()
+
+
+def compute_diff(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> Tuple[Dict, Dict]:
+    """Old and new values of the fields that differ between two document states"""
+    before = before or {}
+    after = after or {}
+    old_values, new_values = {}, {}
+    for key, value in after.items():
+        if key == "_id":
+            continue
+        if key not in before or before[key] != value:
+            if key in before:
+                old_values[key] = before[key]
+            new_values[key] = value
+    return old_values, new_values
+
+
+def apply_entry(state: Optional[Dict[str, Any]], entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Document state after a (diff-format) history entry"""
+    if entry.get("action") == "deleted":
+        return None
+    if entry.get("snapshot") is not None:
+        return dict(entry["snapshot"])
+    if entry.get("action") == "created" or state is None:
+        state = {}
+    state = dict(state)
+    state.update(entry.get("new_values") or {})
+    return state
+
+
+def _is_checkpoint(version: int) -> bool:
+    return version % HISTORY_CHECKPOINT_INTERVAL == 0
+
+
+async def _latest(db, query: Dict[str, Any], projection: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Highest-version history entry matching query (unversioned entries sort last)"""
+    entries = await db.history.find(query, projection).sort("version", -1).limit(1).to_list(1)
+    return entries[0] if entries else None
+
+
+def history_version(document: Dict[str, Any]) -> int:
+    """History version of the change that produced an equipment state
+
+    Equipment versions start at 0 and every update bumps them in the same
+    find-and-modify that writes it, so the history version (1 on creation)
+    is the equipment version plus one and never needs a history read.
+    """
+    return (document.get("version") or 0) + 1
+
+
+async def record_change(db, entry: Dict[str, Any], before: Optional[Dict[str, Any]],
+                        after: Optional[Dict[str, Any]], version: int) -> Dict[str, Any]:
+    """Fill a history entry with the diff between two states, version it and store it
+
+    ``entry`` is a serialized HistoryEntry; ``before``/``after`` are the full
+    equipment documents (None for creation/deletion) and ``version`` comes
+    from history_version(). With a writer set the entry is queued instead of
+    inserted.
+    """
+    # Documents written before versioning have no version field
+    legacy = before is not None and before.get("version") is None
+
+    old_values, new_values = compute_diff(before, after)
+    if entry["action"] == "created":
+        old_values, new_values = {}, dict(after or {})
+        new_values.pop("_id", None)
+    entry.update({
+        "old_values": old_values,
+        "new_values": new_values,
+        "changed_fields": sorted(new_values),
+        "version": version,
+        "checkpoint": entry["action"] == "created",
+        "snapshot": None,
+    })
+    # A checkpoint is also forced after pre-migration entries, which cannot be replayed
+    if after is not None and entry["action"] != "created" and (legacy or _is_checkpoint(version)):
+        entry["checkpoint"] = True
+        entry["snapshot"] = {k: v for k, v in after.items() if k != "_id"}
+    if _writer is not None:
+        _writer.enqueue(entry)
+    else:
+        await db.history.insert_one(entry)
+    return entry
+
+
+async def reconstruct(db, equipment_id: str, version: Optional[int] = None,
+                      at: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """Rebuild the equipment at a version (or as of a UTC datetime)
+
+    Returns {"version", "timestamp", "deleted", "document"} or None when the
+    equipment had no history at that point.
+    """
+    await flush_pending()
+    bound: Dict[str, Any] = {"equipment_id": equipment_id, "version": {"$ne": None}}
+    if version is not None:
+        bound["version"] = {"$lte": version}
+    if at is not None:
+        bound["timestamp"] = {"$lte": at}
+
+    target = await _latest(db, bound, {"_id": 0, "version": 1, "timestamp": 1})
+    if target is None or (version is not None and target["version"] != version):
+        return None
+
+    checkpoint = await _latest(db, {**bound, "version": {"$lte": target["version"]}, "checkpoint": True}, {"_id": 0})
+    start = checkpoint["version"] if checkpoint else 0
+    entries = await db.history.find(
+        {"equipment_id": equipment_id, "version": {"$gt": start, "$lte": target["version"]}},
+        {"_id": 0, "old_values": 0}).sort("version", 1).to_list(None)
+
+    state = apply_entry(None, checkpoint) if checkpoint else None
+    for entry in entries:
+        state = apply_entry(state, entry)
+    return {
+        "version": target["version"],
+        "timestamp": target["timestamp"],
+        "deleted": state is None,
+        "document": state,
+    }
+
+
+def _convert_entry(entry: Dict[str, Any], state: Optional[Dict[str, Any]], version: int) -> Tuple[Dict, Optional[Dict]]:
+    """Diff-format fields for one entry of a chronological history, and the state after it"""
+    action = entry.get("action")
+    if entry.get("version") is not None:
+        # Already diff-based, only the version number may change
+        changes = {"version": version, "changed_fields": sorted(entry.get("new_values") or {})}
+        return changes, apply_entry(state, entry)
+
+    old_values = entry.get("old_values") or {}
+    new_values = entry.get("new_values") or {}
+    if action == "created":
+        after = {k: v for k, v in new_values.items() if k != "_id"}
+        changes = {"old_values": {}, "new_values": after, "checkpoint": True, "snapshot": None}
+    elif action == "deleted":
+        after = None
+        changes = {"old_values": {}, "new_values": {}, "checkpoint": False, "snapshot": None}
+    else:
+        # Legacy updates stored the whole pre-update document in old_values
+        before = {k: v for k, v in old_values.items() if k != "_id"} if old_values else state
+        after = {**(before or {}), **new_values}
+        diff_old, diff_new = compute_diff(before, after)
+        changes = {"old_values": diff_old, "new_values": diff_new, "checkpoint": False, "snapshot": None}
+    changes["version"] = version
+    changes["changed_fields"] = sorted(changes["new_values"])
+    # Updates with no known prior state and every Nth version carry a full snapshot
+    if action not in ("created", "deleted") and (state is None or _is_checkpoint(version)):
+        changes.update({"checkpoint": True, "snapshot": after})
+    return changes, after
+
+
+def _entry_size(entry: Dict[str, Any]) -> int:
+    return len(json.dumps({k: v for k, v in entry.items() if k != "_id"}, default=str))
+
+
+async def _write(collection, updates: List[Tuple[str, Dict[str, Any]]]):
+    if hasattr(collection, "bulk_write"):
+        await collection.bulk_write([UpdateOne({"id": entry_id}, {"$set": changes}) for entry_id, changes in updates],
+                                    ordered=False)
+    else:
+        for entry_id, changes in updates:
+            await collection.update_one({"id": entry_id}, {"$set": changes})
+
+
+async def migrate_history(db, batch_size: int = 500) -> Dict[str, int]:
+    """Rewrite full-document history entries as diffs with checkpoints, in place
+
+    Resumable: only equipment that still has unversioned entries is visited,
+    and each equipment's history is renumbered as a whole. The equipment
+    version is realigned with the renumbered history (see history_version).
+    """
+    report = {"equipment": 0, "entries": 0, "converted": 0, "bytes_before": 0, "bytes_after": 0}
+    equipment_ids = await db.history.distinct("equipment_id", {"version": None})
+    pending: List[Tuple[str, Dict[str, Any]]] = []
+    for equipment_id in equipment_ids:
+        entries = await db.history.find({"equipment_id": equipment_id}).sort(HISTORY_ORDER).to_list(None)
+        state = None
+        for version, entry in enumerate(entries, start=1):
+            report["entries"] += 1
+            report["bytes_before"] += _entry_size(entry)
+            changes, state = _convert_entry(entry, state, version)
+            if entry.get("version") is None:
+                report["converted"] += 1
+            report["bytes_after"] += _entry_size({**entry, **changes})
+            if any(entry.get(key) != value for key, value in changes.items()):
+                pending.append((entry["id"], changes))
+            if len(pending) >= batch_size:
+                await _write(db.history, pending)
+                pending = []
+        if entries:
+            await db.equipment.update_one({"id": equipment_id}, {"$set": {"version": len(entries) - 1}})
+        report["equipment"] += 1
+    if pending:
+        await _write(db.history, pending)
+    return report
+
+
+async def _main():
+    import argparse
+    from dotenv import load_dotenv
+    from pathlib import Path
+    from storage import get_database
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Convert full-document history entries into diffs")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    db = get_database()
+    await db.history.create_index(HISTORY_VERSION_INDEX)
+    report = await migrate_history(db, batch_size=args.batch_size)
+    logger.info(f"History migration finished: {report}")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
@@ -0,0 +1,234 @@
+"""
+Write-behind queue for history entries
+Equipment mutations enqueue their history entry and return; a background
+task writes the queue with insert_many when it reaches HISTORY_BATCH_SIZE
+entries or every HISTORY_FLUSH_INTERVAL_MS. Every entry is first appended to
+a local spool file, which is only removed once its entries are stored, so a
+crash or a database outage never loses history: leftover spool files are
+replayed on the next start.
+
+Every process (uvicorn worker) spools to its own files, named after an
+owner id, and holds a lock on its owner lock file while it runs. At start a
+process replays only the files of owners whose lock it can take (stopped
+processes), first renaming each file into its own spool so no two
+processes replay the same file.
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import os
+import re
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, run a single worker per spool directory
+    fcntl = None
+
+import datetime_codec
+import metrics
+
+logger = logging.getLogger(__name__)
+
+HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", "100"))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL_MS", "200")) / 1000
+HISTORY_SPOOL_FSYNC = os.environ.get("HISTORY_SPOOL_FSYNC", "false").lower() == "true"
+
+queue_depth = metrics.REGISTRY.gauge(
+    "siriu_history_queue_depth", "History entries waiting to be written")
+flushes_total = metrics.REGISTRY.counter(
+    "siriu_history_flushes_total", "History write-behind flushes by outcome", ("status",))
+flush_size = metrics.REGISTRY.histogram(
+    "siriu_history_flush_entries", "History entries written per flush", buckets=(1, 5, 10, 25, 50, 100, 250, 500))
+
+SPOOL_PATTERN = "history-spool*.jsonl"
+# "history-spool-<owner>.current.jsonl" and rotated "history-spool-<owner>-<ns>.jsonl"; files written
+# before owners existed (one process per directory) do not match and are adopted by the first process
+SPOOL_OWNER = re.compile(r"history-spool-(\d+-[0-9a-f]{8})[.-]")
+
+
+def _try_lock(path: Path):
+    """Open and exclusively lock a file without waiting (None when another process holds the lock)"""
+    handle = open(path, "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return None
+    return handle
+
+
+class HistoryWriter:
+    """Batches history inserts in the background with a durable spool file"""
+
+    def __init__(self, collection, spool_dir: Path, batch_size: int = HISTORY_BATCH_SIZE,
+                 flush_interval: float = HISTORY_FLUSH_INTERVAL):
+        self.collection = collection
+        self.spool_dir = Path(spool_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._owner_lock = None
+        self._buffer: List[Dict[str, Any]] = []
+        # Entries taken by the flush in progress, still pending until their insert completes
+        self._inflight: List[Dict[str, Any]] = []
+        # Rotated spool files holding entries that are still buffered
+        self._segments: List[Path] = []
+        self._spool = None
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._buffer) + len(self._inflight)
+
+    async def start(self):
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self._owner_lock = _try_lock(self._lock_path(self.owner))
+        await self._replay_spool()
+        self._spool = open(self._current_path, "a", encoding="utf-8")
+        self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, entry: Dict[str, Any]):
+        """Spool an entry and queue it for the next batch"""
+        self._spool.write(datetime_codec.dumps(entry) + "\n")
+        self._spool.flush()
+        if HISTORY_SPOOL_FSYNC:
+            os.fsync(self._spool.fileno())
+        self._buffer.append(entry)
+        queue_depth.set((), self.depth)
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    async def flush(self):
+        """Write every queued entry (kept queued and spooled if the write fails)"""
+        async with self._lock:
+            if not self._buffer:
+                return
+            self._inflight, self._buffer = self._buffer, []
+            batch = self._inflight
+            self._segments.append(self._rotate())
+            try:
+                for start in range(0, len(batch), self.batch_size):
+                    await self._insert(batch[start:start + self.batch_size])
+            except Exception as e:
+                # Entries inserted before the failure are skipped on the retry by id
+                self._buffer = batch + self._buffer
+                flushes_total.inc(("error",))
+                logger.error(f"History flush failed, {len(self._buffer)} entries kept in the spool: {e}")
+                return
+            finally:
+                self._inflight = []
+                queue_depth.set((), self.depth)
+            for segment in self._segments:
+                segment.unlink(missing_ok=True)
+            self._segments = []
+            flushes_total.inc(("ok",))
+            flush_size.observe((), len(batch))
+
+    async def stop(self):
+        """Drain the queue; anything that cannot be written stays in the spool for the next start"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        if self._buffer:
+            logger.warning(f"{len(self._buffer)} history entries left in {self.spool_dir}")
+        else:
+            self._current_path.unlink(missing_ok=True)
+        if self._owner_lock is not None:
+            # Releasing the lock lets the next process replay whatever is left
+            self._owner_lock.close()
+            self._owner_lock = None
+            if not self._buffer:
+                self._lock_path(self.owner).unlink(missing_ok=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    @property
+    def _current_path(self) -> Path:
+        return self.spool_dir / f"history-spool-{self.owner}.current.jsonl"
+
+    def _lock_path(self, owner: str) -> Path:
+        return self.spool_dir / f"history-spool-{owner}.lock"
+
+    def _segment_path(self) -> Path:
+        return self.spool_dir / f"history-spool-{self.owner}-{time.time_ns()}.jsonl"
+
+    def _rotate(self) -> Path:
+        """Close the current spool file under a unique name and start a new one"""
+        self._spool.close()
+        rotated = self._segment_path()
+        self._current_path.rename(rotated)
+        self._spool = open(self._current_path, "a", encoding="utf-8")
+        return rotated
+
+    async def _insert(self, entries: List[Dict[str, Any]]):
+        # A retried batch may have been partially written already
+        existing = await self.collection.find(
+            {"id": {"$in": [entry["id"] for entry in entries]}}, {"_id": 0, "id": 1}).to_list(None)
+        stored = {doc["id"] for doc in existing}
+        missing = [entry for entry in entries if entry["id"] not in stored]
+        if not missing:
+            return
+        if hasattr(self.collection, "insert_many"):
+            await self.collection.insert_many(missing, ordered=False)
+        else:
+            for entry in missing:
+                await self.collection.insert_one(entry)
+
+    async def _replay_spool(self):
+        """Store entries left by stopped processes that did not write them"""
+        owners: Dict[Optional[str], List[Path]] = {}
+        for path in sorted(self.spool_dir.glob(SPOOL_PATTERN)):
+            match = SPOOL_OWNER.match(path.name)
+            owners.setdefault(match.group(1) if match else None, []).append(path)
+        for owner, paths in owners.items():
+            if owner == self.owner:
+                continue
+            lock = None
+            if owner is not None:
+                lock = _try_lock(self._lock_path(owner))
+                if lock is None:
+                    # Still running: its entries are in its own queue
+                    continue
+            try:
+                for path in paths:
+                    await self._replay_file(path)
+            finally:
+                if lock is not None:
+                    self._lock_path(owner).unlink(missing_ok=True)
+                    lock.close()
+
+    async def _replay_file(self, path: Path):
+        # Claim the file first: it becomes this process' spool, replayed by the next start if this one fails
+        claimed = self._segment_path()
+        try:
+            path.rename(claimed)
+        except FileNotFoundError:
+            return
+        with open(claimed, encoding="utf-8") as spool:
+            entries = [datetime_codec.loads(line) for line in spool if line.strip()]
+        for start in range(0, len(entries), self.batch_size):
+            await self._insert(entries[start:start + self.batch_size])
+        claimed.unlink()
+        if entries:
+            logger.info(f"Replayed {len(entries)} spooled history entries from {path.name}")
@@ -16,7 +16,7 @@ db.createCollection("users", {
         name: { bsonType: "string" },
         role: { enum: ["user", "admin", "superadmin"] },
         password: { bsonType: "string" },
-        created_at: { bsonType: "string" }
+        created_at: { bsonType: "date" }
       }
     }
   }
@@ -41,8 +41,8 @@ db.createCollection("equipment", {
         fecha_adquisicion: { bsonType: "string" },
         estado_operativo: { enum: ["disponible", "asignado", "en_mantenimiento", "dado_de_baja", "en_resguardo"] },
         observaciones: { bsonType: "string" },
-        created_at: { bsonType: "string" },
-        updated_at: { bsonType: "string" },
+        created_at: { bsonType: "date" },
+        updated_at: { bsonType: "date" },
         created_by: { bsonType: "string" }
       }
     }
@@ -59,7 +59,7 @@ db.createCollection("history", {
         equipment_id: { bsonType: "string" },
         action: { bsonType: "string" },
         changed_by: { bsonType: "string" },
-        timestamp: { bsonType: "string" },
+        timestamp: { bsonType: "date" },
         old_values: { bsonType: "object" },
         new_values: { bsonType: "object" }
       }
@@ -77,8 +77,8 @@ db.createCollection("locations", {
         edificio: { bsonType: "string" },
         piso: { bsonType: "string" },
         salon_aula: { bsonType: "string" },
-        created_at: { bsonType: "string" },
-        updated_at: { bsonType: "string" }
+        created_at: { bsonType: "date" },
+        updated_at: { bsonType: "date" }
       }
     }
   }
@@ -95,8 +95,8 @@ db.createCollection("departments", {
         ubicacion_id: { bsonType: "string" },
         numero_trabajadores: { bsonType: "int" },
         trabajadores: { bsonType: "array" },
-        created_at: { bsonType: "string" },
-        updated_at: { bsonType: "string" }
+        created_at: { bsonType: "date" },
+        updated_at: { bsonType: "date" }
       }
     }
   }
@@ -110,8 +110,8 @@ db.createCollection("tipos_bien", {
       properties: {
         id: { bsonType: "string" },
         nombre: { bsonType: "string" },
-        created_at: { bsonType: "string" },
-        updated_at: { bsonType: "string" }
+        created_at: { bsonType: "date" },
+        updated_at: { bsonType: "date" }
       }
     }
   }
@@ -125,8 +125,8 @@ db.createCollection("marcas", {
       properties: {
         id: { bsonType: "string" },
         nombre: { bsonType: "string" },
-        created_at: { bsonType: "string" },
-        updated_at: { bsonType: "string" }
+        created_at: { bsonType: "date" },
+        updated_at: { bsonType: "date" }
       }
     }
   }
@@ -141,13 +141,23 @@ db.createCollection("edificios", {
         id: { bsonType: "string" },
         nombre: { bsonType: "string" },
         direccion: { bsonType: "string" },
-        created_at: { bsonType: "string" },
-        updated_at: { bsonType: "string" }
+        created_at: { bsonType: "date" },
+        updated_at: { bsonType: "date" }
       }
     }
   }
 });
 
+// Pre-images let delete events of the live change feed report the document id
+// (MongoDB 6.0+ replica sets; the feed falls back to the _id elsewhere)
+["equipment", "locations", "departments", "tipos_bien", "marcas", "edificios"].forEach(function (name) {
+  try {
+    db.runCommand({ collMod: name, changeStreamPreAndPostImages: { enabled: true } });
+  } catch (e) {
+    print("Change stream pre-images unavailable for " + name + ": " + e);
+  }
+});
+
 // Create indexes for performance
 print("Creating indexes...");
 
@@ -173,6 +183,16 @@ db.equipment.createIndex({ "modelo": 1 });
 db.equipment.createIndex({ "tipo_bien": 1, "estado_operativo": 1 });
 db.equipment.createIndex({ "departamento": 1, "estado_operativo": 1 });
 
+// Sortable listing fields (GET /api/equipment?sort=...), with the id as tiebreak
+["numero_serie", "numero_factura", "numero_inventario", "tipo_bien", "estado_operativo",
+ "departamento", "ubicacion", "resguardante", "marca", "modelo"].forEach(function (field) {
+  db.equipment.createIndex({ [field]: 1, "id": 1 });
+});
+
+// Delta sync (/api/equipment/changes) and its deletion tombstones (90-day TTL)
+db.equipment.createIndex({ "updated_at": 1, "id": 1 });
+db.equipment_tombstones.createIndex({ "deleted_at": 1 }, { expireAfterSeconds: 7776000 });
+
 // Text index for search functionality
 db.equipment.createIndex({
   "numero_serie": "text",
@@ -194,6 +214,15 @@ db.departments.createIndex({ "ubicacion_id": 1 });
 
 // History indexes
 db.history.createIndex({ "equipment_id": 1 });
+db.history.createIndex({ "equipment_id": 1, "timestamp": -1, "id": -1 });
+db.history.createIndex({ "equipment_id": 1, "version": -1 });
+db.history.createIndex({ "changed_by": 1, "timestamp": -1, "id": -1 });
+db.history.createIndex({ "action": 1, "timestamp": -1, "id": -1 });
+db.history.createIndex({ "changed_fields": 1, "timestamp": -1, "id": -1 });
+
+// History archive segments (one index entry per segment)
+db.history_archive.createIndex({ "equipment_id": 1, "last_timestamp": -1 });
+db.history_archive.createIndex({ "last_timestamp": 1 });
 db.history.createIndex({ "timestamp": -1 });
 db.history.createIndex({ "action": 1 });
 db.history.createIndex({ "changed_by": 1 });
@@ -0,0 +1,136 @@
+"""
+Point-in-time inventory ("as of" a date)
+A scheduled task materializes the equipment collection into compressed
+snapshot chunks; the inventory at any instant is the newest snapshot taken
+before it plus the history entries recorded between the two.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import os
+import uuid
+import zlib
+
+import datetime_codec
+from history_archive import archived_between
+from history_store import apply_entry, flush_pending
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_INTERVAL_HOURS = float(os.environ.get("INVENTORY_SNAPSHOT_INTERVAL_HOURS", "24"))
+SNAPSHOT_CHUNK_SIZE = 500
+SEARCH_FIELDS = ("numero_serie", "marca", "modelo", "resguardante")
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _compress(documents: List[Dict[str, Any]]) -> bytes:
+    return zlib.compress(datetime_codec.dumps(documents, separators=(",", ":")).encode(), 6)
+
+
+def _decompress(data: bytes) -> List[Dict[str, Any]]:
+    return [datetime_codec.decode(document) for document in datetime_codec.loads(zlib.decompress(bytes(data)))]
+
+
+async def take_snapshot(db, chunk_size: int = SNAPSHOT_CHUNK_SIZE) -> Dict[str, Any]:
+    """Materialize the current equipment collection as a compressed snapshot"""
+    # Taken before reading: history replay from this instant is idempotent for
+    # changes that race with the read, while the reverse would lose them
+    taken_at = datetime.now(timezone.utc)
+    snapshot_id = str(uuid.uuid4())
+    documents = await db.equipment.find({}, {"_id": 0}).sort("id", 1).to_list(None)
+
+    chunks = []
+    stored_bytes = 0
+    for number, start in enumerate(range(0, len(documents), chunk_size)):
+        data = _compress(documents[start:start + chunk_size])
+        stored_bytes += len(data)
+        chunks.append({"snapshot_id": snapshot_id, "number": number, "data": data})
+    if chunks:
+        await db.inventory_snapshot_chunks.insert_many(chunks)
+
+    header = {
+        "id": snapshot_id,
+        "taken_at": taken_at,
+        "equipment_count": len(documents),
+        "chunks": len(chunks),
+        "stored_bytes": stored_bytes,
+    }
+    # The header is written last so a partially written snapshot is never used
+    await db.inventory_snapshots.insert_one(dict(header))
+    return header
+
+
+async def latest_snapshot(db, before: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """Newest snapshot taken at or before a UTC datetime"""
+    query = {"taken_at": {"$lte": before}} if before else {}
+    snapshots = await db.inventory_snapshots.find(query, {"_id": 0}).sort("taken_at", -1).limit(1).to_list(1)
+    return snapshots[0] if snapshots else None
+
+
+async def load_snapshot(db, snapshot: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Equipment documents of a snapshot keyed by id"""
+    chunks = await db.inventory_snapshot_chunks.find(
+        {"snapshot_id": snapshot["id"]}, {"_id": 0}).sort("number", 1).to_list(None)
+    inventory = {}
+    for chunk in chunks:
+        for document in _decompress(chunk["data"]):
+            inventory[document["id"]] = document
+    return inventory
+
+
+async def inventory_as_of(db, as_of: datetime) -> List[Dict[str, Any]]:
+    """Equipment documents as they were at a UTC datetime"""
+    await flush_pending()
+    snapshot = await latest_snapshot(db, as_of)
+    inventory = await load_snapshot(db, snapshot) if snapshot else {}
+
+    query: Dict[str, Any] = {"timestamp": {"$lte": as_of}}
+    if snapshot:
+        # Inclusive: stored dates have millisecond precision, so a change made in
+        # the snapshot's millisecond may be missing from it; replaying it is idempotent
+        query["timestamp"]["$gte"] = snapshot["taken_at"]
+    entries = await db.history.find(query, {"_id": 0, "old_values": 0}).to_list(None)
+    entries += await archived_between(db, snapshot["taken_at"] if snapshot else None, as_of)
+    entries.sort(key=lambda entry: (entry["timestamp"], entry["id"]))
+    for entry in entries:
+        state = apply_entry(inventory.get(entry["equipment_id"]), entry)
+        if state is None:
+            inventory.pop(entry["equipment_id"], None)
+        else:
+            inventory[entry["equipment_id"]] = state
+    return sorted(inventory.values(), key=lambda doc: datetime_codec.to_utc(doc.get("created_at")) or _EPOCH)
+
+
+def filter_inventory(documents: List[Dict[str, Any]], filters: Dict[str, Any],
+                     search: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Apply the equipment listing filters to reconstructed documents"""
+    needle = search.lower() if search else None
+    return [
+        doc for doc in documents
+        if all(doc.get(field) == value for field, value in filters.items())
+        and (needle is None or any(needle in str(doc.get(field) or "").lower() for field in SEARCH_FIELDS))
+    ]
+
+
+async def snapshot_scheduler(db, interval_hours: float = SNAPSHOT_INTERVAL_HOURS):
+    """Take a snapshot whenever the newest one is older than the interval"""
+    interval = interval_hours * 3600
+    while True:
+        try:
+            latest = await latest_snapshot(db)
+            age = None
+            if latest:
+                age = (datetime.now(timezone.utc) - datetime_codec.to_utc(latest["taken_at"])).total_seconds()
+            if age is None or age >= interval:
+                header = await take_snapshot(db)
+                logger.info(f"Inventory snapshot {header['id']}: {header['equipment_count']} equipos, "
+                            f"{header['stored_bytes']} bytes")
+                age = 0
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Inventory snapshot failed: {e}")
+            # Retry in five minutes
+            age = max(interval - 300, 0)
+        await asyncio.sleep(max(interval - (age or 0), 60))
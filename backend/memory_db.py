@@ -0,0 +1,1042 @@
+"""
+In-memory database engine with a Motor-like interface
+Used for local tests and benchmarks that must run without MongoDB or network
+"""
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+from datetime import datetime, timezone
+import asyncio
+import re
+
+from bson import ObjectId
+from pymongo import ASCENDING, DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from pymongo.results import BulkWriteResult, InsertOneResult, InsertManyResult, UpdateResult, DeleteResult
+
+from db_monitoring import instrumented
+
+_MISSING = object()
+
+
+def _clone(value):
+    """Copy a JSON-like value (faster than copy.deepcopy for plain documents)"""
+    if isinstance(value, dict):
+        return {k: _clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clone(v) for v in value]
+    return value
+
+
+def _to_bson(value):
+    """Copy a value the way MongoDB stores it: naive UTC datetimes with millisecond precision"""
+    if isinstance(value, dict):
+        return {k: _to_bson(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_bson(v) for v in value]
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+
+def _with_utc(value):
+    """Attach UTC to the naive datetimes of a copied result, like a tz_aware MongoClient"""
+    if isinstance(value, dict):
+        for k, v in value.items():
+            value[k] = _with_utc(v)
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            value[i] = _with_utc(v)
+    elif isinstance(value, datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+_BSON_TYPES = {
+    'string': str, 'date': datetime, 'bool': bool, 'object': dict, 'array': list,
+    'objectId': ObjectId, 'double': float, 'int': int, 'null': type(None),
+}
+
+
+def _get_path(doc: Dict[str, Any], path: str):
+    """Resolve a dotted field path, returning _MISSING when absent"""
+    value = doc
+    for part in path.split('.'):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+    return value
+
+
+def _set_path(doc: Dict[str, Any], path: str, value):
+    """Set a dotted field path, creating intermediate documents"""
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset_path(doc: Dict[str, Any], path: str):
+    """Remove a dotted field path if present"""
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _index_key(value):
+    """Make a field value usable as a dict key"""
+    if isinstance(value, dict):
+        return tuple((k, _index_key(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_index_key(v) for v in value)
+    return value
+
+
+# BSON comparison order for mixed types: null < numbers < strings < objects < arrays < ...
+def _type_rank(value) -> int:
+    if value is None or value is _MISSING:
+        return 0
+    if isinstance(value, bool):
+        return 5
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    if isinstance(value, ObjectId):
+        return 6
+    if isinstance(value, datetime):
+        return 7
+    return 8
+
+
+def _sort_key(value):
+    """Sort key following BSON ordering so mixed-type fields never raise"""
+    rank = _type_rank(value)
+    if rank == 0:
+        return (0, 0)
+    if rank in (3, 4):
+        return (rank, repr(value))
+    if rank == 7 and value.tzinfo is not None:
+        value = value.replace(tzinfo=None) - value.utcoffset()
+    return (rank, value)
+
+
+def _compare(a, b) -> Optional[int]:
+    """Compare two values of the same BSON type, None if not comparable"""
+    if _type_rank(a) != _type_rank(b) or a is None or a is _MISSING:
+        return None
+    ka, kb = _sort_key(a), _sort_key(b)
+    return (ka > kb) - (ka < kb)
+
+
+def _compile_regex(pattern, options: str = ''):
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = 0
+    if 'i' in options:
+        flags |= re.IGNORECASE
+    if 'm' in options:
+        flags |= re.MULTILINE
+    if 's' in options:
+        flags |= re.DOTALL
+    if 'x' in options:
+        flags |= re.VERBOSE
+    return re.compile(pattern, flags)
+
+
+def _candidates(value) -> List[Any]:
+    """Values a query condition is tested against (array fields match per element)"""
+    if isinstance(value, list):
+        return [value] + value
+    return [value]
+
+
+def _match_operators(value, spec: Dict[str, Any]) -> bool:
+    """Evaluate an operator document such as {"$gte": 1, "$lt": 5}"""
+    for op, arg in spec.items():
+        if op == '$eq':
+            if not _match_value(value, arg):
+                return False
+        elif op == '$ne':
+            if _match_value(value, arg):
+                return False
+        elif op in ('$gt', '$gte', '$lt', '$lte'):
+            ok = False
+            for candidate in _candidates(value):
+                result = _compare(candidate, arg)
+                if result is None:
+                    continue
+                if ((op == '$gt' and result > 0) or (op == '$gte' and result >= 0)
+                        or (op == '$lt' and result < 0) or (op == '$lte' and result <= 0)):
+                    ok = True
+                    break
+            if not ok:
+                return False
+        elif op == '$in':
+            if not any(_match_value(value, item) for item in arg):
+                return False
+        elif op == '$nin':
+            if any(_match_value(value, item) for item in arg):
+                return False
+        elif op == '$exists':
+            if (value is not _MISSING) != bool(arg):
+                return False
+        elif op == '$regex':
+            regex = _compile_regex(arg, spec.get('$options', ''))
+            if not any(isinstance(c, str) and regex.search(c) for c in _candidates(value)):
+                return False
+        elif op == '$options':
+            continue
+        elif op == '$not':
+            if _match_condition(value, arg):
+                return False
+        elif op == '$type':
+            types = tuple(_BSON_TYPES[name] for name in (arg if isinstance(arg, list) else [arg]))
+            if not any(isinstance(value, t) and (t is bool or not isinstance(value, bool)) for t in types):
+                return False
+        elif op == '$size':
+            if not isinstance(value, list) or len(value) != arg:
+                return False
+        elif op == '$elemMatch':
+            if not isinstance(value, list) or not any(
+                    isinstance(item, dict) and _matches(item, arg) for item in value):
+                return False
+        else:
+            raise ValueError(f"Unsupported query operator: {op}")
+    return True
+
+
+def _match_value(value, expected) -> bool:
+    """Equality with MongoDB semantics (null matches missing, arrays match elements)"""
+    if isinstance(expected, re.Pattern):
+        return any(isinstance(c, str) and expected.search(c) for c in _candidates(value))
+    if expected is None:
+        return value is None or value is _MISSING
+    if value is _MISSING:
+        return False
+    if isinstance(expected, datetime):
+        expected = _to_bson(expected)
+    return any(c == expected for c in _candidates(value))
+
+
+def _match_condition(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition):
+        return _match_operators(value, condition)
+    return _match_value(value, condition)
+
+
+def _matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    """Check whether a document matches a MongoDB query document"""
+    for key, condition in query.items():
+        if key == '$or':
+            if not any(_matches(doc, sub) for sub in condition):
+                return False
+        elif key == '$and':
+            if not all(_matches(doc, sub) for sub in condition):
+                return False
+        elif key == '$nor':
+            if any(_matches(doc, sub) for sub in condition):
+                return False
+        elif not _match_condition(_get_path(doc, key), condition):
+            return False
+    return True
+
+
+def _project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Apply a MongoDB-style inclusion or exclusion projection to a copy of doc"""
+    if not projection:
+        return _clone(doc)
+
+    include_id = bool(projection.get('_id', 1))
+    included = [k for k, v in projection.items() if k != '_id' and v]
+    excluded = [k for k, v in projection.items() if k != '_id' and not v]
+    if included and excluded:
+        raise ValueError("Cannot mix inclusion and exclusion in a projection")
+
+    if included:
+        result = {}
+        if include_id and '_id' in doc:
+            result['_id'] = doc['_id']
+        for path in included:
+            value = _get_path(doc, path)
+            if value is not _MISSING:
+                _set_path(result, path, _clone(value))
+        return result
+
+    result = _clone(doc)
+    if not include_id:
+        result.pop('_id', None)
+    for path in excluded:
+        _unset_path(result, path)
+    return result
+
+
+def _normalize_sort(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else ASCENDING)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(k, d) for k, d in key_or_list]
+
+
+def _sort_documents(docs: List[Dict[str, Any]], sort: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    # Stable sorts applied from the least significant key preserve multi-key order
+    for field, direction in reversed(sort):
+        docs.sort(key=lambda d: _sort_key(_get_path(d, field)), reverse=direction < 0)
+    return docs
+
+
+class MemoryCursor:
+    """Cursor over query results with the Motor cursor methods used by the API"""
+
+    def __init__(self, collection: 'MemoryCollection', query: Dict[str, Any],
+                 projection: Optional[Dict[str, Any]] = None):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._iterator = None
+
+    def sort(self, key_or_list, direction=None):
+        """Sort results (accepts a field name or a list of (field, direction) pairs)"""
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int):
+        """Skip the first results"""
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        """Limit results"""
+        self._limit = count
+        return self
+
+    @property
+    def collection_name(self) -> str:
+        return self.collection.name
+
+    def _execute(self) -> List[Dict[str, Any]]:
+        docs = self.collection._select(self.query)
+        if self._sort:
+            docs = _sort_documents(docs, self._sort)
+        if self._skip:
+            docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [self.collection._output(_project(doc, self.projection)) for doc in docs]
+
+    @instrumented("find", "query")
+    async def _fetch(self) -> List[Dict[str, Any]]:
+        await asyncio.sleep(0)
+        return self._execute()
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Convert to list"""
+        results = await self._fetch()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._iterator is None:
+            self._iterator = iter(await self._fetch())
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MemoryAggregationCursor:
+    """Cursor returned by aggregate()"""
+
+    def __init__(self, collection: 'MemoryCollection', pipeline: List[Dict[str, Any]]):
+        self.collection = collection
+        self.pipeline = pipeline
+        self.full_pipeline = pipeline
+        self._iterator = None
+
+    @property
+    def collection_name(self) -> str:
+        return self.collection.name
+
+    @instrumented("aggregate", "full_pipeline")
+    async def _fetch(self) -> List[Dict[str, Any]]:
+        await asyncio.sleep(0)
+        return [self.collection._output(doc) for doc in _run_pipeline(self.collection._select({}), self.pipeline)]
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Convert to list"""
+        results = await self._fetch()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._iterator is None:
+            self._iterator = iter(await self._fetch())
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def _evaluate(expression, doc: Dict[str, Any]):
+    """Evaluate the subset of aggregation expressions used by $group/$project"""
+    if isinstance(expression, str) and expression.startswith('$'):
+        value = _get_path(doc, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            op, arg = next(iter(expression.items()))
+            if op == '$literal':
+                return arg
+            if op == '$ifNull':
+                value = _evaluate(arg[0], doc)
+                return _evaluate(arg[1], doc) if value is None else value
+            if op == '$toLower':
+                value = _evaluate(arg, doc)
+                return value.lower() if isinstance(value, str) else ''
+            if op == '$cond':
+                if isinstance(arg, dict):
+                    arg = [arg['if'], arg['then'], arg['else']]
+                return _evaluate(arg[1] if _evaluate(arg[0], doc) else arg[2], doc)
+            if op == '$eq':
+                return _evaluate(arg[0], doc) == _evaluate(arg[1], doc)
+            if op == '$in':
+                return _evaluate(arg[0], doc) in (_evaluate(arg[1], doc) or [])
+        return {k: _evaluate(v, doc) for k, v in expression.items()}
+    if isinstance(expression, list):
+        return [_evaluate(v, doc) for v in expression]
+    return expression
+
+
+def _accumulator_initial(op: str):
+    if op == '$sum':
+        return 0
+    if op == '$avg':
+        return [0, 0]
+    if op in ('$push', '$addToSet'):
+        return []
+    return _MISSING
+
+
+def _group(docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    groups: Dict[Any, Dict[str, Any]] = {}
+    for doc in docs:
+        group_id = _evaluate(spec['_id'], doc)
+        key = _index_key(group_id)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {'_id': group_id}
+            for field, accumulator in spec.items():
+                if field != '_id':
+                    group[field] = _accumulator_initial(next(iter(accumulator)))
+        for field, accumulator in spec.items():
+            if field == '_id':
+                continue
+            op, arg = next(iter(accumulator.items()))
+            value = _evaluate(arg, doc)
+            if op == '$sum':
+                group[field] += value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+            elif op == '$avg':
+                if isinstance(value, (int, float)):
+                    group[field][0] += value
+                    group[field][1] += 1
+            elif op == '$push':
+                group[field].append(value)
+            elif op == '$addToSet':
+                if value not in group[field]:
+                    group[field].append(value)
+            elif op == '$first':
+                if group[field] is _MISSING:
+                    group[field] = value
+            elif op == '$last':
+                group[field] = value
+            elif op in ('$min', '$max'):
+                current = group[field]
+                if value is not None and (current is _MISSING or current is None
+                                          or (_sort_key(value) < _sort_key(current)) == (op == '$min')):
+                    group[field] = value
+            else:
+                raise ValueError(f"Unsupported accumulator: {op}")
+
+    results = []
+    for group in groups.values():
+        for field, accumulator in spec.items():
+            if field == '_id':
+                continue
+            op = next(iter(accumulator))
+            if op == '$avg':
+                total, count = group[field]
+                group[field] = total / count if count else None
+            elif group[field] is _MISSING:
+                group[field] = None
+        results.append(group)
+    return results
+
+
+def _run_pipeline(docs: List[Dict[str, Any]], pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Run an aggregation pipeline over already-selected documents"""
+    for stage in pipeline:
+        name, spec = next(iter(stage.items()))
+        if name == '$match':
+            docs = [doc for doc in docs if _matches(doc, spec)]
+        elif name == '$group':
+            docs = _group(docs, spec)
+        elif name == '$sort':
+            docs = _sort_documents(list(docs), _normalize_sort(spec))
+        elif name == '$skip':
+            docs = docs[spec:]
+        elif name == '$limit':
+            docs = docs[:spec]
+        elif name == '$project':
+            if all(v in (0, 1, True, False) for v in spec.values()):
+                docs = [_project(doc, spec) for doc in docs]
+            else:
+                projected = []
+                for doc in docs:
+                    result = {'_id': doc.get('_id')} if spec.get('_id', 1) else {}
+                    for field, expression in spec.items():
+                        if field == '_id':
+                            continue
+                        if expression in (1, True):
+                            value = _get_path(doc, field)
+                            if value is not _MISSING:
+                                _set_path(result, field, value)
+                        elif expression not in (0, False):
+                            _set_path(result, field, _evaluate(expression, doc))
+                    projected.append(result)
+                docs = projected
+        elif name == '$count':
+            docs = [{spec: len(docs)}] if docs else []
+        elif name == '$unwind':
+            path = (spec if isinstance(spec, str) else spec['path'])[1:]
+            unwound = []
+            for doc in docs:
+                values = _get_path(doc, path)
+                if isinstance(values, list):
+                    for value in values:
+                        copy = dict(doc)
+                        _set_path(copy, path, value)
+                        unwound.append(copy)
+            docs = unwound
+        elif name == '$facet':
+            docs = [{field: _run_pipeline(list(docs), sub) for field, sub in spec.items()}]
+        else:
+            raise ValueError(f"Unsupported aggregation stage: {name}")
+    return [_clone(doc) for doc in docs]
+
+
+class MemoryCollection:
+    """Collection stored in process memory with hash indexes on selected fields"""
+
+    def __init__(self, name: str, tz_aware: bool = False):
+        self.name = name
+        self.tz_aware = tz_aware
+        self._docs: Dict[int, Dict[str, Any]] = {}
+        self._next_key = 0
+        # field -> {value -> set of internal keys}
+        self._indexes: Dict[str, Dict[Any, set]] = {}
+        self._unique: set = set()
+        self._index_names: Dict[str, str] = {}
+        self.create_index_sync('_id', unique=True)
+        self.create_index_sync('id')
+
+    @property
+    def collection_name(self) -> str:
+        return self.name
+
+    def _output(self, doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Result copy as returned to callers (UTC-aware datetimes when tz_aware)"""
+        return _with_utc(doc) if self.tz_aware and doc is not None else doc
+
+    # Index maintenance
+
+    def create_index_sync(self, keys, unique: bool = False, name: Optional[str] = None, **kwargs) -> str:
+        """Create a hash index on the first field of keys"""
+        spec = _normalize_sort(keys)
+        field = spec[0][0]
+        index_name = name or '_'.join(f"{k}_{d}" for k, d in spec)
+        self._index_names[index_name] = field
+        if unique:
+            self._unique.add(field)
+        if field not in self._indexes:
+            index: Dict[Any, set] = {}
+            for key, doc in self._docs.items():
+                for value in self._index_keys(doc, field):
+                    index.setdefault(value, set()).add(key)
+            self._indexes[field] = index
+        return index_name
+
+    @instrumented("createIndexes", None)
+    async def create_index(self, keys, unique: bool = False, name: Optional[str] = None, **kwargs) -> str:
+        """Create an index (only the leading field is used for lookups)"""
+        return self.create_index_sync(keys, unique=unique, name=name, **kwargs)
+
+    async def create_indexes(self, indexes) -> List[str]:
+        """Create several indexes from pymongo IndexModel instances"""
+        names = []
+        for model in indexes:
+            document = model.document
+            names.append(self.create_index_sync(
+                list(document['key'].items()),
+                unique=document.get('unique', False),
+                name=document.get('name')
+            ))
+        return names
+
+    async def index_information(self) -> Dict[str, Any]:
+        """Describe the indexes of the collection"""
+        return {name: {'key': [(field, ASCENDING)], 'unique': field in self._unique}
+                for name, field in self._index_names.items()}
+
+    @staticmethod
+    def _index_value(doc: Dict[str, Any], field: str):
+        value = _get_path(doc, field)
+        return None if value is _MISSING else value
+
+    def _index_keys(self, doc: Dict[str, Any], field: str) -> List[Any]:
+        """Index keys of a document: arrays are multikey (each element plus the whole array)"""
+        value = self._index_value(doc, field)
+        if isinstance(value, list):
+            return [_index_key(value)] + [_index_key(item) for item in value]
+        return [_index_key(value)]
+
+    def _index_add(self, key: int, doc: Dict[str, Any]):
+        for field, index in self._indexes.items():
+            value = _index_key(self._index_value(doc, field))
+            if field in self._unique and index.get(value) and value is not None:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} "
+                                        f"index: {field} dup key: {value!r}")
+        for field, index in self._indexes.items():
+            for value in self._index_keys(doc, field):
+                index.setdefault(value, set()).add(key)
+
+    def _index_remove(self, key: int, doc: Dict[str, Any]):
+        for field, index in self._indexes.items():
+            for value in self._index_keys(doc, field):
+                keys = index.get(value)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[value]
+
+    # Query planning
+
+    def _candidate_keys(self, query: Dict[str, Any]) -> Optional[Iterable[int]]:
+        """Pick the smallest index bucket usable for the query, None for a full scan"""
+        return self._plan(query)[1]
+
+    def _plan(self, query: Dict[str, Any]) -> Tuple[Optional[str], Optional[set]]:
+        """Choose the index field and its candidate keys, (None, None) for a full scan"""
+        best, best_field = None, None
+        for field, condition in query.items():
+            index = self._indexes.get(field)
+            if index is None:
+                continue
+            if isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition):
+                if '$eq' in condition:
+                    values = [condition['$eq']]
+                elif '$in' in condition and not any(isinstance(v, (list, re.Pattern)) for v in condition['$in']):
+                    values = condition['$in']
+                else:
+                    continue
+            elif isinstance(condition, (list, re.Pattern)):
+                continue
+            else:
+                values = [condition]
+            keys = set()
+            for value in values:
+                keys |= index.get(_index_key(_to_bson(value)), set())
+            if best is None or len(keys) < len(best):
+                best, best_field = keys, field
+        return best_field, best
+
+    def explain(self, query: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Describe the winning plan for a filter in MongoDB explain() format"""
+        field, _ = self._plan(query or {})
+        if field is None:
+            stage = {'stage': 'COLLSCAN', 'filter': query or {}, 'direction': 'forward'}
+        else:
+            index_name = next((name for name, f in self._index_names.items() if f == field), field)
+            stage = {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': index_name,
+                                                      'keyPattern': {field: 1}}}
+        return {'queryPlanner': {'namespace': self.name, 'winningPlan': stage}, 'ok': 1.0}
+
+    def _select_keys(self, query: Dict[str, Any], sort=None) -> List[int]:
+        candidates = self._candidate_keys(query or {})
+        if candidates is None:
+            candidates = self._docs.keys()
+        else:
+            candidates = sorted(candidates)
+        keys = [key for key in candidates if not query or _matches(self._docs[key], query)]
+        for field, direction in reversed(_normalize_sort(sort) if sort else []):
+            keys.sort(key=lambda k: _sort_key(_get_path(self._docs[k], field)), reverse=direction < 0)
+        return keys
+
+    def _select(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Return the stored documents matching query (not copies)"""
+        return [self._docs[key] for key in self._select_keys(query)]
+
+    # Motor-compatible API
+
+    def find(self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None,
+             sort=None, skip: int = 0, limit: int = 0) -> MemoryCursor:
+        """Find multiple documents"""
+        cursor = MemoryCursor(self, query or {}, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    @instrumented("find")
+    async def find_one(self, query: Optional[Dict[str, Any]] = None,
+                       projection: Optional[Dict[str, Any]] = None, sort=None) -> Optional[Dict[str, Any]]:
+        """Find single document"""
+        await asyncio.sleep(0)
+        keys = self._select_keys(query or {}, sort)
+        return self._output(_project(self._docs[keys[0]], projection)) if keys else None
+
+    def _insert(self, document: Dict[str, Any]):
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        stored = _to_bson(document)
+        key = self._next_key
+        self._index_add(key, stored)
+        self._docs[key] = stored
+        self._next_key += 1
+        return document['_id']
+
+    @instrumented("insert", None)
+    async def insert_one(self, document: Dict[str, Any]) -> InsertOneResult:
+        """Insert single document (adds an ObjectId _id to document, like pymongo)"""
+        await asyncio.sleep(0)
+        return InsertOneResult(self._insert(document), True)
+
+    @instrumented("insert", None)
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True) -> InsertManyResult:
+        """Insert several documents"""
+        await asyncio.sleep(0)
+        return InsertManyResult([self._insert(document) for document in documents], True)
+
+    def _apply_update(self, doc: Dict[str, Any], update: Dict[str, Any], inserting: bool = False):
+        for op, fields in update.items():
+            if op == '$set':
+                for path, value in fields.items():
+                    _set_path(doc, path, _to_bson(value))
+            elif op == '$setOnInsert':
+                if inserting:
+                    for path, value in fields.items():
+                        _set_path(doc, path, _to_bson(value))
+            elif op == '$unset':
+                for path in fields:
+                    _unset_path(doc, path)
+            elif op == '$inc':
+                for path, amount in fields.items():
+                    current = _get_path(doc, path)
+                    _set_path(doc, path, (0 if current is _MISSING else current) + amount)
+            elif op == '$push':
+                for path, value in fields.items():
+                    current = _get_path(doc, path)
+                    items = [] if current is _MISSING else current
+                    if isinstance(value, dict) and '$each' in value:
+                        items.extend(_to_bson(value['$each']))
+                    else:
+                        items.append(_to_bson(value))
+                    _set_path(doc, path, items)
+            elif op == '$addToSet':
+                for path, value in fields.items():
+                    current = _get_path(doc, path)
+                    items = [] if current is _MISSING else current
+                    if value not in items:
+                        items.append(_to_bson(value))
+                    _set_path(doc, path, items)
+            elif op == '$pull':
+                for path, value in fields.items():
+                    current = _get_path(doc, path)
+                    if isinstance(current, list):
+                        _set_path(doc, path, [v for v in current if not _match_condition(v, value)])
+            elif op == '$max' or op == '$min':
+                for path, value in fields.items():
+                    current = _get_path(doc, path)
+                    if current is _MISSING or (_sort_key(value) > _sort_key(current)) == (op == '$max'):
+                        _set_path(doc, path, _to_bson(value))
+            else:
+                raise ValueError(f"Unsupported update operator: {op}")
+
+    def _upsert_document(self, query: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+        doc = {k: _clone(v) for k, v in query.items() if not k.startswith('$') and not isinstance(v, dict)}
+        if any(k.startswith('$') for k in update):
+            self._apply_update(doc, update, inserting=True)
+        else:
+            doc.update(_clone(update))
+        doc.setdefault('_id', ObjectId())
+        return doc
+
+    def _replace_stored(self, key: int, new_doc: Dict[str, Any]):
+        old_doc = self._docs[key]
+        self._index_remove(key, old_doc)
+        try:
+            self._index_add(key, new_doc)
+        except DuplicateKeyError:
+            self._index_add(key, old_doc)
+            raise
+        self._docs[key] = new_doc
+
+    async def _update(self, query: Dict[str, Any], update: Dict[str, Any], multi: bool,
+                      upsert: bool) -> UpdateResult:
+        await asyncio.sleep(0)
+        keys = self._select_keys(query or {})
+        if not multi:
+            keys = keys[:1]
+        modified = 0
+        for key in keys:
+            new_doc = _clone(self._docs[key])
+            self._apply_update(new_doc, update)
+            if new_doc != self._docs[key]:
+                self._replace_stored(key, new_doc)
+                modified += 1
+        raw = {'n': len(keys), 'nModified': modified, 'ok': 1.0, 'updatedExisting': bool(keys)}
+        if not keys and upsert:
+            doc = self._upsert_document(query or {}, update)
+            self._insert(doc)
+            raw.update({'n': 1, 'upserted': doc['_id']})
+        return UpdateResult(raw, True)
+
+    @instrumented("update")
+    async def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> UpdateResult:
+        """Update single document"""
+        return await self._update(query, update, multi=False, upsert=upsert)
+
+    @instrumented("update")
+    async def update_many(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> UpdateResult:
+        """Update every matching document"""
+        return await self._update(query, update, multi=True, upsert=upsert)
+
+    @instrumented("update")
+    async def replace_one(self, query: Dict[str, Any], replacement: Dict[str, Any], upsert: bool = False) -> UpdateResult:
+        """Replace single document, keeping its _id"""
+        return await self._replace(query, replacement, upsert)
+
+    async def _replace(self, query: Dict[str, Any], replacement: Dict[str, Any], upsert: bool) -> UpdateResult:
+        await asyncio.sleep(0)
+        keys = self._select_keys(query or {})[:1]
+        raw = {'n': len(keys), 'nModified': len(keys), 'ok': 1.0, 'updatedExisting': bool(keys)}
+        if keys:
+            new_doc = _to_bson(replacement)
+            new_doc['_id'] = self._docs[keys[0]]['_id']
+            self._replace_stored(keys[0], new_doc)
+        elif upsert:
+            doc = self._upsert_document(query or {}, replacement)
+            self._insert(doc)
+            raw.update({'n': 1, 'upserted': doc['_id']})
+        return UpdateResult(raw, True)
+
+    @instrumented("findAndModify")
+    async def find_one_and_update(self, query: Dict[str, Any], update: Dict[str, Any],
+                                  projection: Optional[Dict[str, Any]] = None, sort=None,
+                                  upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE) -> Optional[Dict[str, Any]]:
+        """Atomically update a document and return it before or after the update"""
+        await asyncio.sleep(0)
+        docs = self._select_keys(query or {}, sort)
+        if not docs:
+            if not upsert:
+                return None
+            doc = self._upsert_document(query or {}, update)
+            self._insert(doc)
+            return self._output(_project(doc, projection)) if return_document == ReturnDocument.AFTER else None
+        key = docs[0]
+        before = self._docs[key]
+        after = _clone(before)
+        self._apply_update(after, update)
+        if after != before:
+            self._replace_stored(key, after)
+        return self._output(_project(after if return_document == ReturnDocument.AFTER else before, projection))
+
+    @instrumented("findAndModify")
+    async def find_one_and_delete(self, query: Dict[str, Any],
+                                  projection: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Atomically delete a document and return it"""
+        await asyncio.sleep(0)
+        keys = self._select_keys(query or {})[:1]
+        if not keys:
+            return None
+        doc = self._docs.pop(keys[0])
+        self._index_remove(keys[0], doc)
+        return self._output(_project(doc, projection))
+
+    async def _delete(self, query: Dict[str, Any], multi: bool) -> DeleteResult:
+        await asyncio.sleep(0)
+        keys = self._select_keys(query or {})
+        if not multi:
+            keys = keys[:1]
+        for key in keys:
+            self._index_remove(key, self._docs.pop(key))
+        return DeleteResult({'n': len(keys), 'ok': 1.0}, True)
+
+    @instrumented("delete")
+    async def delete_one(self, query: Dict[str, Any]) -> DeleteResult:
+        """Delete single document"""
+        return await self._delete(query, multi=False)
+
+    @instrumented("delete")
+    async def delete_many(self, query: Dict[str, Any]) -> DeleteResult:
+        """Delete every matching document"""
+        return await self._delete(query, multi=True)
+
+    @instrumented("update", None)
+    async def bulk_write(self, requests: List[Any], ordered: bool = True) -> BulkWriteResult:
+        """Apply pymongo InsertOne/UpdateOne/UpdateMany/ReplaceOne/DeleteOne/DeleteMany requests"""
+        counts = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []}
+        for index, request in enumerate(requests):
+            if isinstance(request, InsertOne):
+                self._insert(request._doc)
+                counts['nInserted'] += 1
+                continue
+            if isinstance(request, (DeleteOne, DeleteMany)):
+                result = await self._delete(request._filter, multi=isinstance(request, DeleteMany))
+                counts['nRemoved'] += result.deleted_count
+                continue
+            if isinstance(request, ReplaceOne):
+                result = await self._replace(request._filter, request._doc, request._upsert)
+            elif isinstance(request, (UpdateOne, UpdateMany)):
+                result = await self._update(request._filter, request._doc, multi=isinstance(request, UpdateMany),
+                                            upsert=request._upsert)
+            else:
+                raise TypeError(f"Unsupported bulk write request: {request!r}")
+            if result.upserted_id is not None:
+                counts['nUpserted'] += 1
+                counts['upserted'].append({'index': index, '_id': result.upserted_id})
+            else:
+                counts['nMatched'] += result.matched_count
+                counts['nModified'] += result.modified_count
+        return BulkWriteResult(counts, True)
+
+    @instrumented("aggregate")
+    async def count_documents(self, query: Optional[Dict[str, Any]] = None, **kwargs) -> int:
+        """Count documents matching query"""
+        await asyncio.sleep(0)
+        if not query:
+            return len(self._docs)
+        return len(self._select_keys(query))
+
+    async def estimated_document_count(self) -> int:
+        """Count all documents"""
+        return len(self._docs)
+
+    @instrumented("distinct", 1)
+    async def distinct(self, field: str, query: Optional[Dict[str, Any]] = None) -> List[Any]:
+        """Get distinct values for a field"""
+        await asyncio.sleep(0)
+        values = []
+        seen = set()
+        for doc in self._select(query or {}):
+            value = _get_path(doc, field)
+            if value is _MISSING:
+                continue
+            for item in (value if isinstance(value, list) else [value]):
+                key = _index_key(item)
+                if key not in seen:
+                    seen.add(key)
+                    values.append(item)
+        return values
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> MemoryAggregationCursor:
+        """Run an aggregation pipeline"""
+        pipeline = list(pipeline)
+        cursor = MemoryAggregationCursor(self, pipeline)
+        # A leading $match can use the indexes
+        if pipeline and '$match' in pipeline[0]:
+            query = pipeline[0]['$match']
+            cursor.collection = _MatchedView(self, query)
+            cursor.pipeline = pipeline[1:]
+        return cursor
+
+    async def drop(self):
+        """Remove every document, keeping index definitions"""
+        self._docs.clear()
+        for index in self._indexes.values():
+            index.clear()
+
+
+class _MatchedView:
+    """Pre-filtered view used so a leading $match stage is planned with indexes"""
+
+    def __init__(self, collection: MemoryCollection, query: Dict[str, Any]):
+        self.collection = collection
+        self.query = query
+
+    @property
+    def name(self) -> str:
+        return self.collection.name
+
+    def _select(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return self.collection._select(self.query)
+
+    def _output(self, doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        return self.collection._output(doc)
+
+
+class MemoryDB:
+    """In-memory database exposing collections as attributes, like a Motor database"""
+
+    def __init__(self, name: str = 'memory', tz_aware: bool = False):
+        self.name = name
+        self.tz_aware = tz_aware
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def collection(self, collection_name: str) -> MemoryCollection:
+        """Get collection reference"""
+        collection = self._collections.get(collection_name)
+        if collection is None:
+            collection = self._collections[collection_name] = MemoryCollection(collection_name, self.tz_aware)
+        return collection
+
+    def __getitem__(self, collection_name: str) -> MemoryCollection:
+        return self.collection(collection_name)
+
+    def __getattr__(self, collection_name: str) -> MemoryCollection:
+        if collection_name.startswith('_'):
+            raise AttributeError(collection_name)
+        return self.collection(collection_name)
+
+    async def list_collection_names(self) -> List[str]:
+        """Names of the collections created so far"""
+        return list(self._collections)
+
+    async def command(self, command, value=1, **kwargs) -> Dict[str, Any]:
+        """Run a database command (ping and explain of find-like commands)"""
+        if isinstance(command, str):
+            name = command
+        else:
+            name = next(iter(command))
+            value = command[name]
+        if name == 'ping':
+            return {'ok': 1.0}
+        if name == 'explain':
+            explained = next(iter(value))
+            collection = self.collection(value[explained])
+            if explained == 'aggregate':
+                pipeline = value.get('pipeline') or [{}]
+                return collection.explain(pipeline[0].get('$match', {}))
+            return collection.explain(value.get('filter', value.get('query', {})))
+        raise ValueError(f"Unsupported command: {name}")
+
+    def clear(self):
+        """Drop every collection"""
+        self._collections.clear()
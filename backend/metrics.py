@@ -0,0 +1,257 @@
+"""
+Prometheus-style metrics for the SIRIU API
+Request metrics are collected by an ASGI middleware and database metrics by
+a db_monitoring listener; REGISTRY.render() produces the text exposition format
+"""
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+import bisect
+import hmac
+import threading
+import time
+
+from starlette.routing import Match
+
+import db_monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: Tuple[str, ...] = ()) -> float:
+        return self._values.get(labels, 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in items]
+
+
+class Gauge(Counter):
+    """Value that can go up and down per label set"""
+    kind = "gauge"
+
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1.0):
+        self.inc(labels, -amount)
+
+    def set(self, labels: Tuple[str, ...] = (), value: float = 0.0):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][position] += 1
+            entry[1] += value
+
+    def count(self, labels: Tuple[str, ...] = ()) -> int:
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        lines = []
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+http_requests_total = REGISTRY.counter(
+    "siriu_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_duration = REGISTRY.histogram(
+    "siriu_http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+http_requests_in_flight = REGISTRY.gauge(
+    "siriu_http_requests_in_flight", "HTTP requests currently being served", ("method", "route"))
+http_response_size = REGISTRY.histogram(
+    "siriu_http_response_size_bytes", "HTTP response body size", ("method", "route"), SIZE_BUCKETS)
+db_operations_total = REGISTRY.counter(
+    "siriu_db_operations_total", "Database operations by collection and operation",
+    ("collection", "operation", "status"))
+db_operation_duration = REGISTRY.histogram(
+    "siriu_db_operation_duration_seconds", "Database operation latency", ("collection", "operation"))
+
+
+_current_route: ContextVar[Optional[str]] = ContextVar("siriu_route", default=None)
+
+
+def current_route() -> Optional[str]:
+    """Route template of the request being served (for metrics recorded below the HTTP layer)"""
+    return _current_route.get()
+
+
+def route_template(app, scope) -> str:
+    """Route path template (e.g. /api/equipment/{equipment_id}) to keep label cardinality bounded"""
+    template = scope.get("siriu.route")
+    if template is not None:
+        return template
+    partial = None
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            template = route.path
+            break
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    else:
+        template = partial or "unmatched"
+    # Cached on the scope so inner middlewares do not match the routes again
+    scope["siriu.route"] = template
+    return template
+
+
+def record_db_operation(collection: str, operation: str, duration: float, succeeded: bool, command=None):
+    """db_monitoring listener feeding the database metrics"""
+    db_operations_total.inc((collection, operation, "ok" if succeeded else "error"))
+    db_operation_duration.observe((collection, operation), duration)
+
+
+db_monitoring.add_listener(record_db_operation)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request count, latency, in-flight and response size per route"""
+
+    def __init__(self, app, fastapi_app=None):
+        self.app = app
+        # Routes are resolved against the FastAPI application, not the wrapped middleware stack
+        self.fastapi_app = fastapi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(self.fastapi_app, scope) if self.fastapi_app is not None else scope["path"]
+        labels = (method, route)
+        status_code = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        http_requests_in_flight.inc(labels)
+        token = _current_route.set(route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_route.reset(token)
+            http_requests_in_flight.dec(labels)
+            http_request_duration.observe(labels, time.perf_counter() - started)
+            http_requests_total.inc((method, route, str(status_code)))
+            http_response_size.observe(labels, size)
+
+
+def metrics_authorized(authorization: Optional[str], token: Optional[str]) -> bool:
+    """Check the scrape token (no token configured means the endpoint is open)"""
+    if not token:
+        return True
+    # Constant-time comparison, so response timing does not reveal the token
+    return hmac.compare_digest((authorization or "").encode(), f"Bearer {token}".encode())
@@ -0,0 +1,152 @@
+"""
+Convert ISO string timestamps into native datetimes
+Older versions stored created_at/updated_at/timestamp as isoformat strings.
+This rewrites them in place, in batches, as BSON dates (Timestamps in
+Firestore). Resumable: each pass only selects documents that still hold a
+string in one of the fields, so it can be stopped and run again at any time.
+
+On MongoDB the $jsonSchema validators created by init_mongodb.js are first
+switched to dates (with validationLevel "moderate", so documents that still
+hold strings can be updated until they are converted).
+"""
+from typing import Any, Dict, List, Tuple
+import asyncio
+import json
+import logging
+
+from pymongo import UpdateOne
+
+import datetime_codec
+
+logger = logging.getLogger(__name__)
+
+_EQUIPMENT_FIELDS = ("created_at", "updated_at")
+
+# Collection -> timestamp fields (dotted paths for equipment states embedded in history entries)
+MIGRATED_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "equipment": _EQUIPMENT_FIELDS,
+    "locations": _EQUIPMENT_FIELDS,
+    "departments": _EQUIPMENT_FIELDS,
+    "tipos_bien": _EQUIPMENT_FIELDS,
+    "marcas": _EQUIPMENT_FIELDS,
+    "edificios": _EQUIPMENT_FIELDS,
+    "users": _EQUIPMENT_FIELDS,
+    "history": ("timestamp",) + tuple(f"{part}.{field}" for part in ("old_values", "new_values", "snapshot")
+                                      for field in _EQUIPMENT_FIELDS),
+    "history_archive": ("first_timestamp", "last_timestamp"),
+    "inventory_snapshots": ("taken_at",),
+}
+
+
+def _get_path(document: Dict[str, Any], path: str):
+    for part in path.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+
+def _converted(document: Dict[str, Any], fields: Tuple[str, ...]) -> Dict[str, Any]:
+    """$set document for the string timestamps of a document that parse as ISO dates"""
+    changes = {}
+    for field in fields:
+        value = _get_path(document, field)
+        if isinstance(value, str):
+            converted = datetime_codec.to_utc(value)
+            if converted is not value:
+                changes[field] = converted
+    return changes
+
+
+async def _write(collection, updates: List[Tuple[str, Dict[str, Any]]]):
+    if hasattr(collection, "bulk_write"):
+        await collection.bulk_write([UpdateOne({"id": doc_id}, {"$set": changes}) for doc_id, changes in updates],
+                                    ordered=False)
+    else:
+        for doc_id, changes in updates:
+            await collection.update_one({"id": doc_id}, {"$set": changes})
+
+
+async def migrate_collection(collection, fields: Tuple[str, ...], batch_size: int = 500) -> Dict[str, int]:
+    """Convert one collection; documents are visited in id order, batch_size at a time"""
+    report = {"scanned": 0, "converted": 0, "unparseable": 0}
+    pending = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    projection = {"_id": 0, "id": 1, **{field: 1 for field in fields}}
+    last_id = None
+    while True:
+        query = dict(pending)
+        if last_id is not None:
+            query["id"] = {"$gt": last_id}
+        batch = await collection.find(query, projection).sort("id", 1).limit(batch_size).to_list(batch_size)
+        updates = []
+        for document in batch:
+            changes = _converted(document, fields)
+            if changes:
+                updates.append((document["id"], changes))
+            # Values that are not ISO dates are left alone (and reported)
+            report["unparseable"] += sum(
+                1 for field in fields if isinstance(_get_path(document, field), str) and field not in changes)
+        if updates:
+            await _write(collection, updates)
+        report["scanned"] += len(batch)
+        report["converted"] += len(updates)
+        if len(batch) < batch_size:
+            return report
+        last_id = batch[-1]["id"]
+
+
+async def update_validators(db) -> List[str]:
+    """Declare the migrated top-level fields as dates in the collections' $jsonSchema validators
+
+    Returns the collections whose validator changed.
+    """
+    # Only MongoDB has validators (checked on the type: MemoryDB answers any attribute)
+    if getattr(type(db), "list_collections", None) is None:
+        return []
+    updated = []
+    async for info in await db.list_collections(filter={"name": {"$in": list(MIGRATED_FIELDS)}}):
+        schema = (info.get("options", {}).get("validator") or {}).get("$jsonSchema")
+        if not schema:
+            continue
+        properties = schema.get("properties", {})
+        fields = [field for field in MIGRATED_FIELDS[info["name"]]
+                  if properties.get(field, {}).get("bsonType") == "string"]
+        if not fields:
+            continue
+        for field in fields:
+            properties[field]["bsonType"] = "date"
+        await db.command("collMod", info["name"], validator={"$jsonSchema": schema}, validationLevel="moderate")
+        updated.append(info["name"])
+        logger.info(f"{info['name']}: validator now expects dates for {fields}")
+    return updated
+
+
+async def migrate_datetimes(db, batch_size: int = 500) -> Dict[str, Dict[str, int]]:
+    """Convert every collection in MIGRATED_FIELDS"""
+    await update_validators(db)
+    report = {}
+    for name, fields in MIGRATED_FIELDS.items():
+        report[name] = await migrate_collection(getattr(db, name), fields, batch_size)
+        logger.info(f"{name}: {report[name]}")
+    return report
+
+
+async def _main():
+    import argparse
+    from dotenv import load_dotenv
+    from pathlib import Path
+    from storage import get_database
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Convert ISO string timestamps into native datetimes")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    report = await migrate_datetimes(get_database(), batch_size=args.batch_size)
+    logger.info("Datetime migration finished")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
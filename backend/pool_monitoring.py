@@ -0,0 +1,82 @@
+"""
+Connection pool metrics for MongoDB
+A pymongo ConnectionPoolListener keeping, per server, the open and checked
+out connections, the configured maximum and how long requests waited to
+check a connection out, so the pool can be sized for the worker count:
+utilization is checked_out / max_size, and a growing checkout wait means
+requests queue for connections.
+"""
+import threading
+import time
+
+from pymongo import monitoring
+
+import metrics
+
+CHECKOUT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+pool_connections = metrics.REGISTRY.gauge(
+    "siriu_db_pool_connections", "Open connections per server", ("server",))
+pool_checked_out = metrics.REGISTRY.gauge(
+    "siriu_db_pool_checked_out", "Connections in use per server", ("server",))
+pool_max_size = metrics.REGISTRY.gauge(
+    "siriu_db_pool_max_size", "Configured maximum pool size per server", ("server",))
+pool_checkout_wait = metrics.REGISTRY.histogram(
+    "siriu_db_pool_checkout_wait_seconds", "Time spent waiting to check a connection out", ("server",),
+    CHECKOUT_BUCKETS)
+pool_checkout_failures_total = metrics.REGISTRY.counter(
+    "siriu_db_pool_checkout_failures_total", "Failed connection checkouts by server and reason", ("server", "reason"))
+
+
+def _server(address) -> str:
+    host, port = address
+    return f"{host}:{port}"
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Translate pool events into the pool metrics (events arrive on Motor's worker threads)"""
+
+    def __init__(self):
+        # A checkout starts and ends on the same thread
+        self._checkouts = threading.local()
+
+    def pool_created(self, event):
+        pool_max_size.set((_server(event.address),), event.options.get("maxPoolSize", 100))
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pool_connections.inc((_server(event.address),))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pool_connections.dec((_server(event.address),))
+
+    def connection_check_out_started(self, event):
+        self._checkouts.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._observe_wait(event.address)
+        pool_checkout_failures_total.inc((_server(event.address), str(event.reason)))
+
+    def connection_checked_out(self, event):
+        self._observe_wait(event.address)
+        pool_checked_out.inc((_server(event.address),))
+
+    def connection_checked_in(self, event):
+        pool_checked_out.dec((_server(event.address),))
+
+    def _observe_wait(self, address):
+        started = getattr(self._checkouts, "started", None)
+        if started is not None:
+            self._checkouts.started = None
+            pool_checkout_wait.observe((_server(address),), time.perf_counter() - started)
@@ -0,0 +1,309 @@
+"""
+On-demand sampling profiler
+A background thread samples the event loop thread's Python stack while a
+profiling session is active, and database operations are added as
+"[db] collection.operation" frames weighted by their duration, so awaited
+DB time shows up next to CPU time. Output is collapsed stacks (flamegraph.pl,
+speedscope, inferno) or speedscope JSON. With no session active the only
+cost is a header check per request.
+"""
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+from starlette.responses import JSONResponse, Response
+
+import db_monitoring
+import metrics
+
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+PROFILE_FORMATS = ("speedscope", "collapsed")
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY = "_profile"
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+class ProfileSession:
+    """Stack weights (in seconds) collected for one request or one time window"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.samples = 0
+        self.stacks: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stack: Tuple[str, ...], weight: float, sample: bool = False):
+        with self._lock:
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + weight
+            if sample:
+                self.samples += 1
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def _items(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return sorted(self.stacks.items())
+
+    def collapsed(self) -> str:
+        """One "frame;frame;frame weight" line per stack, weights in microseconds"""
+        lines = [f"{';'.join(stack)} {round(weight * 1e6)}" for stack, weight in self._items()]
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self) -> dict:
+        """Sampled profile in the speedscope file format, weights in milliseconds"""
+        frame_index: Dict[str, int] = {}
+        frames, samples, weights = [], [], []
+        for stack, weight in self._items():
+            indexes = []
+            for name in stack:
+                if name not in frame_index:
+                    frame_index[name] = len(frames)
+                    frames.append({"name": name})
+                indexes.append(frame_index[name])
+            samples.append(indexes)
+            weights.append(round(weight * 1000, 3))
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": self.name,
+            "exporter": "siriu-profiler",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+# Sessions sampling every request, and sessions bound to a single request task
+_global_sessions: List[ProfileSession] = []
+_task_sessions: Dict[asyncio.Task, ProfileSession] = {}
+# "METHOD /route" of the requests running while any session is active
+_task_labels: Dict[asyncio.Task, str] = {}
+_request_label: ContextVar[Optional[str]] = ContextVar("siriu_profile_label", default=None)
+_request_session: ContextVar[Optional[ProfileSession]] = ContextVar("siriu_profile_session", default=None)
+
+_state_lock = threading.Lock()
+_sampler: Optional["_Sampler"] = None
+
+
+def _active() -> bool:
+    return bool(_global_sessions or _task_sessions)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    location = "/".join(path[-2:])
+    # ';' separates frames in the collapsed format
+    return f"{code.co_qualname} ({location}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _is_loop_dispatch(frame) -> bool:
+    code = frame.f_code
+    return code.co_name == "_run" and code.co_filename.replace("\\", "/").endswith("asyncio/events.py")
+
+
+def _frame_stack(frame) -> Tuple[str, ...]:
+    """Root-first stack of a frame, starting below the event loop callback dispatch"""
+    names = []
+    while frame is not None and not _is_loop_dispatch(frame):
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return tuple(names)
+
+
+class _Sampler(threading.Thread):
+    """Samples the event loop thread every PROFILE_INTERVAL while sessions are active"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, thread_id: int):
+        super().__init__(name="siriu-profiler", daemon=True)
+        self.loop = loop
+        self.thread_id = thread_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self.stopped.wait(PROFILE_INTERVAL):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            task = asyncio.current_task(self.loop)
+            frame = sys._current_frames().get(self.thread_id)
+            if task is None or frame is None:
+                # Idle loop (waiting on I/O or awaited DB calls)
+                continue
+            stack = _frame_stack(frame)
+            label = _task_labels.get(task)
+            if label:
+                stack = (label,) + stack
+            for session in list(_global_sessions):
+                session.add(stack, elapsed, sample=True)
+            session = _task_sessions.get(task)
+            if session is not None:
+                session.add(stack, elapsed, sample=True)
+
+
+def _record_db_operation(collection: str, operation: str, duration: float, succeeded: bool, command=None):
+    """db_monitoring listener adding DB time as frames (registered only while profiling)"""
+    session = _request_session.get()
+    if session is None and not _global_sessions:
+        return
+    label = _request_label.get()
+    stack = (label,) if label else ()
+    stack += (f"[db] {collection or 'command'}.{operation}",)
+    for global_session in list(_global_sessions):
+        global_session.add(stack, duration)
+    if session is not None:
+        session.add(stack, duration)
+
+
+def _start(session: ProfileSession, task: Optional[asyncio.Task] = None):
+    global _sampler
+    with _state_lock:
+        if task is None:
+            _global_sessions.append(session)
+        else:
+            _task_sessions[task] = session
+        if _sampler is None:
+            _sampler = _Sampler(asyncio.get_running_loop(), threading.get_ident())
+            _sampler.start()
+            db_monitoring.add_listener(_record_db_operation)
+
+
+def _stop(session: ProfileSession, task: Optional[asyncio.Task] = None):
+    global _sampler
+    with _state_lock:
+        if task is None:
+            _global_sessions.remove(session)
+        else:
+            _task_sessions.pop(task, None)
+        session.finished = time.perf_counter()
+        if not _active() and _sampler is not None:
+            _sampler.stopped.set()
+            _sampler = None
+            db_monitoring.remove_listener(_record_db_operation)
+            _task_labels.clear()
+
+
+async def profile_for(seconds: float, name: Optional[str] = None) -> ProfileSession:
+    """Profile every request served during the next ``seconds``"""
+    session = ProfileSession(name or f"SIRIU API ({seconds:g}s)")
+    _start(session)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        _stop(session)
+    return session
+
+
+def profile_response(session: ProfileSession, profile_format: str) -> Response:
+    """Render a finished session in the requested format"""
+    headers = {
+        "X-Profile-Samples": str(session.samples),
+        "X-Profile-Duration-Ms": f"{session.duration * 1000:.1f}",
+    }
+    if profile_format == "collapsed":
+        return Response(session.collapsed(), media_type="text/plain; charset=utf-8", headers=headers)
+    return Response(json.dumps(session.speedscope()), media_type="application/json", headers=headers)
+
+
+def requested_format(scope) -> Optional[str]:
+    """Profile format asked for through the X-Profile header or the _profile query flag"""
+    value = None
+    for name, header_value in scope.get("headers", ()):
+        if name == PROFILE_HEADER:
+            value = header_value.decode("latin-1")
+            break
+    query_string = scope.get("query_string", b"")
+    if value is None and PROFILE_QUERY.encode() in query_string:
+        values = parse_qs(query_string.decode("latin-1")).get(PROFILE_QUERY)
+        value = values[0] if values else None
+    if value is None:
+        return None
+    value = value.strip().lower()
+    return value if value in PROFILE_FORMATS else "speedscope"
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling single requests on demand and labelling requests during timed sessions
+
+    A request carrying ``X-Profile: speedscope|collapsed`` (or ``?_profile=``)
+    is executed normally and answered with its profile instead of its body,
+    when ``authorize(scope)`` allows it.
+    """
+
+    def __init__(self, app, fastapi_app=None, authorize=None):
+        self.app = app
+        self.fastapi_app = fastapi_app
+        self.authorize = authorize
+
+    def _label(self, scope) -> str:
+        route = metrics.route_template(self.fastapi_app, scope) if self.fastapi_app else scope["path"]
+        return f"{scope['method']} {route}"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile_format = requested_format(scope)
+        if profile_format is None:
+            if not _global_sessions:
+                await self.app(scope, receive, send)
+            else:
+                await self._run_labelled(scope, receive, send)
+            return
+
+        if self.authorize is None or not await self.authorize(scope):
+            response = JSONResponse({"detail": "Solo el superadmin puede perfilar solicitudes"}, status_code=403)
+            await response(scope, receive, send)
+            return
+
+        label = self._label(scope)
+        session = ProfileSession(label)
+        status_code = 500
+
+        async def discard(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+        task = asyncio.current_task()
+        session_token = _request_session.set(session)
+        _start(session, task)
+        try:
+            await self._run_labelled(scope, receive, discard)
+        finally:
+            _stop(session, task)
+            _request_session.reset(session_token)
+        response = profile_response(session, profile_format)
+        response.headers["X-Profiled-Status"] = str(status_code)
+        await response(scope, receive, send)
+
+    async def _run_labelled(self, scope, receive, send):
+        task = asyncio.current_task()
+        label = self._label(scope)
+        label_token = _request_label.set(label)
+        _task_labels[task] = label
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _task_labels.pop(task, None)
+            _request_label.reset(label_token)
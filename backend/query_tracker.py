@@ -0,0 +1,253 @@
+"""
+Per-request database query tracking
+Counts DB operations and cumulative DB time for every HTTP request, logs
+requests above the configured thresholds with their (redacted) query shapes
+and the explain plan of any collection scan, and offers a query budget
+assertion for tests
+"""
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Set
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+import db_monitoring
+import metrics
+
+logger = logging.getLogger("siriu.slow_requests")
+
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "1000"))
+SLOW_REQUEST_QUERIES = int(os.environ.get("SLOW_REQUEST_QUERIES", "20"))
+SLOW_REQUEST_EXPLAIN = os.environ.get("SLOW_REQUEST_EXPLAIN", "true").lower() == "true"
+MAX_EXPLAINS_PER_REQUEST = 5
+
+# Operations whose filter can be explained as a find
+_EXPLAINABLE = {"find", "aggregate", "distinct", "findAndModify", "update", "delete"}
+
+db_queries_per_request = metrics.REGISTRY.histogram(
+    "siriu_http_db_operations_per_request", "Database operations issued per HTTP request",
+    ("method", "route"), buckets=(1, 2, 3, 5, 10, 20, 50, 100, 250))
+db_time_per_request = metrics.REGISTRY.histogram(
+    "siriu_http_db_seconds_per_request", "Cumulative database time per HTTP request", ("method", "route"))
+slow_requests_total = metrics.REGISTRY.counter(
+    "siriu_slow_requests_total", "Requests over the slow-request thresholds", ("method", "route"))
+
+
+def query_shape(value, in_pipeline: bool = False):
+    """Replace literal values in a filter or pipeline with '?' keeping keys and operators"""
+    if isinstance(value, dict):
+        shaped = {}
+        for key, item in value.items():
+            if in_pipeline and key.startswith("$") and key != "$match":
+                # Stages other than $match are written in code, not built from user input
+                shaped[key] = item
+            else:
+                shaped[key] = query_shape(item)
+        return shaped
+    if isinstance(value, list):
+        if in_pipeline or (value and all(isinstance(item, dict) for item in value)):
+            return [query_shape(item, in_pipeline) for item in value]
+        return ["?"] if value else []
+    return "?"
+
+
+def _shape_key(collection: str, operation: str, command) -> str:
+    shape = query_shape(command, in_pipeline=isinstance(command, list)) if command is not None else None
+    return f"{collection}.{operation} {json.dumps(shape, sort_keys=True, default=str)}"
+
+
+class QueryLog:
+    """Database operations observed while a request (or a test block) runs"""
+
+    def __init__(self):
+        self.operations: List[tuple] = []
+        self.db_time = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        return len(self.operations)
+
+    def add(self, collection: str, operation: str, duration: float, command):
+        with self._lock:
+            self.operations.append((collection, operation, duration, command))
+            self.db_time += duration
+
+    def shapes(self) -> List[Dict[str, Any]]:
+        """Operations grouped by redacted query shape, most repeated first"""
+        grouped: Dict[str, Dict[str, Any]] = {}
+        for collection, operation, duration, command in self.operations:
+            key = _shape_key(collection, operation, command)
+            entry = grouped.setdefault(key, {"shape": key, "count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += duration * 1000
+        for entry in grouped.values():
+            entry["total_ms"] = round(entry["total_ms"], 2)
+        return sorted(grouped.values(), key=lambda e: (-e["count"], -e["total_ms"]))
+
+
+_current_request: ContextVar[Optional[QueryLog]] = ContextVar("siriu_query_log", default=None)
+_captures: List[QueryLog] = []
+
+
+def _record(collection: str, operation: str, duration: float, succeeded: bool, command=None):
+    request_log = _current_request.get()
+    if request_log is not None:
+        request_log.add(collection, operation, duration, command)
+    for capture in _captures:
+        capture.add(collection, operation, duration, command)
+
+
+db_monitoring.add_listener(_record)
+
+
+def current_query_log() -> Optional[QueryLog]:
+    """Query log of the request being served, if any"""
+    return _current_request.get()
+
+
+def _has_collscan(stage: Optional[Dict[str, Any]]) -> bool:
+    while stage:
+        if stage.get("stage") == "COLLSCAN":
+            return True
+        inputs = stage.get("inputStages") or []
+        if any(_has_collscan(child) for child in inputs):
+            return True
+        stage = stage.get("inputStage")
+    return False
+
+
+def _redact_plan(plan):
+    """Strip literal values (filters and index bounds) from an explain plan"""
+    if isinstance(plan, dict):
+        redacted = {}
+        for key, value in plan.items():
+            if key in ("filter", "parsedQuery"):
+                redacted[key] = query_shape(value)
+            elif key == "indexBounds":
+                redacted[key] = {field: ["?"] for field in value}
+            else:
+                redacted[key] = _redact_plan(value)
+        return redacted
+    if isinstance(plan, list):
+        return [_redact_plan(item) for item in plan]
+    return plan
+
+
+def _explain_command(collection: str, operation: str, command) -> Optional[Dict[str, Any]]:
+    if operation not in _EXPLAINABLE or command is None or not collection:
+        return None
+    if isinstance(command, list):
+        return {"aggregate": collection, "pipeline": command, "cursor": {}}
+    return {"find": collection, "filter": command}
+
+
+async def explain_collscans(db, query_log: QueryLog) -> List[Dict[str, Any]]:
+    """Winning plans of the distinct query shapes that scan a whole collection"""
+    seen = set()
+    findings = []
+    for collection, operation, _, command in query_log.operations:
+        key = _shape_key(collection, operation, command)
+        explain = _explain_command(collection, operation, command)
+        if explain is None or key in seen:
+            continue
+        seen.add(key)
+        if len(seen) > MAX_EXPLAINS_PER_REQUEST:
+            break
+        try:
+            result = await db.command("explain", explain, verbosity="queryPlanner")
+        except Exception as e:
+            logger.debug(f"explain failed for {key}: {e}")
+            continue
+        plan = result.get("queryPlanner", {}).get("winningPlan")
+        if _has_collscan(plan):
+            findings.append({"shape": key, "winning_plan": _redact_plan(plan)})
+    return findings
+
+
+class QueryTrackingMiddleware:
+    """ASGI middleware attaching a QueryLog to each request and logging slow or chatty ones"""
+
+    def __init__(self, app, fastapi_app=None, get_db: Callable[[], Any] = None):
+        self.app = app
+        self.fastapi_app = fastapi_app
+        self.get_db = get_db
+        # The loop only keeps weak references to tasks; unreferenced reports could be collected mid-run
+        self._reports: Set[asyncio.Task] = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        query_log = QueryLog()
+        token = _current_request.set(query_log)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_request.reset(token)
+            elapsed = time.perf_counter() - started
+            method = scope["method"]
+            route = metrics.route_template(self.fastapi_app, scope) if self.fastapi_app else scope["path"]
+            db_queries_per_request.observe((method, route), query_log.count)
+            db_time_per_request.observe((method, route), query_log.db_time)
+            if elapsed * 1000 >= SLOW_REQUEST_MS or query_log.count >= SLOW_REQUEST_QUERIES:
+                slow_requests_total.inc((method, route))
+                # Explain runs after the response so it never adds to the request latency
+                report = asyncio.get_running_loop().create_task(self._report(method, route, elapsed, query_log))
+                self._reports.add(report)
+                report.add_done_callback(self._reports.discard)
+
+    async def _report(self, method: str, route: str, elapsed: float, query_log: QueryLog):
+        collscans = []
+        if SLOW_REQUEST_EXPLAIN and self.get_db is not None:
+            collscans = await explain_collscans(self.get_db(), query_log)
+        logger.warning(json.dumps({
+            "event": "slow_request",
+            "method": method,
+            "route": route,
+            "duration_ms": round(elapsed * 1000, 2),
+            "db_operations": query_log.count,
+            "db_time_ms": round(query_log.db_time * 1000, 2),
+            "query_shapes": query_log.shapes(),
+            "collscans": collscans,
+        }, default=str))
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised by assert_query_budget when a block issues too many DB operations"""
+
+
+class assert_query_budget:
+    """Fail a test when the wrapped block exceeds a DB operation (or time) budget
+
+        with assert_query_budget(3):
+            await client.get("/api/dashboard/stats", headers=headers)
+    """
+
+    def __init__(self, max_operations: int, max_db_ms: Optional[float] = None):
+        self.max_operations = max_operations
+        self.max_db_ms = max_db_ms
+        self.log = QueryLog()
+
+    def __enter__(self) -> QueryLog:
+        _captures.append(self.log)
+        return self.log
+
+    def __exit__(self, exc_type, exc, tb):
+        _captures.remove(self.log)
+        if exc_type is not None:
+            return False
+        problems = []
+        if self.log.count > self.max_operations:
+            problems.append(f"{self.log.count} database operations (budget {self.max_operations})")
+        if self.max_db_ms is not None and self.log.db_time * 1000 > self.max_db_ms:
+            problems.append(f"{self.log.db_time * 1000:.1f} ms of database time (budget {self.max_db_ms} ms)")
+        if problems:
+            shapes = "\n".join(f"  {entry['count']:4d}x {entry['shape']}" for entry in self.log.shapes())
+            raise QueryBudgetExceeded(f"Query budget exceeded: {', '.join(problems)}\n{shapes}")
+        return False
@@ -0,0 +1,84 @@
+"""
+Read-preference routing for MongoDB replica sets
+Heavy read workloads can be served by secondaries so they do not compete
+with writes on the primary. Workloads are configured next to MONGO_URL as
+"workload=mode[:maxStalenessSeconds]" pairs:
+
+    MONGO_READ_PREFERENCES="bi=secondaryPreferred:120,export=secondaryPreferred:120"
+
+"bi" covers the dashboards and "export" the Excel/PDF exports; every other
+read (including reads right after a write) stays on the primary. Workloads
+not listed read from the primary too. maxStalenessSeconds must be at least
+90 (a MongoDB requirement). Other storage backends ignore the setting.
+
+Reads sent with a non-primary preference are counted per route, mode and
+the replica that served them (siriu_db_routed_reads_total).
+"""
+from typing import Dict, Optional, Tuple
+import os
+
+from pymongo import monitoring, read_preferences
+
+import metrics
+
+READ_MODES = {
+    "primary": read_preferences.Primary,
+    "primaryPreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondaryPreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+MIN_MAX_STALENESS = 90
+
+routed_reads_total = metrics.REGISTRY.counter(
+    "siriu_db_routed_reads_total", "Reads sent with a non-primary read preference by route and serving replica",
+    ("route", "read_preference", "server"))
+
+
+def parse_read_preferences(text: str) -> Dict[str, Tuple[str, Optional[int]]]:
+    """"bi=secondaryPreferred:120,export=nearest" -> {"bi": ("secondaryPreferred", 120), "export": ("nearest", None)}"""
+    preferences = {}
+    for part in filter(None, (piece.strip() for piece in text.split(","))):
+        workload, _, spec = part.partition("=")
+        mode, _, staleness = spec.strip().partition(":")
+        if mode not in READ_MODES:
+            raise ValueError(f"Unknown read preference '{mode}' for '{workload}', expected one of {list(READ_MODES)}")
+        max_staleness = int(staleness) if staleness else None
+        if max_staleness is not None and (mode == "primary" or max_staleness < MIN_MAX_STALENESS):
+            raise ValueError(f"maxStalenessSeconds for '{workload}' needs a non-primary mode and at least "
+                             f"{MIN_MAX_STALENESS} seconds")
+        preferences[workload.strip()] = (mode, max_staleness)
+    return preferences
+
+
+def read_preference(mode: str, max_staleness: Optional[int] = None):
+    if mode == "primary":
+        return read_preferences.Primary()
+    return READ_MODES[mode](max_staleness=-1 if max_staleness is None else max_staleness)
+
+
+def route_reads(db, workload: str, preferences: Optional[Dict[str, Tuple[str, Optional[int]]]] = None):
+    """Database handle for a workload: db itself, or a view of it with the workload's read preference"""
+    if preferences is None:
+        preferences = parse_read_preferences(os.environ.get("MONGO_READ_PREFERENCES", ""))
+    # Only Motor databases have read preferences (checked on the type: MemoryDB answers any attribute)
+    if workload not in preferences or getattr(type(db), "with_options", None) is None:
+        return db
+    return db.with_options(read_preference=read_preference(*preferences[workload]))
+
+
+class RoutedReadListener(monitoring.CommandListener):
+    """Count the replica each non-primary read went to, under the route of the request that issued it"""
+
+    def started(self, event):
+        preference = event.command.get("$readPreference")
+        if not preference:
+            return
+        host, port = event.connection_id
+        routed_reads_total.inc((metrics.current_route() or "background", preference.get("mode", ""), f"{host}:{port}"))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
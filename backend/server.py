@@ -1,19 +1,23 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Query, Header, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
-from io import BytesIO
-from fastapi.responses import StreamingResponse
+from io import BytesIO, StringIO
+import asyncio
+import base64
+import csv
+import json
+from fastapi.responses import StreamingResponse, Response
+from pymongo import ReturnDocument
 import openpyxl
 from reportlab.lib.pagesizes import letter, landscape
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
@@ -23,24 +27,37 @@ from reportlab.lib import colors
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# Database connection (MongoDB or Firestore)
-USE_FIRESTORE = os.getenv('USE_FIRESTORE', 'false').lower() == 'true'
-
-if USE_FIRESTORE:
-    from firestore_db import get_database
-    db = get_database()
-    logger = logging.getLogger(__name__)
-    logger.info("Using Firestore database")
-else:
-    mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-    client = AsyncIOMotorClient(mongo_url)
-    db = client[os.environ.get('DB_NAME', 'test_database')]
-    logger = logging.getLogger(__name__)
-    logger.info("Using MongoDB database")
+# Database connection (MongoDB, Firestore or in-memory)
+from storage import get_storage_backend, get_database, warm_up
+from metrics import REGISTRY, CONTENT_TYPE, MetricsMiddleware, metrics_authorized
+from query_tracker import QueryTrackingMiddleware
+import profiler
+import history_store
+from history_store import HISTORY_VERSION_INDEX, flush_pending, history_version, record_change, reconstruct
+from history_writer import HistoryWriter
+import inventory_snapshots
+import change_feed
+import datetime_codec
+from fast_json import FastJSONResponse, RowShape
+import history_archive
+import batch
+import single_flight
+import read_routing
+from admission import AdmissionMiddleware, build_limiters
+
+STORAGE_BACKEND = get_storage_backend()
+USE_FIRESTORE = STORAGE_BACKEND == "firestore"
+db = get_database(STORAGE_BACKEND)
+# Dashboards and exports may be served by secondaries (MONGO_READ_PREFERENCES); everything else reads the primary
+bi_db = read_routing.route_reads(db, "bi")
+export_db = read_routing.route_reads(db, "export")
+logger = logging.getLogger(__name__)
+logger.info(f"Using {STORAGE_BACKEND} database")
 
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY")
 if not SECRET_KEY:
     raise ValueError("No JWT_SECRET_KEY set for Flask application")
@@ -65,14 +82,22 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # Sub-requests of /api/batch reuse the user the batch was authenticated with
+    user = batch.authenticated_user(request.scope)
+    if user is not None:
+        return user
+    return await user_from_token(credentials.credentials)
+
+async def user_from_token(token: Optional[str]):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudo validar las credenciales",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if not token:
+        raise credentials_exception
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
@@ -127,6 +152,8 @@ class Equipment(BaseModel):
     observaciones: Optional[str] = ""
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    # Optimistic concurrency: incremented by every update, checked against If-Match
+    version: int = 0
     created_by: str = ""
 
 class EquipmentCreate(BaseModel):
@@ -156,6 +183,8 @@ class EquipmentUpdate(BaseModel):
     fecha_adquisicion: Optional[str] = None
     estado_operativo: Optional[str] = None
     observaciones: Optional[str] = None
+    # Expected current version (alternative to the If-Match header)
+    version: Optional[int] = None
 
 class HistoryEntry(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -164,8 +193,13 @@ class HistoryEntry(BaseModel):
     action: str
     changed_by: str
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    # Only the changed fields; "created" entries hold the whole document
     old_values: Optional[Dict[str, Any]] = {}
     new_values: Optional[Dict[str, Any]] = {}
+    changed_fields: List[str] = []
+    version: Optional[int] = None
+    checkpoint: bool = False
+    snapshot: Optional[Dict[str, Any]] = None
 
 class Location(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -175,6 +209,7 @@ class Location(BaseModel):
     salon_aula: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    version: int = 0
 
 class LocationCreate(BaseModel):
     edificio: str
@@ -185,6 +220,7 @@ class LocationUpdate(BaseModel):
     edificio: Optional[str] = None
     piso: Optional[str] = None
     salon_aula: Optional[str] = None
+    version: Optional[int] = None
 
 class Department(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -195,6 +231,7 @@ class Department(BaseModel):
     trabajadores: List[Dict[str, str]] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    version: int = 0
 
 class DepartmentCreate(BaseModel):
     nombre: str
@@ -207,6 +244,7 @@ class DepartmentUpdate(BaseModel):
     ubicacion_id: Optional[str] = None
     numero_trabajadores: Optional[int] = None
     trabajadores: Optional[List[Dict[str, str]]] = None
+    version: Optional[int] = None
 
 class TipoBien(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -214,12 +252,14 @@ class TipoBien(BaseModel):
     nombre: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    version: int = 0
 
 class TipoBienCreate(BaseModel):
     nombre: str
 
 class TipoBienUpdate(BaseModel):
     nombre: Optional[str] = None
+    version: Optional[int] = None
 
 class Marca(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -227,12 +267,14 @@ class Marca(BaseModel):
     nombre: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    version: int = 0
 
 class MarcaCreate(BaseModel):
     nombre: str
 
 class MarcaUpdate(BaseModel):
     nombre: Optional[str] = None
+    version: Optional[int] = None
 
 class Edificio(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -241,6 +283,7 @@ class Edificio(BaseModel):
     direccion: Optional[str] = ""
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    version: int = 0
 
 class EdificioCreate(BaseModel):
     nombre: str
@@ -249,6 +292,16 @@ class EdificioCreate(BaseModel):
 class EdificioUpdate(BaseModel):
     nombre: Optional[str] = None
     direccion: Optional[str] = None
+    version: Optional[int] = None
+
+# List endpoints encode trusted DB rows directly instead of through response_model
+EQUIPMENT_ROWS = RowShape(Equipment)
+LOCATION_ROWS = RowShape(Location)
+DEPARTMENT_ROWS = RowShape(Department)
+TIPO_BIEN_ROWS = RowShape(TipoBien)
+MARCA_ROWS = RowShape(Marca)
+EDIFICIO_ROWS = RowShape(Edificio)
+USER_ROWS = RowShape(User)
 
 # Auth Routes
 @api_router.post("/auth/register", response_model=User)
@@ -268,7 +321,6 @@ async def register_user(user_data: UserCreate, current_user: dict = Depends(get_
     
     doc = user_obj.model_dump()
     doc["password"] = get_password_hash(user_data.password)
-    doc["created_at"] = doc["created_at"].isoformat()
     
     await db.users.insert_one(doc)
     return user_obj
@@ -322,12 +374,80 @@ async def change_password(
     hashed_password = get_password_hash(user_data.new_password)
     await db.users.update_one(
         {"id": current_user["id"]}, 
-        {"$set": {"password": hashed_password, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"password": hashed_password, "updated_at": datetime.now(timezone.utc)}}
     )
     
     return {"message": "Contraseña actualizada exitosamente"}
 
 # Equipment Routes
+# Each sortable field has a (field, id) index (startup and init_mongodb.js), so single-key sorts are read in
+# index order; multi-key sorts are sorted by the database, bounded by the page limit pushed into the query
+EQUIPMENT_PAGE_SIZE = 1000
+EQUIPMENT_SORT_FIELDS = {"numero_serie", "numero_factura", "numero_inventario", "tipo_bien", "estado_operativo",
+                         "departamento", "ubicacion", "resguardante", "marca", "modelo", "updated_at"}
+
+def parse_fields(fields: str, allowed: List[str]) -> List[str]:
+    """Sparse fieldset from a comma-separated list (the id is always included)"""
+    selected = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos desconocidos: {', '.join(unknown)}")
+    return ["id", *selected]
+
+def parse_sort(sort: str, allowed: set) -> List[tuple]:
+    """Sort keys from "campo,-otro" (- for descending), with the id as final tiebreak
+
+    The id follows the direction of the last key, so a (field, id) index serves both directions.
+    """
+    order = []
+    for key in (part.strip() for part in sort.split(",")):
+        name = key.lstrip("-")
+        if name not in allowed:
+            raise HTTPException(status_code=400, detail=f"No se puede ordenar por '{name}'")
+        order.append((name, -1 if key.startswith("-") else 1))
+    return order + [("id", order[-1][1])]
+
+def sort_rows(documents: List[dict], order: List[tuple]) -> List[dict]:
+    """Sort documents in Python like the database would (missing values first)"""
+    for key, direction in reversed(order):
+        documents.sort(key=lambda doc: (doc.get(key) is not None, doc.get(key) or ""), reverse=direction < 0)
+    return documents
+
+EQUIPMENT_FACETS = ("tipo_bien", "estado_operativo", "departamento", "ubicacion")
+
+def facet_pipeline(search_query: dict, filters: dict, order: List[tuple], offset: int, limit: int,
+                   projection: dict) -> List[dict]:
+    """One aggregation returning a page of results, their total and the facet counts
+
+    Each facet is counted under every filter except its own, so a dropdown
+    keeps showing its alternatives once one of its values is selected.
+    """
+    facets = {
+        "items": [{"$match": filters}, {"$sort": dict(order)}, {"$skip": offset}, {"$limit": limit},
+                  {"$project": projection}],
+        "total": [{"$match": filters}, {"$count": "count"}],
+    }
+    for field in EQUIPMENT_FACETS:
+        others = {key: value for key, value in filters.items() if key != field}
+        facets[field] = [{"$match": others}, {"$group": {"_id": f"${field}", "count": {"$sum": 1}}}]
+    return [{"$match": search_query}, {"$facet": facets}]
+
+def count_facets(documents: List[dict], filters: dict) -> dict:
+    """Facet counts computed in Python, for as-of listings and backends without aggregation"""
+    counts = {field: {} for field in EQUIPMENT_FACETS}
+    for doc in documents:
+        for field in EQUIPMENT_FACETS:
+            value = doc.get(field)
+            if value is not None and all(doc.get(k) == v for k, v in filters.items() if k != field):
+                counts[field][value] = counts[field].get(value, 0) + 1
+    return counts
+
+def facet_response(items: List[dict], total: int, counts: dict, offset: int, limit: int, shape: RowShape):
+    facets = {field: dict(sorted(values.items(), key=lambda item: (-item[1], str(item[0]))))
+              for field, values in counts.items()}
+    return FastJSONResponse({"items": shape.conform(items), "total": total, "offset": offset, "limit": limit,
+                             "facets": facets})
+
 @api_router.get("/equipment", response_model=List[Equipment])
 async def get_equipment(
     current_user: dict = Depends(get_current_user),
@@ -335,48 +455,272 @@ async def get_equipment(
     estado_operativo: Optional[str] = None,
     departamento: Optional[str] = None,
     ubicacion: Optional[str] = None,
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    as_of: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    sort: Optional[str] = None,
+    facets: bool = False,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(EQUIPMENT_PAGE_SIZE, ge=1, le=EQUIPMENT_PAGE_SIZE)
 ):
-    query = {}
-    if tipo_bien:
-        query["tipo_bien"] = tipo_bien
-    if estado_operativo:
-        query["estado_operativo"] = estado_operativo
-    if departamento:
-        query["departamento"] = departamento
-    if ubicacion:
-        query["ubicacion"] = ubicacion
+    """List equipment; fields=a,b,c returns only those fields, sort=a,-b orders by indexed fields
+
+    facets=true returns {"items", "total", "offset", "limit", "facets"}: a
+    page of results plus counts per tipo_bien, estado_operativo, departamento
+    and ubicacion under the current filters.
+    """
+    shape = EQUIPMENT_ROWS.subset(parse_fields(fields, EQUIPMENT_ROWS.fields)) if fields else EQUIPMENT_ROWS
+    order = parse_sort(sort, EQUIPMENT_SORT_FIELDS) if sort else None
+    if facets or offset:
+        # Pages need a stable order
+        order = order or [("id", 1)]
+    filters = {k: v for k, v in {"tipo_bien": tipo_bien, "estado_operativo": estado_operativo,
+                                  "departamento": departamento, "ubicacion": ubicacion}.items() if v}
+
+    if as_of:
+        searched = inventory_snapshots.filter_inventory(
+            await inventory_snapshots.inventory_as_of(db, history_timestamp(as_of)), {}, search)
+        equipment_list = inventory_snapshots.filter_inventory(searched, filters)
+        if order:
+            sort_rows(equipment_list, order)
+        page = shape.project(equipment_list[offset:offset + limit])
+        if facets:
+            return facet_response(page, len(equipment_list), count_facets(searched, filters), offset, limit, shape)
+        return shape.response(page)
+
+    search_query = {}
     if search:
-        query["$or"] = [
+        search_query["$or"] = [
             {"numero_serie": {"$regex": search, "$options": "i"}},
             {"marca": {"$regex": search, "$options": "i"}},
             {"modelo": {"$regex": search, "$options": "i"}},
             {"resguardante": {"$regex": search, "$options": "i"}}
         ]
-    
-    equipment_list = await db.equipment.find(query, {"_id": 0}).to_list(1000)
-    for eq in equipment_list:
-        if isinstance(eq.get("created_at"), str):
-            eq["created_at"] = datetime.fromisoformat(eq["created_at"])
-        if isinstance(eq.get("updated_at"), str):
-            eq["updated_at"] = datetime.fromisoformat(eq["updated_at"])
-    return equipment_list
+
+    if facets and hasattr(db.equipment, "aggregate"):
+        pipeline = facet_pipeline(search_query, filters, order, offset, limit, shape.projection)
+        result = (await db.equipment.aggregate(pipeline).to_list(1))[0]
+        counts = {field: {row["_id"]: row["count"] for row in result[field] if row["_id"] is not None}
+                  for field in EQUIPMENT_FACETS}
+        total = result["total"][0]["count"] if result["total"] else 0
+        return facet_response(result["items"], total, counts, offset, limit, shape)
+    if facets:
+        # The Firestore adapter has no aggregation: count from the searched documents
+        searched = await db.equipment.find(search_query, {"_id": 0}).to_list(None)
+        matching = sort_rows(inventory_snapshots.filter_inventory(searched, filters), order)
+        return facet_response(shape.project(matching[offset:offset + limit]), len(matching),
+                              count_facets(searched, filters), offset, limit, shape)
+
+    cursor = db.equipment.find({**filters, **search_query}, shape.projection)
+    if order:
+        cursor = cursor.sort(order)
+    if offset:
+        cursor = cursor.skip(offset)
+    return shape.response(await cursor.limit(limit).to_list(limit))
+
+# Delta sync
+SYNC_PAGE_SIZE = 1000
+SYNC_MAX_PAGE_SIZE = 5000
+# Tokens step back this far so writes committed late (or on a skewed clock) are not missed
+SYNC_CLOCK_SKEW = timedelta(seconds=float(os.environ.get("SYNC_CLOCK_SKEW_SECONDS", "5")))
+TOMBSTONE_RETENTION_DAYS = float(os.environ.get("EQUIPMENT_TOMBSTONE_RETENTION_DAYS", "90"))
+
+def encode_sync_token(state: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_sync_token(token: str) -> dict:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return {
+            "base": datetime.fromisoformat(state["b"]) if state.get("b") else None,
+            "position": state.get("p"),
+            "start": datetime.fromisoformat(state["s"]) if state.get("s") else None,
+            "full": bool(state.get("f")),
+        }
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise HTTPException(status_code=400, detail="Token de sincronización inválido")
+
+@api_router.get("/equipment/changes")
+async def get_equipment_changes(
+    since: Optional[str] = None,
+    limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=SYNC_MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user)
+):
+    """Equipment created or updated since a sync token, plus tombstones of deleted equipment
+
+    Without a token the whole inventory is returned (in pages). Follow
+    "token" while has_more is true, then keep the last token for the next
+    refresh; 410 means it is older than the tombstones and a full sync is needed.
+    """
+    state = decode_sync_token(since) if since else {"base": None, "position": None, "start": None, "full": False}
+    base, position = state["base"], state["position"]
+    start = state["start"] or datetime.now(timezone.utc)
+    if base is not None and base < datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+        raise HTTPException(status_code=410, detail="Token de sincronización expirado; descarga el inventario completo")
+
+    full = base is None or state["full"]
+    if not full and position is None:
+        # Documents still holding a legacy string updated_at (before migrate_datetimes) cannot be found by
+        # date, so deltas resend everything, keeping the id order for the remaining pages of this refresh
+        full = await db.equipment.find_one({"updated_at": {"$type": "string"}}, {"_id": 0, "id": 1}) is not None
+    if full:
+        # Full sync pages by id, which also covers documents with legacy string dates
+        query = {"id": {"$gt": position[1]}} if position else {}
+        sort = [("id", 1)]
+    else:
+        query = {"updated_at": {"$gte": base}}
+        if position:
+            after = datetime.fromisoformat(position[0])
+            query["$or"] = [{"updated_at": {"$gt": after}}, {"updated_at": after, "id": {"$gt": position[1]}}]
+        sort = [("updated_at", 1), ("id", 1)]
+    documents = await db.equipment.find(query, {"_id": 0}).sort(sort).limit(limit + 1).to_list(limit + 1)
+
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    deleted = []
+    if has_more:
+        last = documents[-1]
+        last_updated = datetime_codec.to_utc(last.get("updated_at"))
+        token = encode_sync_token({
+            "b": base.isoformat() if base else None,
+            "p": [last_updated.isoformat() if last_updated else None, last["id"]],
+            "s": start.isoformat(),
+            "f": 1 if full and base else None,
+        })
+    else:
+        tombstones = await db.equipment_tombstones.find(
+            {"deleted_at": {"$gte": base or start - SYNC_CLOCK_SKEW}}, {"id": 1, "deleted_at": 1, "_id": 0}
+        ).to_list(None)
+        deleted = [{"id": t["id"], "deleted_at": t["deleted_at"]} for t in tombstones]
+        token = encode_sync_token({"b": (start - SYNC_CLOCK_SKEW).isoformat()})
+    return {"changes": documents, "deleted": deleted, "token": token, "has_more": has_more}
 
 @api_router.get("/equipment/{equipment_id}", response_model=Equipment)
 async def get_equipment_by_id(
     equipment_id: str,
+    response: Response,
     current_user: dict = Depends(get_current_user)
 ):
     equipment = await db.equipment.find_one({"id": equipment_id}, {"_id": 0})
     if not equipment:
         raise HTTPException(status_code=404, detail="Equipo no encontrado")
-    
-    if isinstance(equipment.get("created_at"), str):
-        equipment["created_at"] = datetime.fromisoformat(equipment["created_at"])
-    if isinstance(equipment.get("updated_at"), str):
-        equipment["updated_at"] = datetime.fromisoformat(equipment["updated_at"])
+    set_etag(response, equipment)
     return equipment
 
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+HISTORY_SORT = [("timestamp", -1), ("id", -1)]
+
+DETAIL_HISTORY_SIZE = 10
+CUSTODIAN_ASSETS_LIMIT = 50
+CUSTODIAN_ASSET_ROWS = EQUIPMENT_ROWS.subset(
+    ["id", "numero_inventario", "numero_serie", "tipo_bien", "marca", "modelo", "estado_operativo", "ubicacion"])
+
+def parse_location_label(label: str) -> Optional[dict]:
+    """edificio/piso/salon_aula of a label written by the equipment form ("Edificio, Piso 2, Aula 5")"""
+    parts = (label or "").split(", Piso ", 1)
+    if len(parts) != 2 or ", " not in parts[1]:
+        return None
+    piso, salon_aula = parts[1].split(", ", 1)
+    return {"edificio": parts[0], "piso": piso, "salon_aula": salon_aula}
+
+async def find_one_shaped(collection, query: dict, shape: RowShape) -> Optional[dict]:
+    if not query:
+        return None
+    document = await collection.find_one(query, shape.projection)
+    return shape.conform([document])[0] if document else None
+
+async def find_custodian_assets(equipment: dict) -> List[dict]:
+    """Other assets of the equipment's custodian (none when it has no custodian)"""
+    if not equipment.get("resguardante"):
+        return []
+    assets = await db.equipment.find(
+        {"resguardante": equipment["resguardante"], "id": {"$ne": equipment["id"]}},
+        CUSTODIAN_ASSET_ROWS.projection
+    ).sort("id", 1).limit(CUSTODIAN_ASSETS_LIMIT).to_list(CUSTODIAN_ASSETS_LIMIT)
+    return CUSTODIAN_ASSET_ROWS.conform(assets)
+
+@api_router.get("/equipment/{equipment_id}/detail", response_model=Dict[str, Any])
+async def get_equipment_detail(
+    equipment_id: str,
+    history_limit: int = Query(DETAIL_HISTORY_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    history_cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Everything the detail page shows, in one round trip
+
+    The asset and its history page only need the id and are read together;
+    the location, department, edificio and the custodian's other assets depend
+    on the asset and are read together once it is known, so the latency is two
+    round trips whatever the number of lookups. history.next_cursor pages on
+    through /history/{equipment_id}.
+    """
+    equipment, (history, next_cursor) = await asyncio.gather(
+        db.equipment.find_one({"id": equipment_id}, EQUIPMENT_ROWS.projection),
+        history_page(equipment_id, history_limit, history_cursor, summary=True),
+    )
+    if not equipment:
+        raise HTTPException(status_code=404, detail="Equipo no encontrado")
+    EQUIPMENT_ROWS.conform([equipment])
+
+    place = parse_location_label(equipment.get("ubicacion"))
+    location, department, edificio, custodian_assets = await asyncio.gather(
+        find_one_shaped(db.locations, place, LOCATION_ROWS),
+        find_one_shaped(db.departments, {"nombre": equipment["departamento"]} if equipment.get("departamento") else {},
+                        DEPARTMENT_ROWS),
+        find_one_shaped(db.edificios, {"nombre": place["edificio"]} if place else {}, EDIFICIO_ROWS),
+        find_custodian_assets(equipment),
+    )
+    response = FastJSONResponse({
+        "equipment": equipment,
+        "history": {"items": history, "next_cursor": next_cursor},
+        "location": location,
+        "department": department,
+        "edificio": edificio,
+        "custodian_assets": custodian_assets,
+    })
+    set_etag(response, equipment)
+    return response
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Version number in an If-Match header ("3", "\"3\"" or W/"3"); None for absent or *"""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Encabezado If-Match inválido")
+
+def expected_version(if_match: Optional[str], body_version: Optional[int]) -> Optional[int]:
+    version = parse_if_match(if_match)
+    return body_version if version is None else version
+
+async def update_versioned(collection_name: str, doc_id: str, update_data: dict, version: Optional[int],
+                           not_found: str, conflict: str):
+    """Apply $set and bump the version in a single find-and-modify
+
+    With an expected version the write only matches that version (409 when
+    another update got there first). Returns the (before, after) images: the
+    pre-image comes from the database, the post-image follows from the $set.
+    """
+    collection = getattr(db, collection_name)
+    query = {"id": doc_id}
+    if version is not None:
+        # Documents written before versioning have no version field (version 0)
+        query["version"] = version if version else {"$in": [0, None]}
+    before = await collection.find_one_and_update(
+        query, {"$set": update_data, "$inc": {"version": 1}},
+        projection={"_id": 0}, return_document=ReturnDocument.BEFORE)
+    if before is None:
+        if version is not None and await collection.find_one({"id": doc_id}, {"_id": 0, "id": 1}):
+            raise HTTPException(status_code=409, detail=conflict)
+        raise HTTPException(status_code=404, detail=not_found)
+    change_feed.publish(collection_name, "update", doc_id, update_data)
+    return before, {**before, **update_data, "version": (before.get("version") or 0) + 1}
+
+def set_etag(response: Response, document: dict):
+    response.headers["ETag"] = f'"{document.get("version") or 0}"'
+
 @api_router.post("/equipment", response_model=Equipment)
 async def create_equipment(
     equipment_data: EquipmentCreate,
@@ -391,21 +735,17 @@ async def create_equipment(
     )
     
     doc = equipment_obj.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
-    doc["updated_at"] = doc["updated_at"].isoformat()
-    
     await db.equipment.insert_one(doc)
+    change_feed.publish("equipment", "insert", doc["id"])
     
     # Create history entry
     history_entry = HistoryEntry(
         equipment_id=equipment_obj.id,
         action="created",
-        changed_by=current_user["email"],
-        new_values=doc
+        changed_by=current_user["email"]
     )
     history_doc = history_entry.model_dump()
-    history_doc["timestamp"] = history_doc["timestamp"].isoformat()
-    await db.history.insert_one(history_doc)
+    await record_change(db, history_doc, None, doc, history_version(doc))
     
     return equipment_obj
 
@@ -413,37 +753,32 @@ async def create_equipment(
 async def update_equipment(
     equipment_id: str,
     equipment_data: EquipmentUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
+    """Update an equipment; If-Match (or a version in the body) rejects stale edits with 409"""
     if current_user["role"] not in ["admin", "superadmin"]:
         raise HTTPException(status_code=403, detail="No tienes permisos para editar equipos")
     
-    existing_equipment = await db.equipment.find_one({"id": equipment_id}, {"_id": 0})
-    if not existing_equipment:
-        raise HTTPException(status_code=404, detail="Equipo no encontrado")
-    
-    update_data = {k: v for k, v in equipment_data.model_dump().items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data = {k: v for k, v in equipment_data.model_dump(exclude={"version"}).items() if v is not None}
+    update_data["updated_at"] = datetime.now(timezone.utc)
     
-    await db.equipment.update_one({"id": equipment_id}, {"$set": update_data})
+    existing_equipment, updated_equipment = await update_versioned(
+        "equipment", equipment_id, update_data, expected_version(if_match, equipment_data.version),
+        not_found="Equipo no encontrado",
+        conflict="El equipo fue modificado por otro usuario; recarga la información e intenta de nuevo")
     
-    # Create history entry
+    # Create history entry (changed fields only), versioned by the find-and-modify above
     history_entry = HistoryEntry(
         equipment_id=equipment_id,
         action="updated",
-        changed_by=current_user["email"],
-        old_values=existing_equipment,
-        new_values=update_data
+        changed_by=current_user["email"]
     )
     history_doc = history_entry.model_dump()
-    history_doc["timestamp"] = history_doc["timestamp"].isoformat()
-    await db.history.insert_one(history_doc)
-    
-    updated_equipment = await db.equipment.find_one({"id": equipment_id}, {"_id": 0})
-    if isinstance(updated_equipment.get("created_at"), str):
-        updated_equipment["created_at"] = datetime.fromisoformat(updated_equipment["created_at"])
-    if isinstance(updated_equipment.get("updated_at"), str):
-        updated_equipment["updated_at"] = datetime.fromisoformat(updated_equipment["updated_at"])
+    await record_change(db, history_doc, existing_equipment, updated_equipment, history_version(updated_equipment))
+    
+    set_etag(response, updated_equipment)
     return updated_equipment
 
 @api_router.delete("/equipment/{equipment_id}")
@@ -454,25 +789,53 @@ async def delete_equipment(
     if current_user["role"] != "superadmin":
         raise HTTPException(status_code=403, detail="Solo el superadmin puede eliminar equipos")
     
-    existing_equipment = await db.equipment.find_one({"id": equipment_id}, {"_id": 0})
+    # The deleted image carries the version of the last update, so the deletion is versioned after it
+    existing_equipment = await db.equipment.find_one_and_delete({"id": equipment_id}, projection={"_id": 0})
     if not existing_equipment:
         raise HTTPException(status_code=404, detail="Equipo no encontrado")
     
-    await db.equipment.delete_one({"id": equipment_id})
+    # Tombstone for delta sync clients (expired by a TTL index)
+    await db.equipment_tombstones.insert_one({
+        "id": equipment_id,
+        "deleted_at": datetime.now(timezone.utc),
+        "deleted_by": current_user["email"]
+    })
+    change_feed.publish("equipment", "delete", equipment_id)
     
-    # Create history entry
+    # Create history entry (the deleted state can be rebuilt from earlier versions)
     history_entry = HistoryEntry(
         equipment_id=equipment_id,
         action="deleted",
-        changed_by=current_user["email"],
-        old_values=existing_equipment
+        changed_by=current_user["email"]
     )
     history_doc = history_entry.model_dump()
-    history_doc["timestamp"] = history_doc["timestamp"].isoformat()
-    await db.history.insert_one(history_doc)
+    await record_change(db, history_doc, existing_equipment, None, history_version(existing_equipment) + 1)
     
     return {"message": "Equipo eliminado exitosamente"}
 
+# Live change feed
+@api_router.get("/changes/stream")
+async def stream_changes(
+    collections: Optional[str] = None,
+    since: Optional[str] = None,
+    access_token: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Equipment and catalog changes as Server-Sent Events
+
+    EventSource cannot send headers, so the token may also be passed as
+    access_token. Reconnections resume after Last-Event-ID (or since=);
+    a "reset" event means the client must refetch its data.
+    """
+    await user_from_token(credentials.credentials if credentials else access_token)
+    selected = [c.strip() for c in collections.split(",")] if collections else None
+    return StreamingResponse(
+        change_feed.event_stream(db, selected, last_event_id or since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # History Routes
 def clean_dict_for_json(obj):
     """Recursively clean dictionary to remove ObjectId and other non-JSON serializable objects"""
@@ -491,67 +854,317 @@ def clean_dict_for_json(obj):
     else:
         return obj
 
+def encode_history_cursor(entry: dict) -> str:
+    """Opaque keyset cursor pointing after the given history entry"""
+    raw = json.dumps([datetime_codec.to_utc(entry["timestamp"]).isoformat(), entry["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, entry_id = json.loads(raw)
+        return datetime_codec.to_utc(datetime.fromisoformat(timestamp)), entry_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor de historial inválido")
+
+def history_timestamp(value: datetime) -> datetime:
+    """Query bound for stored timestamps (naive query parameters are taken as UTC)"""
+    return datetime_codec.to_utc(value)
+
+def serialize_history_entry(entry: dict, summary: bool = False) -> dict:
+    clean_entry = {
+        "id": entry.get("id", ""),
+        "equipment_id": entry.get("equipment_id", ""),
+        "action": entry.get("action", ""),
+        "changed_by": entry.get("changed_by", ""),
+        "timestamp": entry.get("timestamp", ""),
+        "version": entry.get("version"),
+    }
+    if hasattr(clean_entry["timestamp"], 'isoformat'):
+        clean_entry["timestamp"] = clean_entry["timestamp"].isoformat()
+    if not summary:
+        clean_entry["old_values"] = clean_dict_for_json(entry.get("old_values") or {})
+        clean_entry["new_values"] = clean_dict_for_json(entry.get("new_values") or {})
+    return clean_entry
+
 @api_router.get("/history/{equipment_id}")
 async def get_equipment_history(
     equipment_id: str,
+    response: Response,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    action: Optional[str] = None,
+    changed_by: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    summary: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
-    try:
-        history_list = await db.history.find({"equipment_id": equipment_id}, {"_id": 0}).to_list(1000)
-        result = []
-        for entry in history_list:
-            # Create a clean dict with only the fields we need
-            clean_entry = {
-                "id": entry.get("id", ""),
-                "equipment_id": entry.get("equipment_id", ""),
-                "action": entry.get("action", ""),
-                "changed_by": entry.get("changed_by", ""),
-                "timestamp": entry.get("timestamp", ""),
-                "old_values": clean_dict_for_json(entry.get("old_values", {})),
-                "new_values": clean_dict_for_json(entry.get("new_values", {}))
-            }
-            
-            # Convert timestamp if needed
-            if isinstance(clean_entry["timestamp"], str):
-                try:
-                    clean_entry["timestamp"] = datetime.fromisoformat(clean_entry["timestamp"]).isoformat()
-                except:
-                    pass
-            elif hasattr(clean_entry["timestamp"], 'isoformat'):
-                clean_entry["timestamp"] = clean_entry["timestamp"].isoformat()
-                
-            result.append(clean_entry)
-        return result
-    except Exception as e:
-        # Return empty list if there's an error
-        return []
+    """History of an equipment, newest first, one page at a time
+
+    The cursor for the next page is returned in the X-Next-Cursor header;
+    summary=true omits old_values/new_values for list views.
+    """
+    entries, next_cursor = await history_page(equipment_id, limit, cursor, action=action, changed_by=changed_by,
+                                              since=since, until=until, summary=summary)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return entries
+
+async def history_page(equipment_id: str, limit: int, cursor: Optional[str] = None, action: Optional[str] = None,
+                       changed_by: Optional[str] = None, since: Optional[datetime] = None,
+                       until: Optional[datetime] = None, summary: bool = False) -> tuple:
+    """One page of serialized history entries and the cursor of the next page (None on the last one)"""
+    await flush_pending()
+    query = {"equipment_id": equipment_id}
+    if action:
+        query["action"] = action
+    if changed_by:
+        query["changed_by"] = changed_by
+    if since or until:
+        query["timestamp"] = {}
+        if since:
+            query["timestamp"]["$gte"] = history_timestamp(since)
+        if until:
+            query["timestamp"]["$lt"] = history_timestamp(until)
+    position = decode_history_cursor(cursor) if cursor else None
+    if position:
+        timestamp, entry_id = position
+        # Keyset pagination on (timestamp, id), served by the (equipment_id, timestamp) index
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "id": {"$lt": entry_id}}
+        ]
+
+    projection = {"_id": 0, "snapshot": 0}
+    if summary:
+        projection.update({"old_values": 0, "new_values": 0})
+
+    entries = await db.history.find(query, projection).sort(HISTORY_SORT).limit(limit + 1).to_list(limit + 1)
+    if len(entries) <= limit:
+        # Older entries may have been moved to the archive tier
+        def archived_match(entry):
+            return ((not action or entry.get("action") == action)
+                    and (not changed_by or entry.get("changed_by") == changed_by)
+                    and (not since or entry["timestamp"] >= query["timestamp"]["$gte"])
+                    and (not until or entry["timestamp"] < query["timestamp"]["$lt"])
+                    and (not position or (entry["timestamp"], entry["id"]) < tuple(position)))
+        entries += await history_archive.page_archived(
+            db, equipment_id, limit + 1 - len(entries), archived_match, before=position[0] if position else None)
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_history_cursor(entries[-1])
+    return [serialize_history_entry(entry, summary) for entry in entries], next_cursor
+
+@api_router.get("/history/{equipment_id}/versions/{version}")
+async def get_equipment_version(
+    equipment_id: str,
+    version: int,
+    current_user: dict = Depends(get_current_user)
+):
+    """Equipment document as it was at a history version"""
+    rebuilt = await reconstruct(db, equipment_id, version=version)
+    if rebuilt is None:
+        rebuilt = await history_archive.reconstruct_archived(db, equipment_id, version)
+    if rebuilt is None:
+        raise HTTPException(status_code=404, detail="Versión no encontrada")
+    return rebuilt
+
+AUDIT_EXPORT_BATCH_SIZE = 500
+AUDIT_EXPORT_COLUMNS = ["timestamp", "equipment_id", "action", "changed_by", "version",
+                        "changed_fields", "old_values", "new_values"]
+
+async def iter_history_entries(query: dict, projection: dict, position: Optional[tuple] = None,
+                               archived: Optional[AsyncIterator[dict]] = None,
+                               batch_size: int = AUDIT_EXPORT_BATCH_SIZE):
+    """History entries matching query, newest first, read in keyset batches
+
+    ``archived`` entries (already filtered, newest first) are merged into
+    the stream in order, read only as far as the stream gets.
+    """
+    pending = await anext(archived, None) if archived is not None else None
+    while True:
+        batch_query = dict(query)
+        if position:
+            batch_query["$or"] = [
+                {"timestamp": {"$lt": position[0]}},
+                {"timestamp": position[0], "id": {"$lt": position[1]}}
+            ]
+        batch = await db.history.find(batch_query, projection).sort(HISTORY_SORT).limit(batch_size).to_list(batch_size)
+        for entry in batch:
+            while pending is not None and (pending["timestamp"], pending["id"]) > (entry["timestamp"], entry["id"]):
+                yield pending
+                pending = await anext(archived, None)
+            yield entry
+        if len(batch) < batch_size:
+            break
+        position = (batch[-1]["timestamp"], batch[-1]["id"])
+    while pending is not None:
+        yield pending
+        pending = await anext(archived, None)
+
+@api_router.get("/history")
+async def query_audit_log(
+    response: Response,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    changed_by: Optional[str] = None,
+    action: Optional[str] = None,
+    field: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    summary: bool = False,
+    include_archived: bool = False,
+    export: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Audit log across all equipment, newest first (admin and superadmin only)
+
+    Pages with the X-Next-Cursor header like /history/{equipment_id};
+    export=csv|ndjson streams every matching entry instead.
+    """
+    if current_user["role"] not in ["admin", "superadmin"]:
+        raise HTTPException(status_code=403, detail="No tienes permisos para consultar la bitácora")
+
+    await flush_pending()
+    query = {}
+    if changed_by:
+        query["changed_by"] = changed_by
+    if action:
+        query["action"] = action
+    if field:
+        query["changed_fields"] = field
+    bounds = {}
+    if since:
+        bounds["$gte"] = history_timestamp(since)
+    if until:
+        bounds["$lt"] = history_timestamp(until)
+    if bounds:
+        query["timestamp"] = bounds
+    position = decode_history_cursor(cursor) if cursor and not export else None
+
+    projection = {"_id": 0, "snapshot": 0}
+    if summary:
+        projection.update({"old_values": 0, "new_values": 0})
+
+    archived = None
+    if include_archived:
+        def archived_match(entry):
+            return ((not changed_by or entry.get("changed_by") == changed_by)
+                    and (not action or entry.get("action") == action)
+                    and (not field or field in (entry.get("changed_fields") or entry.get("new_values") or {}))
+                    and (not until or entry["timestamp"] < bounds["$lt"])
+                    and (not position or (entry["timestamp"], entry["id"]) < tuple(position)))
+        archived = history_archive.iter_archived_range(
+            db, bounds.get("$gte"), position[0] if position else bounds.get("$lt"), archived_match)
+
+    entries = iter_history_entries(query, projection, position, archived,
+                                   batch_size=AUDIT_EXPORT_BATCH_SIZE if export else limit + 1)
+    if export:
+        return StreamingResponse(
+            stream_audit_export(entries, export, summary),
+            media_type="text/csv; charset=utf-8" if export == "csv" else "application/x-ndjson",
+            headers={"Content-Disposition": f"attachment; filename=bitacora.{export}"}
+        )
+
+    page = []
+    async for entry in entries:
+        page.append(entry)
+        if len(page) > limit:
+            break
+    if len(page) > limit:
+        page = page[:limit]
+        response.headers["X-Next-Cursor"] = encode_history_cursor(page[-1])
+    return [{**serialize_history_entry(entry, summary), "changed_fields": entry.get("changed_fields", [])}
+            for entry in page]
+
+async def stream_audit_export(entries, export_format: str, summary: bool):
+    """Encode audit entries as CSV rows or JSON lines, one batch at a time"""
+    if export_format == "csv":
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(AUDIT_EXPORT_COLUMNS)
+        yield buffer.getvalue()
+    async for entry in entries:
+        row = {**serialize_history_entry(entry, summary), "changed_fields": entry.get("changed_fields", [])}
+        if export_format == "ndjson":
+            yield json.dumps(row, default=str) + "\n"
+            continue
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([
+            row["timestamp"], row["equipment_id"], row["action"], row["changed_by"], row["version"] or "",
+            ";".join(row["changed_fields"]),
+            json.dumps(row.get("old_values", {}), default=str), json.dumps(row.get("new_values", {}), default=str)
+        ])
+        yield buffer.getvalue()
 
 # Dashboard Stats
+def dashboard_stats_from_documents(equipment_list: List[dict], tipos_bien_list: List[str]) -> dict:
+    """Dashboard counters computed from equipment documents (used for as-of queries)"""
+    by_type = {tipo: 0 for tipo in tipos_bien_list}
+    by_status = {status: 0 for status in ["disponible", "asignado", "en_mantenimiento", "dado_de_baja", "en_resguardo"]}
+    by_department = {}
+    for eq in equipment_list:
+        if eq.get("tipo_bien") in by_type:
+            by_type[eq["tipo_bien"]] += 1
+        if eq.get("estado_operativo") in by_status:
+            by_status[eq["estado_operativo"]] += 1
+        if eq.get("departamento") is not None:
+            by_department[eq["departamento"]] = by_department.get(eq["departamento"], 0) + 1
+    return {
+        "total_equipment": len(equipment_list),
+        "by_type": by_type,
+        "by_status": by_status,
+        "by_department": by_department
+    }
+
+read_coalescer = single_flight.SingleFlight()
+# Writes of this process drop coalesced results (other processes' writes are bounded by the TTL)
+change_feed.add_listener(read_coalescer.invalidate)
+
+async def coalesced(route: str, current_user: dict, compute, **params):
+    """Result of compute(), shared by identical concurrent requests (see single_flight.py)"""
+    key = single_flight.request_key(route, current_user["role"], params)
+    return await read_coalescer.run(key, compute)
+
 @api_router.get("/dashboard/stats")
-async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
-    total_equipment = await db.equipment.count_documents({})
+async def get_dashboard_stats(
+    current_user: dict = Depends(get_current_user),
+    as_of: Optional[datetime] = None
+):
+    return await coalesced("dashboard_stats", current_user, lambda: dashboard_stats(as_of), as_of=as_of)
+
+async def dashboard_stats(as_of: Optional[datetime]) -> dict:
+    if as_of:
+        tipos_bien_docs = await db.tipos_bien.find({}, {"_id": 0}).to_list(1000)
+        equipment_list = await inventory_snapshots.inventory_as_of(db, history_timestamp(as_of))
+        return dashboard_stats_from_documents(equipment_list, [tipo["nombre"] for tipo in tipos_bien_docs])
+
+    total_equipment = await bi_db.equipment.count_documents({})
     
     # Get all tipos_bien from the new collection
-    tipos_bien_docs = await db.tipos_bien.find({}, {"_id": 0}).to_list(1000)
+    tipos_bien_docs = await bi_db.tipos_bien.find({}, {"_id": 0}).to_list(1000)
     tipos_bien_list = [tipo["nombre"] for tipo in tipos_bien_docs]
     
     # By type - dynamically from tipos_bien collection
     by_type = {}
     for tipo in tipos_bien_list:
-        count = await db.equipment.count_documents({"tipo_bien": tipo})
+        count = await bi_db.equipment.count_documents({"tipo_bien": tipo})
         by_type[tipo] = count
     
     # By status
     by_status = {}
     for status in ["disponible", "asignado", "en_mantenimiento", "dado_de_baja", "en_resguardo"]:
-        count = await db.equipment.count_documents({"estado_operativo": status})
+        count = await bi_db.equipment.count_documents({"estado_operativo": status})
         by_status[status] = count
     
     # By department
-    departments = await db.equipment.distinct("departamento")
+    departments = await bi_db.equipment.distinct("departamento")
     by_department = {}
     for dept in departments:
-        count = await db.equipment.count_documents({"departamento": dept})
+        count = await bi_db.equipment.count_documents({"departamento": dept})
         by_department[dept] = count
     
     return {
@@ -564,6 +1177,9 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
 # Business Intelligence Dashboard - Equipment by Department
 @api_router.get("/dashboard/equipment-by-department")
 async def get_equipment_by_department(current_user: dict = Depends(get_current_user)):
+    return await coalesced("equipment_by_department", current_user, equipment_by_department)
+
+async def equipment_by_department() -> list:
     # Aggregate equipment by department with detailed stats
     pipeline = [
         {
@@ -583,7 +1199,7 @@ async def get_equipment_by_department(current_user: dict = Depends(get_current_u
         }
     ]
     
-    result = await db.equipment.aggregate(pipeline).to_list(length=100)
+    result = await bi_db.equipment.aggregate(pipeline).to_list(length=100)
     
     # Process the results
     department_stats = []
@@ -610,6 +1226,9 @@ async def get_equipment_by_department(current_user: dict = Depends(get_current_u
 # Business Intelligence Dashboard - Equipment by Location
 @api_router.get("/dashboard/equipment-by-location")
 async def get_equipment_by_location(current_user: dict = Depends(get_current_user)):
+    return await coalesced("equipment_by_location", current_user, equipment_by_location)
+
+async def equipment_by_location() -> list:
     # Aggregate equipment by location with detailed stats
     pipeline = [
         {
@@ -629,7 +1248,7 @@ async def get_equipment_by_location(current_user: dict = Depends(get_current_use
         }
     ]
     
-    result = await db.equipment.aggregate(pipeline).to_list(length=100)
+    result = await bi_db.equipment.aggregate(pipeline).to_list(length=100)
     
     # Process the results
     location_stats = []
@@ -655,8 +1274,25 @@ async def get_equipment_by_location(current_user: dict = Depends(get_current_use
 
 # Export Routes
 @api_router.get("/equipment/export/excel")
-async def export_excel(current_user: dict = Depends(get_current_user)):
-    equipment_list = await db.equipment.find({}, {"_id": 0}).to_list(1000)
+async def export_excel(
+    current_user: dict = Depends(get_current_user),
+    as_of: Optional[datetime] = None
+):
+    content, filename = await coalesced("export_excel", current_user, lambda: excel_export(as_of), as_of=as_of)
+    return StreamingResponse(
+        BytesIO(content),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+async def excel_export(as_of: Optional[datetime]) -> tuple:
+    """Workbook bytes and file name"""
+    if as_of:
+        equipment_list = await inventory_snapshots.inventory_as_of(db, history_timestamp(as_of))
+        filename = f"inventario_{history_timestamp(as_of).date().isoformat()}.xlsx"
+    else:
+        equipment_list = await export_db.equipment.find({}, {"_id": 0}).to_list(1000)
+        filename = "inventario.xlsx"
     
     wb = openpyxl.Workbook()
     ws = wb.active
@@ -684,18 +1320,21 @@ async def export_excel(current_user: dict = Depends(get_current_user)):
         ])
     
     output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=inventario.xlsx"}
-    )
+    # Rendering is CPU-bound: off the event loop so it does not stall other requests
+    await asyncio.to_thread(wb.save, output)
+    return output.getvalue(), filename
 
 @api_router.get("/equipment/export/pdf")
 async def export_pdf(current_user: dict = Depends(get_current_user)):
-    equipment_list = await db.equipment.find({}, {"_id": 0}).to_list(1000)
+    content = await coalesced("export_pdf", current_user, pdf_export)
+    return StreamingResponse(
+        BytesIO(content),
+        media_type="application/pdf",
+        headers={"Content-Disposition": "attachment; filename=inventario.pdf"}
+    )
+
+async def pdf_export() -> bytes:
+    equipment_list = await export_db.equipment.find({}, {"_id": 0}).to_list(1000)
     
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=landscape(letter))
@@ -741,26 +1380,15 @@ async def export_pdf(current_user: dict = Depends(get_current_user)):
     ]))
     
     elements.append(table)
-    doc.build(elements)
-    buffer.seek(0)
-    
-    return StreamingResponse(
-        buffer,
-        media_type="application/pdf",
-        headers={"Content-Disposition": "attachment; filename=inventario.pdf"}
-    )
+    await asyncio.to_thread(doc.build, elements)
+    return buffer.getvalue()
 
 # Location Management
 @api_router.get("/locations", response_model=List[Location])
 async def get_locations(current_user: dict = Depends(get_current_user)):
     """Get all locations (accessible to all authenticated users)"""
-    locations = await db.locations.find({}, {"_id": 0}).to_list(1000)
-    for location in locations:
-        if isinstance(location.get("created_at"), str):
-            location["created_at"] = datetime.fromisoformat(location["created_at"])
-        if isinstance(location.get("updated_at"), str):
-            location["updated_at"] = datetime.fromisoformat(location["updated_at"])
-    return locations
+    locations = await db.locations.find({}, LOCATION_ROWS.projection).to_list(1000)
+    return LOCATION_ROWS.response(locations)
 
 @api_router.post("/locations", response_model=Location)
 async def create_location(
@@ -778,27 +1406,23 @@ async def create_location(
     )
     
     doc = location_obj.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
-    doc["updated_at"] = doc["updated_at"].isoformat()
     
     await db.locations.insert_one(doc)
+    change_feed.publish("locations", "insert", doc["id"])
     return location_obj
 
 @api_router.put("/locations/{location_id}", response_model=Location)
 async def update_location(
     location_id: str,
     location_data: LocationUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
     """Update a location (admin and superadmin only)"""
     if current_user["role"] not in ["admin", "superadmin"]:
         raise HTTPException(status_code=403, detail="Solo administradores pueden editar ubicaciones")
     
-    # Check if location exists
-    existing_location = await db.locations.find_one({"id": location_id}, {"_id": 0})
-    if not existing_location:
-        raise HTTPException(status_code=404, detail="Ubicación no encontrada")
-    
     # Prepare update data
     update_data = {}
     if location_data.edificio is not None:
@@ -808,12 +1432,17 @@ async def update_location(
     if location_data.salon_aula is not None:
         update_data["salon_aula"] = location_data.salon_aula
     
-    if update_data:
-        update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
-        await db.locations.update_one({"id": location_id}, {"$set": update_data})
-    
-    # Return updated location
-    updated_location = await db.locations.find_one({"id": location_id}, {"_id": 0})
+    if not update_data:
+        updated_location = await db.locations.find_one({"id": location_id}, {"_id": 0})
+        if not updated_location:
+            raise HTTPException(status_code=404, detail="Ubicación no encontrada")
+    else:
+        update_data["updated_at"] = datetime.now(timezone.utc)
+        _, updated_location = await update_versioned(
+            "locations", location_id, update_data, expected_version(if_match, location_data.version),
+            not_found="Ubicación no encontrada",
+            conflict="La ubicación fue modificada por otro usuario; recarga la información e intenta de nuevo")
+    set_etag(response, updated_location)
     return updated_location
 
 @api_router.delete("/locations/{location_id}")
@@ -833,6 +1462,7 @@ async def delete_location(
     result = await db.locations.delete_one({"id": location_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Ubicación no encontrada")
+    change_feed.publish("locations", "delete", location_id)
     
     return {"message": "Ubicación eliminada exitosamente"}
 
@@ -840,13 +1470,8 @@ async def delete_location(
 @api_router.get("/departments", response_model=List[Department])
 async def get_departments(current_user: dict = Depends(get_current_user)):
     """Get all departments (accessible to all authenticated users)"""
-    departments = await db.departments.find({}, {"_id": 0}).to_list(1000)
-    for department in departments:
-        if isinstance(department.get("created_at"), str):
-            department["created_at"] = datetime.fromisoformat(department["created_at"])
-        if isinstance(department.get("updated_at"), str):
-            department["updated_at"] = datetime.fromisoformat(department["updated_at"])
-    return departments
+    departments = await db.departments.find({}, DEPARTMENT_ROWS.projection).to_list(1000)
+    return DEPARTMENT_ROWS.response(departments)
 
 @api_router.post("/departments", response_model=Department)
 async def create_department(
@@ -870,27 +1495,23 @@ async def create_department(
     )
     
     doc = department_obj.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
-    doc["updated_at"] = doc["updated_at"].isoformat()
     
     await db.departments.insert_one(doc)
+    change_feed.publish("departments", "insert", doc["id"])
     return department_obj
 
 @api_router.put("/departments/{department_id}", response_model=Department)
 async def update_department(
     department_id: str,
     department_data: DepartmentUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
     """Update a department (admin and superadmin only)"""
     if current_user["role"] not in ["admin", "superadmin"]:
         raise HTTPException(status_code=403, detail="Solo administradores pueden editar departamentos")
     
-    # Check if department exists
-    existing_department = await db.departments.find_one({"id": department_id}, {"_id": 0})
-    if not existing_department:
-        raise HTTPException(status_code=404, detail="Departamento no encontrado")
-    
     # Validate location exists if provided
     if department_data.ubicacion_id is not None:
         location = await db.locations.find_one({"id": department_data.ubicacion_id}, {"_id": 0})
@@ -908,12 +1529,17 @@ async def update_department(
     if department_data.trabajadores is not None:
         update_data["trabajadores"] = department_data.trabajadores
     
-    if update_data:
-        update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
-        await db.departments.update_one({"id": department_id}, {"$set": update_data})
-    
-    # Return updated department
-    updated_department = await db.departments.find_one({"id": department_id}, {"_id": 0})
+    if not update_data:
+        updated_department = await db.departments.find_one({"id": department_id}, {"_id": 0})
+        if not updated_department:
+            raise HTTPException(status_code=404, detail="Departamento no encontrado")
+    else:
+        update_data["updated_at"] = datetime.now(timezone.utc)
+        _, updated_department = await update_versioned(
+            "departments", department_id, update_data, expected_version(if_match, department_data.version),
+            not_found="Departamento no encontrado",
+            conflict="El departamento fue modificado por otro usuario; recarga la información e intenta de nuevo")
+    set_etag(response, updated_department)
     return updated_department
 
 @api_router.delete("/departments/{department_id}")
@@ -933,6 +1559,7 @@ async def delete_department(
     result = await db.departments.delete_one({"id": department_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Departamento no encontrado")
+    change_feed.publish("departments", "delete", department_id)
     
     return {"message": "Departamento eliminado exitosamente"}
 
@@ -940,20 +1567,23 @@ async def delete_department(
 @api_router.get("/dashboard/equipment-by-edificio")
 async def get_equipment_by_edificio(current_user: dict = Depends(get_current_user)):
     """Get equipment statistics by edificio"""
+    return await coalesced("equipment_by_edificio", current_user, equipment_by_edificio)
+
+async def equipment_by_edificio() -> list:
     # Get all edificios
-    edificios = await db.edificios.find({}, {"_id": 0}).to_list(1000)
+    edificios = await bi_db.edificios.find({}, {"_id": 0}).to_list(1000)
     
     edificio_stats = []
     for edificio in edificios:
         equipment_in_edificio = []
         
         # 1. Find all locations in this edificio
-        locations = await db.locations.find({"edificio": edificio["nombre"]}, {"_id": 0}).to_list(1000)
+        locations = await bi_db.locations.find({"edificio": edificio["nombre"]}, {"_id": 0}).to_list(1000)
         location_names = [f"{loc['edificio']} - {loc['piso']} - {loc['salon_aula']}" for loc in locations]
         
         # Count equipment in these locations
         for loc_name in location_names:
-            equip_list = await db.equipment.find({"ubicacion": loc_name}, {"_id": 0}).to_list(1000)
+            equip_list = await bi_db.equipment.find({"ubicacion": loc_name}, {"_id": 0}).to_list(1000)
             equipment_in_edificio.extend(equip_list)
         
         # 2. Find all departments in this edificio (by their ubicacion_id)
@@ -961,7 +1591,7 @@ async def get_equipment_by_edificio(current_user: dict = Depends(get_current_use
         location_ids = [loc["id"] for loc in locations]
         
         # Find departments located in this edificio
-        departments_in_edificio = await db.departments.find(
+        departments_in_edificio = await bi_db.departments.find(
             {"ubicacion_id": {"$in": location_ids}}, 
             {"_id": 0}
         ).to_list(1000)
@@ -970,7 +1600,7 @@ async def get_equipment_by_edificio(current_user: dict = Depends(get_current_use
         
         # Count equipment assigned to these departments
         for dept_name in department_names:
-            equip_list = await db.equipment.find({"departamento": dept_name}, {"_id": 0}).to_list(1000)
+            equip_list = await bi_db.equipment.find({"departamento": dept_name}, {"_id": 0}).to_list(1000)
             # Avoid duplicates: only add if not already counted by location
             for equip in equip_list:
                 if equip not in equipment_in_edificio:
@@ -1004,13 +1634,8 @@ async def get_tipos_bien(current_user: dict = Depends(get_current_user)):
     if current_user["role"] not in ["admin", "superadmin"]:
         raise HTTPException(status_code=403, detail="Solo administradores pueden ver tipos de bien")
     
-    tipos = await db.tipos_bien.find({}, {"_id": 0}).to_list(1000)
-    for tipo in tipos:
-        if isinstance(tipo.get("created_at"), str):
-            tipo["created_at"] = datetime.fromisoformat(tipo["created_at"])
-        if isinstance(tipo.get("updated_at"), str):
-            tipo["updated_at"] = datetime.fromisoformat(tipo["updated_at"])
-    return tipos
+    tipos = await db.tipos_bien.find({}, TIPO_BIEN_ROWS.projection).to_list(1000)
+    return TIPO_BIEN_ROWS.response(tipos)
 
 @api_router.post("/tipos-bien", response_model=TipoBien)
 async def create_tipo_bien(
@@ -1028,46 +1653,39 @@ async def create_tipo_bien(
     
     tipo_obj = TipoBien(nombre=tipo_data.nombre)
     doc = tipo_obj.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
-    doc["updated_at"] = doc["updated_at"].isoformat()
     
     await db.tipos_bien.insert_one(doc)
+    change_feed.publish("tipos_bien", "insert", doc["id"])
     return tipo_obj
 
 @api_router.put("/tipos-bien/{tipo_id}", response_model=TipoBien)
 async def update_tipo_bien(
     tipo_id: str,
     tipo_data: TipoBienUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
     """Update a tipo bien (admin and superadmin only)"""
     if current_user["role"] not in ["admin", "superadmin"]:
         raise HTTPException(status_code=403, detail="Solo administradores pueden editar tipos de bien")
     
-    # Check if tipo exists
-    existing_tipo = await db.tipos_bien.find_one({"id": tipo_id}, {"_id": 0})
-    if not existing_tipo:
-        raise HTTPException(status_code=404, detail="Tipo de bien no encontrado")
-    
     # Check if new name already exists
-    if tipo_data.nombre and tipo_data.nombre != existing_tipo["nombre"]:
-        name_check = await db.tipos_bien.find_one({"nombre": tipo_data.nombre})
-        if name_check:
+    if tipo_data.nombre:
+        name_check = await db.tipos_bien.find_one({"nombre": tipo_data.nombre}, {"_id": 0, "id": 1})
+        if name_check and name_check["id"] != tipo_id:
             raise HTTPException(status_code=400, detail="Este tipo de bien ya existe")
     
     # Prepare update data
-    update_data = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    update_data = {"updated_at": datetime.now(timezone.utc)}
     if tipo_data.nombre:
         update_data["nombre"] = tipo_data.nombre
     
-    await db.tipos_bien.update_one({"id": tipo_id}, {"$set": update_data})
-    
-    # Return updated tipo
-    updated_tipo = await db.tipos_bien.find_one({"id": tipo_id}, {"_id": 0})
-    if isinstance(updated_tipo.get("created_at"), str):
-        updated_tipo["created_at"] = datetime.fromisoformat(updated_tipo["created_at"])
-    if isinstance(updated_tipo.get("updated_at"), str):
-        updated_tipo["updated_at"] = datetime.fromisoformat(updated_tipo["updated_at"])
+    _, updated_tipo = await update_versioned(
+        "tipos_bien", tipo_id, update_data, expected_version(if_match, tipo_data.version),
+        not_found="Tipo de bien no encontrado",
+        conflict="El tipo de bien fue modificado por otro usuario; recarga la información e intenta de nuevo")
+    set_etag(response, updated_tipo)
     return updated_tipo
 
 @api_router.delete("/tipos-bien/{tipo_id}")
@@ -1087,6 +1705,7 @@ async def delete_tipo_bien(
     result = await db.tipos_bien.delete_one({"id": tipo_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Tipo de bien no encontrado")
+    change_feed.publish("tipos_bien", "delete", tipo_id)
     
     return {"message": "Tipo de bien eliminado exitosamente"}
 
@@ -1097,13 +1716,8 @@ async def get_marcas(current_user: dict = Depends(get_current_user)):
     if current_user["role"] not in ["admin", "superadmin"]:
         raise HTTPException(status_code=403, detail="Solo administradores pueden ver marcas")
     
-    marcas = await db.marcas.find({}, {"_id": 0}).to_list(1000)
-    for marca in marcas:
-        if isinstance(marca.get("created_at"), str):
-            marca["created_at"] = datetime.fromisoformat(marca["created_at"])
-        if isinstance(marca.get("updated_at"), str):
-            marca["updated_at"] = datetime.fromisoformat(marca["updated_at"])
-    return marcas
+    marcas = await db.marcas.find({}, MARCA_ROWS.projection).to_list(1000)
+    return MARCA_ROWS.response(marcas)
 
 @api_router.post("/marcas", response_model=Marca)
 async def create_marca(
@@ -1121,46 +1735,39 @@ async def create_marca(
     
     marca_obj = Marca(nombre=marca_data.nombre)
     doc = marca_obj.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
-    doc["updated_at"] = doc["updated_at"].isoformat()
     
     await db.marcas.insert_one(doc)
+    change_feed.publish("marcas", "insert", doc["id"])
     return marca_obj
 
 @api_router.put("/marcas/{marca_id}", response_model=Marca)
 async def update_marca(
     marca_id: str,
     marca_data: MarcaUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
     """Update a marca (admin and superadmin only)"""
     if current_user["role"] not in ["admin", "superadmin"]:
         raise HTTPException(status_code=403, detail="Solo administradores pueden editar marcas")
     
-    # Check if marca exists
-    existing_marca = await db.marcas.find_one({"id": marca_id}, {"_id": 0})
-    if not existing_marca:
-        raise HTTPException(status_code=404, detail="Marca no encontrada")
-    
     # Check if new name already exists
-    if marca_data.nombre and marca_data.nombre != existing_marca["nombre"]:
-        name_check = await db.marcas.find_one({"nombre": marca_data.nombre})
-        if name_check:
+    if marca_data.nombre:
+        name_check = await db.marcas.find_one({"nombre": marca_data.nombre}, {"_id": 0, "id": 1})
+        if name_check and name_check["id"] != marca_id:
             raise HTTPException(status_code=400, detail="Esta marca ya existe")
     
     # Prepare update data
-    update_data = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    update_data = {"updated_at": datetime.now(timezone.utc)}
     if marca_data.nombre:
         update_data["nombre"] = marca_data.nombre
     
-    await db.marcas.update_one({"id": marca_id}, {"$set": update_data})
-    
-    # Return updated marca
-    updated_marca = await db.marcas.find_one({"id": marca_id}, {"_id": 0})
-    if isinstance(updated_marca.get("created_at"), str):
-        updated_marca["created_at"] = datetime.fromisoformat(updated_marca["created_at"])
-    if isinstance(updated_marca.get("updated_at"), str):
-        updated_marca["updated_at"] = datetime.fromisoformat(updated_marca["updated_at"])
+    _, updated_marca = await update_versioned(
+        "marcas", marca_id, update_data, expected_version(if_match, marca_data.version),
+        not_found="Marca no encontrada",
+        conflict="La marca fue modificada por otro usuario; recarga la información e intenta de nuevo")
+    set_etag(response, updated_marca)
     return updated_marca
 
 @api_router.delete("/marcas/{marca_id}")
@@ -1180,6 +1787,7 @@ async def delete_marca(
     result = await db.marcas.delete_one({"id": marca_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Marca no encontrada")
+    change_feed.publish("marcas", "delete", marca_id)
     
     return {"message": "Marca eliminada exitosamente"}
 
@@ -1190,13 +1798,8 @@ async def get_edificios(current_user: dict = Depends(get_current_user)):
     if current_user["role"] not in ["admin", "superadmin"]:
         raise HTTPException(status_code=403, detail="Solo administradores pueden ver edificios")
     
-    edificios = await db.edificios.find({}, {"_id": 0}).to_list(1000)
-    for edificio in edificios:
-        if isinstance(edificio.get("created_at"), str):
-            edificio["created_at"] = datetime.fromisoformat(edificio["created_at"])
-        if isinstance(edificio.get("updated_at"), str):
-            edificio["updated_at"] = datetime.fromisoformat(edificio["updated_at"])
-    return edificios
+    edificios = await db.edificios.find({}, EDIFICIO_ROWS.projection).to_list(1000)
+    return EDIFICIO_ROWS.response(edificios)
 
 @api_router.post("/edificios", response_model=Edificio)
 async def create_edificio(
@@ -1217,48 +1820,41 @@ async def create_edificio(
         direccion=edificio_data.direccion or ""
     )
     doc = edificio_obj.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
-    doc["updated_at"] = doc["updated_at"].isoformat()
     
     await db.edificios.insert_one(doc)
+    change_feed.publish("edificios", "insert", doc["id"])
     return edificio_obj
 
 @api_router.put("/edificios/{edificio_id}", response_model=Edificio)
 async def update_edificio(
     edificio_id: str,
     edificio_data: EdificioUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
     """Update an edificio (admin and superadmin only)"""
     if current_user["role"] not in ["admin", "superadmin"]:
         raise HTTPException(status_code=403, detail="Solo administradores pueden editar edificios")
     
-    # Check if edificio exists
-    existing_edificio = await db.edificios.find_one({"id": edificio_id}, {"_id": 0})
-    if not existing_edificio:
-        raise HTTPException(status_code=404, detail="Edificio no encontrado")
-    
     # Check if new name already exists
-    if edificio_data.nombre and edificio_data.nombre != existing_edificio["nombre"]:
-        name_check = await db.edificios.find_one({"nombre": edificio_data.nombre})
-        if name_check:
+    if edificio_data.nombre:
+        name_check = await db.edificios.find_one({"nombre": edificio_data.nombre}, {"_id": 0, "id": 1})
+        if name_check and name_check["id"] != edificio_id:
             raise HTTPException(status_code=400, detail="Este edificio ya existe")
     
     # Prepare update data
-    update_data = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    update_data = {"updated_at": datetime.now(timezone.utc)}
     if edificio_data.nombre:
         update_data["nombre"] = edificio_data.nombre
     if edificio_data.direccion is not None:
         update_data["direccion"] = edificio_data.direccion
     
-    await db.edificios.update_one({"id": edificio_id}, {"$set": update_data})
-    
-    # Return updated edificio
-    updated_edificio = await db.edificios.find_one({"id": edificio_id}, {"_id": 0})
-    if isinstance(updated_edificio.get("created_at"), str):
-        updated_edificio["created_at"] = datetime.fromisoformat(updated_edificio["created_at"])
-    if isinstance(updated_edificio.get("updated_at"), str):
-        updated_edificio["updated_at"] = datetime.fromisoformat(updated_edificio["updated_at"])
+    _, updated_edificio = await update_versioned(
+        "edificios", edificio_id, update_data, expected_version(if_match, edificio_data.version),
+        not_found="Edificio no encontrado",
+        conflict="El edificio fue modificado por otro usuario; recarga la información e intenta de nuevo")
+    set_etag(response, updated_edificio)
     return updated_edificio
 
 @api_router.delete("/edificios/{edificio_id}")
@@ -1278,6 +1874,7 @@ async def delete_edificio(
     result = await db.edificios.delete_one({"id": edificio_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Edificio no encontrado")
+    change_feed.publish("edificios", "delete", edificio_id)
     
     return {"message": "Edificio eliminado exitosamente"}
 
@@ -1287,11 +1884,9 @@ async def get_users(current_user: dict = Depends(get_current_user)):
     if current_user["role"] != "superadmin":
         raise HTTPException(status_code=403, detail="Solo el superadmin puede ver usuarios")
     
-    users = await db.users.find({}, {"_id": 0, "password": 0}).to_list(1000)
-    for user in users:
-        if isinstance(user.get("created_at"), str):
-            user["created_at"] = datetime.fromisoformat(user["created_at"])
-    return users
+    # The projection only includes User fields, so the password hash is never read
+    users = await db.users.find({}, USER_ROWS.projection).to_list(1000)
+    return USER_ROWS.response(users)
 
 @api_router.delete("/users/{user_id}")
 async def delete_user(
@@ -1335,7 +1930,7 @@ async def update_user(
         "email": user_data.email,
         "name": user_data.name,
         "role": user_data.role,
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": datetime.now(timezone.utc)
     }
     
     # Update password if provided
@@ -1368,14 +1963,112 @@ async def reset_user_password(
     # Update the user's password
     await db.users.update_one(
         {"id": user_id}, 
-        {"$set": {"password": hashed_password, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"password": hashed_password, "updated_at": datetime.now(timezone.utc)}}
     )
     
     return {"message": f"Contraseña restablecida a: {default_password}"}
 
+@api_router.get("/admin/profile")
+async def profile_api(
+    seconds: float = Query(10, gt=0, le=profiler.PROFILE_MAX_SECONDS),
+    format: str = Query("speedscope", pattern="^(speedscope|collapsed)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Sample every request served during the next N seconds (superadmin only)"""
+    if current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Solo el superadmin puede perfilar la API")
+    session = await profiler.profile_for(seconds)
+    return profiler.profile_response(session, format)
+
+@api_router.get("/admin/inventory-snapshots")
+async def list_inventory_snapshots(current_user: dict = Depends(get_current_user)):
+    """Materialized inventory snapshots, newest first"""
+    if current_user["role"] not in ["admin", "superadmin"]:
+        raise HTTPException(status_code=403, detail="No tienes permisos para ver los snapshots de inventario")
+    return await db.inventory_snapshots.find({}, {"_id": 0}).sort("taken_at", -1).to_list(1000)
+
+@api_router.post("/admin/inventory-snapshots")
+async def create_inventory_snapshot(current_user: dict = Depends(get_current_user)):
+    """Take an inventory snapshot now (e.g. at fiscal year-end)"""
+    if current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Solo el superadmin puede crear snapshots de inventario")
+    return await inventory_snapshots.take_snapshot(db)
+
+@api_router.post("/admin/history/archive")
+async def archive_old_history(
+    older_than_days: float = Query(history_archive.HISTORY_ARCHIVE_AFTER_DAYS, gt=0),
+    current_user: dict = Depends(get_current_user)
+):
+    """Move history older than N days into compressed archive segments"""
+    if current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Solo el superadmin puede archivar el historial")
+    return await history_archive.archive_history(db, older_than_days)
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    path: str
+    params: Dict[str, Any] = {}
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
+
+@api_router.post("/batch")
+async def run_batch(
+    batch_request: BatchRequest,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """Several GET requests in one round trip, dispatched concurrently (see batch.py)"""
+    if len(batch_request.requests) > batch.BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=413,
+                            detail=f"Un lote admite como máximo {batch.BATCH_MAX_REQUESTS} solicitudes")
+    items = [item.model_dump() for item in batch_request.requests]
+    return FastJSONResponse({"responses": await batch.run_batch(batch_app, request.scope, current_user, items)})
+
+async def profiling_allowed(scope) -> bool:
+    """Single-request profiling (X-Profile header) uses the same superadmin check"""
+    authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        user = await user_from_token(token)
+    except HTTPException:
+        return False
+    return user["role"] == "superadmin"
+
+def admission_identity(scope) -> str:
+    """Fairness key for admission control: the token subject, or the client address before login
+
+    Behind a proxy the address comes from X-Forwarded-For (uvicorn --proxy-headers, see the Dockerfile);
+    otherwise every anonymous request would share the proxy's address and its per-user share.
+    """
+    authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            subject = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+            if subject:
+                return subject
+        except JWTError:
+            pass
+    client = scope.get("client")
+    return client[0] if client else "anonymous"
+
 # Include router
 app.include_router(api_router)
 
+# Per-route-class concurrency limits (ADMISSION_LIMITS, ADMISSION_PER_USER); added before CORS so it
+# runs inside it and 429/503 responses stay readable by the browser
+admission_limiters = build_limiters()
+app.add_middleware(AdmissionMiddleware, identify=admission_identity, limiters=admission_limiters)
+# Batched sub-requests skip the middleware stack; they are admitted against the same slots
+batch_app = AdmissionMiddleware(app.router, identify=admission_identity, limiters=admission_limiters)
+
+# On-demand profiling (X-Profile header / _profile query flag, superadmin only); inside CORS too, so its
+# 403 for other users reaches the page instead of an opaque CORS error
+app.add_middleware(profiler.ProfilingMiddleware, fastapi_app=app, authorize=profiling_allowed)
+
 # Enhanced CORS configuration with fallback
 allowed_origins = [
     "https://siriu.netlify.app",  # Production frontend
@@ -1396,6 +2089,9 @@ if env_origins:
 
 logger.info(f"CORS Origins configured: {allowed_origins}")
 
+# Response headers the frontend needs to read (pagination cursors)
+exposed_headers = ["X-Next-Cursor", "ETag", "Retry-After"]
+
 # Custom CORS middleware for flexible origin handling
 class FlexibleCORSMiddleware:
     def __init__(self, app):
@@ -1424,7 +2120,8 @@ class FlexibleCORSMiddleware:
                     headers = message.get("headers", [])
                     headers.extend([
                         (b"access-control-allow-origin", b"*"),
-                        (b"access-control-allow-credentials", b"true")
+                        (b"access-control-allow-credentials", b"true"),
+                        (b"access-control-expose-headers", ", ".join(exposed_headers).encode())
                     ])
                     message["headers"] = headers
                 await send(message)
@@ -1444,8 +2141,17 @@ else:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=exposed_headers,
     )
 
+# Per-request DB operation counts and slow-request log (thresholds: SLOW_REQUEST_MS, SLOW_REQUEST_QUERIES)
+app.add_middleware(QueryTrackingMiddleware, fastapi_app=app,
+                   get_db=None if USE_FIRESTORE else (lambda: db))
+
+# Per-route request metrics (outermost, so CORS and error handling are measured too)
+app.add_middleware(MetricsMiddleware, fastapi_app=app)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -1497,8 +2203,59 @@ async def api_health_check():
     """API health check endpoint"""
     return await health_check()
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(authorization: Optional[str] = Header(None)):
+    """Prometheus scrape endpoint (requires METRICS_TOKEN as bearer token when set)"""
+    if not metrics_authorized(authorization, METRICS_TOKEN):
+        raise HTTPException(status_code=401, detail="Token de métricas inválido")
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+snapshot_task: Optional[asyncio.Task] = None
+history_writer: Optional[HistoryWriter] = None
+# Connections opened at startup (defaults to MONGO_MIN_POOL_SIZE)
+MONGO_WARMUP_CONNECTIONS = int(os.environ.get("MONGO_WARMUP_CONNECTIONS") or os.environ.get("MONGO_MIN_POOL_SIZE") or "4")
+# History entries are written in the background in batches (false: one insert per change)
+HISTORY_WRITE_BEHIND = os.environ.get("HISTORY_WRITE_BEHIND", "true").lower() == "true"
+HISTORY_SPOOL_DIR = Path(os.environ.get("HISTORY_SPOOL_DIR", ROOT_DIR / "spool"))
+
 @app.on_event("startup")
 async def startup_event():
+    if STORAGE_BACKEND == "mongodb":
+        # Open connections (and their TLS handshakes) now instead of in the first requests after a cold start
+        warmed = await warm_up(db, MONGO_WARMUP_CONNECTIONS)
+        logger.info(f"MongoDB pool warmed up with {warmed}/{MONGO_WARMUP_CONNECTIONS} connections")
+
+    # Indexes the API queries rely on (Firestore composite indexes are managed in the console)
+    if not USE_FIRESTORE:
+        await db.equipment.create_index([("updated_at", 1), ("id", 1)])
+        for field in sorted(EQUIPMENT_SORT_FIELDS - {"updated_at"}):
+            await db.equipment.create_index([(field, 1), ("id", 1)])
+        await db.equipment_tombstones.create_index(
+            "deleted_at", expireAfterSeconds=int(TOMBSTONE_RETENTION_DAYS * 86400))
+        await db.history.create_index([("equipment_id", 1), ("timestamp", -1), ("id", -1)])
+        await db.history.create_index(HISTORY_VERSION_INDEX)
+        await db.history.create_index([("timestamp", 1), ("id", 1)])
+        for audit_field in ("changed_by", "action", "changed_fields"):
+            await db.history.create_index([(audit_field, 1), ("timestamp", -1), ("id", -1)])
+        await db.inventory_snapshots.create_index("taken_at")
+        await db.inventory_snapshot_chunks.create_index([("snapshot_id", 1), ("number", 1)])
+        for keys in history_archive.ARCHIVE_INDEXES:
+            await db.history_archive.create_index(keys)
+
+    # Spooled entries left by a previous run are written before serving requests
+    global history_writer
+    if HISTORY_WRITE_BEHIND:
+        history_writer = HistoryWriter(db.history, HISTORY_SPOOL_DIR)
+        await history_writer.start()
+        history_store.set_writer(history_writer)
+
+    await change_feed.configure(db, STORAGE_BACKEND)
+
+    # Periodic inventory snapshots for as-of queries (INVENTORY_SNAPSHOT_INTERVAL_HOURS=0 disables them)
+    global snapshot_task
+    if inventory_snapshots.SNAPSHOT_INTERVAL_HOURS > 0:
+        snapshot_task = asyncio.create_task(inventory_snapshots.snapshot_scheduler(db))
+
     # Create default superadmin if not exists
     existing_superadmin = await db.users.find_one({"role": "superadmin"})
     if not existing_superadmin:
@@ -1509,11 +2266,19 @@ async def startup_event():
         )
         doc = superadmin.model_dump()
         doc["password"] = get_password_hash("admin123")
-        doc["created_at"] = doc["created_at"].isoformat()
         await db.users.insert_one(doc)
         logger.info("Superadmin creado: admin@universidad.edu / admin123")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    if not USE_FIRESTORE:
-        client.close()
\ No newline at end of file
+    global history_writer
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+    await change_feed.stop()
+    if history_writer is not None:
+        # Drain queued history before the client goes away
+        history_store.set_writer(None)
+        await history_writer.stop()
+        history_writer = None
+    if STORAGE_BACKEND == "mongodb":
+        db.client.close()
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""
+Request coalescing for expensive read endpoints
+Identical requests (same route, parameters and permission scope) that arrive
+while one of them is being computed wait for that computation and share its
+result instead of running it again, so a burst of dashboard loads costs one
+set of aggregations.
+
+Optionally results are also kept for READ_CACHE_TTL_SECONDS, and served for
+READ_CACHE_STALE_SECONDS more while a single background refresh runs
+(stale-while-revalidate). Both default to 0: only in-flight sharing, never a
+result older than the request. invalidate() drops everything, including
+computations already running, so reads after a write never get data from
+before it; the server calls it on every change published by this process.
+"""
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+import asyncio
+import logging
+import os
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+READ_CACHE_TTL = float(os.environ.get("READ_CACHE_TTL_SECONDS", "0"))
+READ_CACHE_STALE = float(os.environ.get("READ_CACHE_STALE_SECONDS", "0"))
+READ_CACHE_MAX_ENTRIES = int(os.environ.get("READ_CACHE_MAX_ENTRIES", "256"))
+
+coalesced_total = metrics.REGISTRY.counter(
+    "siriu_coalesced_requests_total",
+    "Coalesced reads by route and outcome (computed, shared, cached, stale)", ("route", "outcome"))
+
+
+def request_key(route: str, scope: str, params: Dict[str, Any]) -> Tuple[Hashable, ...]:
+    """Key of a request: route name, permission scope and the parameters that were given"""
+    return (route, scope, tuple(sorted((name, str(value)) for name, value in params.items() if value is not None)))
+
+
+class SingleFlight:
+    """One computation per key at a time, with an optional short-lived result cache"""
+
+    def __init__(self, ttl: float = READ_CACHE_TTL, stale: float = READ_CACHE_STALE,
+                 max_entries: int = READ_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.stale = stale
+        self.max_entries = max_entries
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._cache: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._generation = 0
+
+    async def run(self, key: Tuple[Hashable, ...], compute: Callable[[], Awaitable[Any]]) -> Any:
+        cached = self._cache.get(key)
+        if cached is not None:
+            stored_at, value = cached
+            age = time.monotonic() - stored_at
+            if age < self.ttl:
+                coalesced_total.inc((key[0], "cached"))
+                return value
+            if age < self.ttl + self.stale:
+                coalesced_total.inc((key[0], "stale"))
+                self._start(key, compute)
+                return value
+            del self._cache[key]
+
+        task = self._inflight.get(key)
+        coalesced_total.inc((key[0], "shared" if task else "computed"))
+        if task is None:
+            task = self._start(key, compute)
+        # Shielded: a caller that disconnects does not cancel the computation the others wait for
+        return await asyncio.shield(task)
+
+    def invalidate(self, *args):
+        """Forget cached results and detach running computations (their results are not cached)"""
+        self._generation += 1
+        self._cache.clear()
+        self._inflight.clear()
+
+    def _start(self, key: Tuple[Hashable, ...], compute: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is not None:
+            return task
+        generation = self._generation
+
+        async def flight():
+            try:
+                value = await compute()
+                if generation == self._generation and (self.ttl or self.stale):
+                    self._store(key, value)
+                return value
+            finally:
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+
+        task = asyncio.ensure_future(flight())
+        task.add_done_callback(_log_failure)
+        self._inflight[key] = task
+        return task
+
+    def _store(self, key: Tuple[Hashable, ...], value: Any):
+        self._cache[key] = (time.monotonic(), value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+
+def _log_failure(task: asyncio.Task):
+    # Retrieved here so background refreshes nobody awaits do not warn; callers get the error themselves
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"Coalesced computation failed: {task.exception()!r}")
@@ -0,0 +1,101 @@
+"""
+Storage backends for the SIRIU API
+Selects MongoDB (Motor), Firestore or the in-memory engine from the environment
+"""
+from typing import Any, Dict, List, Optional, Protocol
+import asyncio
+import os
+
+STORAGE_BACKENDS = ("mongodb", "firestore", "memory")
+
+
+class StorageCursor(Protocol):
+    """Cursor methods the API relies on"""
+
+    def limit(self, count: int) -> "StorageCursor": ...
+
+    async def to_list(self, length: Optional[int]) -> List[Dict[str, Any]]: ...
+
+
+class StorageCollection(Protocol):
+    """Subset of the Motor collection API used by server.py"""
+
+    def find(self, query: Dict[str, Any] = None, projection: Optional[Dict] = None) -> StorageCursor: ...
+
+    async def find_one(self, query: Dict[str, Any], projection: Optional[Dict] = None) -> Optional[Dict]: ...
+
+    async def insert_one(self, document: Dict[str, Any]) -> Any: ...
+
+    async def update_one(self, query: Dict[str, Any], update: Dict[str, Any]) -> Any: ...
+
+    async def delete_one(self, query: Dict[str, Any]) -> Any: ...
+
+    async def count_documents(self, query: Dict[str, Any]) -> int: ...
+
+    async def distinct(self, field: str) -> List[Any]: ...
+
+
+def get_storage_backend() -> str:
+    """Name of the configured backend (STORAGE_BACKEND, falling back to USE_FIRESTORE)"""
+    backend = os.getenv('STORAGE_BACKEND', '').strip().lower()
+    if not backend:
+        use_firestore = os.getenv('USE_FIRESTORE', 'false').lower() == 'true'
+        backend = "firestore" if use_firestore else "mongodb"
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}', expected one of {STORAGE_BACKENDS}")
+    return backend
+
+
+def get_database(backend: Optional[str] = None):
+    """Get database instance for the given (or configured) backend"""
+    backend = backend or get_storage_backend()
+
+    if backend == "firestore":
+        from firestore_db import FirestoreDB
+        return FirestoreDB(os.getenv('GCP_PROJECT_ID'))
+
+    if backend == "memory":
+        from memory_db import MemoryDB
+        return MemoryDB(os.environ.get('DB_NAME', 'test_database'), tz_aware=True)
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from db_monitoring import MongoCommandListener
+    from pool_monitoring import PoolMetricsListener
+    from read_routing import RoutedReadListener
+    mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+    # tz_aware: BSON dates come back as UTC-aware datetimes, like the values the API writes
+    client = AsyncIOMotorClient(mongo_url, tz_aware=True, **mongo_client_options(),
+                                event_listeners=[MongoCommandListener(), RoutedReadListener(), PoolMetricsListener()])
+    return client[os.environ.get('DB_NAME', 'test_database')]
+
+
+# Environment variable -> (client option, type); unset variables keep the driver default (or MONGO_URL's value)
+MONGO_CLIENT_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "MONGO_COMPRESSORS": ("compressors", str),  # e.g. "zstd,snappy" (needs zstandard / python-snappy)
+    "MONGO_ZLIB_COMPRESSION_LEVEL": ("zlibCompressionLevel", int),
+}
+
+
+def mongo_client_options() -> Dict[str, Any]:
+    """Pool, timeout and compression options for AsyncIOMotorClient from the environment"""
+    options = {}
+    for variable, (option, kind) in MONGO_CLIENT_OPTIONS.items():
+        value = os.environ.get(variable, '').strip()
+        if value:
+            options[option] = kind(value)
+    return options
+
+
+async def warm_up(db, connections: int) -> int:
+    """Open pool connections before serving requests (concurrent pings each need their own connection)"""
+    if connections <= 0:
+        return 0
+    results = await asyncio.gather(*(db.command("ping") for _ in range(connections)), return_exceptions=True)
+    return sum(1 for result in results if not isinstance(result, Exception))
@@ -0,0 +1,196 @@
+"""
+Synthetic campus generator for benchmarks
+Produces edificios, locations, departments, catalogs, equipment and history
+shaped like the documents server.py stores, at a configurable scale
+"""
+import random
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List
+
+TIPOS_BIEN = [
+    "computadora", "periferico", "componente_red", "dispositivo_movil", "insumo_critico",
+    "servidor", "impresora", "proyector", "telefono_ip", "no_break",
+]
+
+MARCAS = [
+    "Dell", "HP", "Lenovo", "Apple", "Acer", "Asus", "Cisco", "Ubiquiti", "Epson", "Brother",
+    "Samsung", "LG", "Logitech", "APC", "TP-Link", "Huawei", "Microsoft", "Xerox", "BenQ", "Canon",
+]
+
+MODELOS = ["Serie 100", "Serie 300", "Serie 500", "Pro", "Plus", "Max", "Lite", "Ultra", "X1", "G5"]
+
+ESTADOS = {
+    "asignado": 0.55,
+    "disponible": 0.2,
+    "en_mantenimiento": 0.1,
+    "en_resguardo": 0.1,
+    "dado_de_baja": 0.05,
+}
+
+DEPARTAMENTOS = [
+    "Sistemas", "Finanzas", "Recursos Humanos", "Biblioteca", "Rectoría", "Servicios Escolares",
+    "Ingeniería", "Medicina", "Derecho", "Arquitectura", "Contaduría", "Posgrado", "Investigación",
+    "Vinculación", "Comunicación", "Jurídico", "Mantenimiento", "Deportes", "Idiomas", "Laboratorios",
+]
+
+NOMBRES = ["Ana", "Luis", "María", "José", "Carmen", "Jorge", "Laura", "Pedro", "Sofía", "Miguel",
+           "Lucía", "Diego", "Elena", "Raúl", "Paula", "Héctor", "Irene", "Óscar", "Rosa", "Iván"]
+APELLIDOS = ["García", "López", "Martínez", "Hernández", "Pérez", "Sánchez", "Ramírez", "Torres",
+             "Flores", "Rivera", "Gómez", "Díaz", "Cruz", "Morales", "Ortiz", "Vargas"]
+
+EDITABLE_FIELDS = ["estado_operativo", "resguardante", "ubicacion", "departamento", "observaciones"]
+
+EPOCH = datetime(2019, 1, 1, tzinfo=timezone.utc)
+
+
+class CampusGenerator:
+    """Deterministic generator: the same seed and scale always yield the same campus"""
+
+    def __init__(self, assets: int = 10000, seed: int = 42, history_per_asset: float = 3.0):
+        self.assets = assets
+        self.history_per_asset = history_per_asset
+        self.rng = random.Random(seed)
+
+    def _id(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def _moment(self, start: datetime = EPOCH, days: int = 6 * 365) -> datetime:
+        return start + timedelta(seconds=self.rng.randrange(days * 86400))
+
+    def _stamped(self, doc: Dict[str, Any], moment: datetime) -> Dict[str, Any]:
+        doc["created_at"] = moment
+        doc["updated_at"] = moment
+        return doc
+
+    def _person(self) -> str:
+        return f"{self.rng.choice(NOMBRES)} {self.rng.choice(APELLIDOS)} {self.rng.choice(APELLIDOS)}"
+
+    def edificios(self) -> List[Dict[str, Any]]:
+        count = max(3, self.assets // 2000)
+        return [
+            self._stamped({"id": self._id(), "nombre": f"Edificio {i + 1}",
+                           "direccion": f"Circuito Universitario {100 + i}"}, EPOCH)
+            for i in range(count)
+        ]
+
+    def locations(self, edificios: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        locations = []
+        for edificio in edificios:
+            for piso in range(1, self.rng.randint(3, 6) + 1):
+                for salon in range(1, self.rng.randint(10, 30) + 1):
+                    locations.append(self._stamped({
+                        "id": self._id(),
+                        "edificio": edificio["nombre"],
+                        "piso": f"Piso {piso}",
+                        "salon_aula": f"Aula {piso}{salon:02d}",
+                    }, EPOCH))
+        return locations
+
+    def departments(self, locations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        count = max(len(DEPARTAMENTOS), self.assets // 100)
+        departments = []
+        for i in range(count):
+            base = DEPARTAMENTOS[i % len(DEPARTAMENTOS)]
+            nombre = base if i < len(DEPARTAMENTOS) else f"{base} {i // len(DEPARTAMENTOS) + 1}"
+            workers = [{"nombre": self._person(), "puesto": "Personal"} for _ in range(self.rng.randint(2, 25))]
+            departments.append(self._stamped({
+                "id": self._id(),
+                "nombre": nombre,
+                "ubicacion_id": self.rng.choice(locations)["id"],
+                "numero_trabajadores": len(workers),
+                "trabajadores": workers,
+            }, EPOCH))
+        return departments
+
+    def catalog(self, names: List[str]) -> List[Dict[str, Any]]:
+        return [self._stamped({"id": self._id(), "nombre": nombre}, EPOCH) for nombre in names]
+
+    def equipment(self, locations, departments, tipos, marcas) -> List[Dict[str, Any]]:
+        estados, weights = zip(*ESTADOS.items())
+        location_names = [f"{loc['edificio']} - {loc['piso']} - {loc['salon_aula']}" for loc in locations]
+        equipment = []
+        for i in range(self.assets):
+            adquirido = self._moment()
+            equipment.append(self._stamped({
+                "id": self._id(),
+                "ubicacion": self.rng.choice(location_names),
+                "resguardante": self._person(),
+                "departamento": self.rng.choice(departments)["nombre"],
+                "tipo_bien": self.rng.choice(tipos)["nombre"],
+                "numero_serie": f"SN{i:08d}",
+                "numero_factura": f"F-{self.rng.randrange(10 ** 6):06d}",
+                "numero_inventario": f"INV-{i:07d}",
+                "marca": self.rng.choice(marcas)["nombre"],
+                "modelo": self.rng.choice(MODELOS),
+                "fecha_adquisicion": adquirido.date().isoformat(),
+                "estado_operativo": self.rng.choices(estados, weights)[0],
+                "observaciones": "Sin observaciones" if self.rng.random() < 0.7 else
+                                 "Revisión anual pendiente. " * self.rng.randint(1, 8),
+                "created_by": "admin@universidad.edu",
+            }, adquirido))
+        return equipment
+
+    def history(self, equipment, locations, departments) -> List[Dict[str, Any]]:
+        """Created entry per asset plus updates that mimic update_equipment"""
+        location_names = [f"{loc['edificio']} - {loc['piso']} - {loc['salon_aula']}" for loc in locations]
+        choices = {
+            "estado_operativo": list(ESTADOS),
+            "ubicacion": location_names,
+            "departamento": [dept["nombre"] for dept in departments],
+        }
+        history = []
+        for eq in equipment:
+            created = eq["created_at"]
+            history.append({"id": self._id(), "equipment_id": eq["id"], "action": "created",
+                            "changed_by": eq["created_by"], "timestamp": eq["created_at"],
+                            "old_values": {}, "new_values": dict(eq)})
+            updates = int(self.rng.expovariate(1 / max(self.history_per_asset - 1, 0.01)))
+            moment = created
+            for _ in range(updates):
+                moment = self._moment(moment, 180)
+                field = self.rng.choice(EDITABLE_FIELDS)
+                if field in choices:
+                    value = self.rng.choice(choices[field])
+                elif field == "resguardante":
+                    value = self._person()
+                else:
+                    value = f"Actualizado {moment.date().isoformat()}"
+                old_values = dict(eq)
+                eq[field] = value
+                eq["updated_at"] = moment
+                history.append({"id": self._id(), "equipment_id": eq["id"], "action": "updated",
+                                "changed_by": "admin@universidad.edu", "timestamp": moment,
+                                "old_values": old_values,
+                                "new_values": {field: value, "updated_at": eq["updated_at"]}})
+        return history
+
+    def generate(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Build every collection of the campus"""
+        edificios = self.edificios()
+        locations = self.locations(edificios)
+        departments = self.departments(locations)
+        tipos = self.catalog(TIPOS_BIEN)
+        marcas = self.catalog(MARCAS)
+        equipment = self.equipment(locations, departments, tipos, marcas)
+        history = self.history(equipment, locations, departments)
+        return {
+            "edificios": edificios,
+            "locations": locations,
+            "departments": departments,
+            "tipos_bien": tipos,
+            "marcas": marcas,
+            "equipment": equipment,
+            "history": history,
+        }
+
+
+async def seed_database(db, campus: Dict[str, List[Dict[str, Any]]], batch_size: int = 1000) -> Dict[str, int]:
+    """Insert a generated campus into any storage backend, returning counts per collection"""
+    counts = {}
+    for name, documents in campus.items():
+        collection = db[name]
+        for start in range(0, len(documents), batch_size):
+            await collection.insert_many([dict(doc) for doc in documents[start:start + batch_size]])
+        counts[name] = len(documents)
+    return counts
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Async load driver for the SIRIU API
+
+Replays a traffic mix modeled on the frontend pages against either the app
+running in-process on a seeded in-memory database (default) or a live server
+(--base-url). Reports p50/p95/p99 latency, throughput and peak RSS per
+endpoint and writes machine-readable JSON that can be compared across commits.
+
+    python benchmarks/load.py --assets 10000 --duration 30 --output bench.json
+    python benchmarks/load.py --assets 50000 --compare bench.json
+    python benchmarks/load.py --base-url http://localhost:8080 --email admin@universidad.edu --password admin123
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import httpx  # noqa: E402
+
+from campus import CampusGenerator, seed_database  # noqa: E402
+
+# Requests each page issues on mount; inner lists run concurrently like the
+# un-awaited axios calls in the React components, outer steps run in order.
+SCENARIOS = {
+    "inventory_list": [["GET /api/equipment"]],
+    "equipment_detail": [["GET /api/equipment/{id}", "GET /api/history/{id}"]],
+    "dashboard": [["GET /api/tipos-bien", "GET /api/dashboard/stats"]],
+    "bi_dashboard": [["GET /api/tipos-bien", "GET /api/dashboard/equipment-by-department"],
+                     ["GET /api/dashboard/equipment-by-location"],
+                     ["GET /api/dashboard/equipment-by-edificio"]],
+    "equipment_form": [["GET /api/departments", "GET /api/locations", "GET /api/tipos-bien",
+                        "GET /api/marcas", "GET /api/equipment/{id}"]],
+    "export": [["GET /api/equipment/export/{format}"]],
+}
+
+DEFAULT_MIX = {
+    "inventory_list": 40,
+    "equipment_detail": 25,
+    "dashboard": 15,
+    "bi_dashboard": 10,
+    "equipment_form": 7,
+    "export": 3,
+}
+
+PERCENTILES = (50, 95, 99)
+
+# One INFO line per request would dominate the run
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident set size of this process (None where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, value.split(",")):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario '{name}', expected one of {list(SCENARIOS)}")
+        mix[name] = int(weight)
+    return mix
+
+
+class Recorder:
+    """Collects latency, status, payload size and RSS samples per endpoint"""
+
+    def __init__(self):
+        self.samples: Dict[str, Dict[str, Any]] = {}
+        self.recording = False
+
+    def record(self, endpoint: str, seconds: float, status: int, size: int):
+        if not self.recording:
+            return
+        stats = self.samples.setdefault(endpoint, {"latencies": [], "errors": 0, "bytes": 0, "peak_rss": 0})
+        stats["latencies"].append(seconds)
+        stats["bytes"] += size
+        if status >= 400:
+            stats["errors"] += 1
+        rss = current_rss_bytes()
+        if rss is not None:
+            stats["peak_rss"] = max(stats["peak_rss"], rss)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        endpoints = {}
+        for endpoint, stats in sorted(self.samples.items()):
+            latencies = sorted(stats["latencies"])
+            count = len(latencies)
+            summary = {
+                "count": count,
+                "errors": stats["errors"],
+                "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+                "mean_ms": round(sum(latencies) / count * 1000, 3),
+                "avg_bytes": int(stats["bytes"] / count),
+                "peak_rss_mb": round(stats["peak_rss"] / 2 ** 20, 1) if stats["peak_rss"] else None,
+            }
+            for pct in PERCENTILES:
+                summary[f"p{pct}_ms"] = round(percentile(latencies, pct) * 1000, 3)
+            endpoints[endpoint] = summary
+        total = sum(e["count"] for e in endpoints.values())
+        return {
+            "endpoints": endpoints,
+            "totals": {
+                "requests": total,
+                "errors": sum(e["errors"] for e in endpoints.values()),
+                "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+                "elapsed_s": round(elapsed, 3),
+                "peak_rss_mb": round(peak_rss_bytes() / 2 ** 20, 1),
+            },
+        }
+
+
+class LoadDriver:
+    """Virtual users that repeatedly open a random page and issue its requests"""
+
+    def __init__(self, client: httpx.AsyncClient, headers: Dict[str, str], equipment_ids: List[str],
+                 mix: Dict[str, int], recorder: Recorder, seed: int):
+        self.client = client
+        self.headers = headers
+        self.equipment_ids = equipment_ids
+        self.scenarios = [name for name, weight in mix.items() if weight > 0]
+        self.weights = [mix[name] for name in self.scenarios]
+        self.recorder = recorder
+        self.rng = random.Random(seed)
+
+    async def request(self, endpoint: str, params: Dict[str, str]):
+        method, template = endpoint.split(" ", 1)
+        url = template.format(**params)
+        started = time.perf_counter()
+        response = await self.client.request(method, url, headers=self.headers)
+        body = await response.aread()
+        self.recorder.record(endpoint, time.perf_counter() - started, response.status_code, len(body))
+
+    async def open_page(self):
+        scenario = self.rng.choices(self.scenarios, self.weights)[0]
+        params = {
+            "id": self.rng.choice(self.equipment_ids) if self.equipment_ids else "missing",
+            "format": self.rng.choice(["excel", "pdf"]),
+        }
+        for step in SCENARIOS[scenario]:
+            await asyncio.gather(*(self.request(endpoint, params) for endpoint in step))
+
+    async def user(self, deadline: float):
+        while time.perf_counter() < deadline:
+            await self.open_page()
+
+    async def run(self, concurrency: int, duration: float, warmup: float) -> float:
+        if warmup:
+            await asyncio.gather(*(self.user(time.perf_counter() + warmup) for _ in range(concurrency)))
+        self.recorder.recording = True
+        started = time.perf_counter()
+        await asyncio.gather(*(self.user(started + duration) for _ in range(concurrency)))
+        return time.perf_counter() - started
+
+
+async def in_process_target(args, campus):
+    """Seed the in-memory backend and return an ASGI client plus superadmin headers"""
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-key")
+    import server
+
+    await seed_database(server.db, campus)
+    await server.app.router.startup()
+    headers = {"Authorization": f"Bearer {server.create_access_token(data={'sub': 'admin@universidad.edu'})}"}
+    transport = httpx.ASGITransport(app=server.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None), headers
+
+
+async def remote_target(args, campus):
+    """Optionally seed the configured database, then log in to a live server"""
+    if args.seed_db:
+        from storage import get_database
+        await seed_database(get_database(), campus)
+    client = httpx.AsyncClient(base_url=args.base_url, timeout=None)
+    response = await client.post("/api/auth/login", json={"email": args.email, "password": args.password})
+    response.raise_for_status()
+    return client, {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> str:
+    """Human-readable p50/p95/p99 deltas against a previous run"""
+    lines = [f"{'endpoint':55} {'metric':8} {'baseline':>10} {'current':>10} {'delta':>8}"]
+    for endpoint, stats in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        for metric in [f"p{pct}_ms" for pct in PERCENTILES] + ["throughput_rps"]:
+            old, new = before.get(metric), stats.get(metric)
+            if not old:
+                continue
+            lines.append(f"{endpoint:55} {metric:8} {old:10.2f} {new:10.2f} {(new - old) / old * 100:+7.1f}%")
+    return "\n".join(lines)
+
+
+def print_table(report: Dict[str, Any]):
+    print(f"{'endpoint':55} {'count':>7} {'err':>4} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'rss MB':>7}")
+    for endpoint, stats in report["endpoints"].items():
+        print(f"{endpoint:55} {stats['count']:7d} {stats['errors']:4d} {stats['throughput_rps']:8.1f} "
+              f"{stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} {stats['p99_ms']:9.2f} "
+              f"{stats['peak_rss_mb'] or 0:7.1f}")
+    totals = report["totals"]
+    print(f"total: {totals['requests']} requests, {totals['errors']} errors, "
+          f"{totals['throughput_rps']} req/s, peak RSS {totals['peak_rss_mb']} MB")
+
+
+async def main(args) -> Dict[str, Any]:
+    generated = time.perf_counter()
+    campus = CampusGenerator(args.assets, args.seed, args.history_per_asset).generate()
+    generated = time.perf_counter() - generated
+    equipment_ids = [eq["id"] for eq in campus["equipment"]]
+
+    if args.base_url:
+        client, headers = await remote_target(args, campus)
+    else:
+        client, headers = await in_process_target(args, campus)
+
+    recorder = Recorder()
+    async with client:
+        driver = LoadDriver(client, headers, equipment_ids, args.mix, recorder, args.seed)
+        elapsed = await driver.run(args.concurrency, args.duration, args.warmup)
+
+    report = recorder.report(elapsed)
+    report["meta"] = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "target": args.base_url or "in-process",
+        "storage_backend": os.environ.get("STORAGE_BACKEND", "mongodb") if not args.base_url else None,
+        "assets": args.assets,
+        "seed": args.seed,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "warmup_s": args.warmup,
+        "mix": args.mix,
+        "collections": {name: len(docs) for name, docs in campus.items()},
+        "generate_s": round(generated, 3),
+        "python": platform.python_version(),
+    }
+    return report
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--assets", type=int, default=10000, help="number of equipment documents")
+    parser.add_argument("--history-per-asset", type=float, default=3.0, help="average history entries per asset")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for data and traffic")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before recording")
+    parser.add_argument("--mix", type=parse_mix, default=dict(DEFAULT_MIX),
+                        help="scenario weights, e.g. inventory_list=50,export=0")
+    parser.add_argument("--base-url", help="benchmark a live server instead of the in-process app")
+    parser.add_argument("--email", default="admin@universidad.edu", help="login for --base-url")
+    parser.add_argument("--password", default="admin123", help="password for --base-url")
+    parser.add_argument("--seed-db", action="store_true",
+                        help="with --base-url, insert the campus into the database from STORAGE_BACKEND/MONGO_URL")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="previous JSON report to diff against")
+    return parser
+
+
+if __name__ == "__main__":
+    arguments = build_parser().parse_args()
+    result = asyncio.run(main(arguments))
+    print_table(result)
+    if arguments.output:
+        Path(arguments.output).write_text(json.dumps(result, indent=2))
+    if arguments.compare:
+        print()
+        print(compare(result, json.loads(Path(arguments.compare).read_text())))
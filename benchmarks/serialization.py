@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Per-row serialization cost of the list endpoints
+
+Encodes synthetic campus documents the way FastAPI does with response_model
+(validate every dict into the model, dump it and render it with json.dumps)
+and through the fast path used by the list endpoints (fast_json.RowShape),
+then prints microseconds per row for each model.
+
+    python benchmarks/serialization.py --rows 5000 --repeat 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-key")
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+import server  # noqa: E402
+from campus import CampusGenerator  # noqa: E402
+
+
+def response_model_path(model) -> Callable[[List[Dict[str, Any]]], Awaitable[bytes]]:
+    field = create_response_field(name=f"Response_{model.__name__}", type_=List[model], mode="serialization")
+
+    async def encode(rows):
+        content = await serialize_response(field=field, response_content=rows)
+        return JSONResponse(content).body
+    return encode
+
+
+def fast_path(shape) -> Callable[[List[Dict[str, Any]]], Awaitable[bytes]]:
+    async def encode(rows):
+        return shape.response(rows).body
+    return encode
+
+
+async def per_row_us(encode, rows: List[Dict[str, Any]], repeat: int) -> float:
+    await encode(rows)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await encode(rows)
+        best = min(best, time.perf_counter() - start)
+    return best / len(rows) * 1e6
+
+
+async def main(args) -> Dict[str, Any]:
+    campus = CampusGenerator(assets=args.rows, seed=args.seed, history_per_asset=1).generate()
+    cases = [
+        ("equipment", server.Equipment, server.EQUIPMENT_ROWS, campus["equipment"]),
+        ("locations", server.Location, server.LOCATION_ROWS, campus["locations"]),
+        ("departments", server.Department, server.DEPARTMENT_ROWS, campus["departments"]),
+    ]
+    report = {}
+    for name, model, shape, documents in cases:
+        # Rows as the database returns them for each path
+        stored = [{k: v for k, v in doc.items() if k != "_id"} for doc in documents]
+        projected = [{k: doc[k] for k in shape.fields if k in doc} for doc in documents]
+        assert json.loads(await response_model_path(model)(stored)) == json.loads(await fast_path(shape)(projected))
+        before = await per_row_us(response_model_path(model), stored, args.repeat)
+        after = await per_row_us(fast_path(shape), projected, args.repeat)
+        report[name] = {"rows": len(documents), "response_model_us": round(before, 2),
+                        "fast_path_us": round(after, 2), "speedup": round(before / after, 1)}
+    return report
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=5000, help="number of equipment documents")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case (the best is kept)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for the campus")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    return parser
+
+
+if __name__ == "__main__":
+    arguments = build_parser().parse_args()
+    result = asyncio.run(main(arguments))
+    print(f"{'model':<12} {'rows':>6} {'response_model':>15} {'fast path':>10} {'speedup':>8}")
+    for model_name, stats in result.items():
+        print(f"{model_name:<12} {stats['rows']:>6} {stats['response_model_us']:>12.2f} us "
+              f"{stats['fast_path_us']:>7.2f} us {stats['speedup']:>7.1f}x")
+    if arguments.output:
+        Path(arguments.output).write_text(json.dumps(result, indent=2))
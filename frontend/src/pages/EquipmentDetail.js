@@ -13,6 +13,7 @@ export default function EquipmentDetail() {
   const navigate = useNavigate();
   const [equipment, setEquipment] = useState(null);
   const [history, setHistory] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null);
   const [loading, setLoading] = useState(true);
   const [user, setUser] = useState(null);
 
@@ -21,17 +22,19 @@ export default function EquipmentDetail() {
     if (userData) {
       setUser(JSON.parse(userData));
     }
-    fetchEquipment();
-    fetchHistory();
+    fetchDetail();
   }, [id]);
 
-  const fetchEquipment = async () => {
+  // The equipment and the first history page in one request; more history pages come from /history
+  const fetchDetail = async () => {
     try {
       const token = localStorage.getItem("token");
-      const response = await axios.get(`${API}/equipment/${id}`, {
+      const response = await axios.get(`${API}/equipment/${id}/detail`, {
         headers: { Authorization: `Bearer ${token}` },
       });
-      setEquipment(response.data);
+      setEquipment(response.data.equipment);
+      setHistory(response.data.history.items);
+      setHistoryCursor(response.data.history.next_cursor || null);
     } catch (error) {
       toast.error("Error al cargar equipo");
       navigate("/inventory");
@@ -40,13 +43,15 @@ export default function EquipmentDetail() {
     }
   };
 
-  const fetchHistory = async () => {
+  const fetchHistory = async (cursor) => {
     try {
       const token = localStorage.getItem("token");
       const response = await axios.get(`${API}/history/${id}`, {
         headers: { Authorization: `Bearer ${token}` },
+        params: { summary: true, cursor },
       });
-      setHistory(response.data);
+      setHistory((previous) => [...previous, ...response.data]);
+      setHistoryCursor(response.headers["x-next-cursor"] || null);
     } catch (error) {
       console.error("Error al cargar historial");
     }
@@ -283,6 +288,15 @@ export default function EquipmentDetail() {
                 <p className="text-sm text-gray-300">Por: {entry.changed_by}</p>
               </div>
             ))}
+            {historyCursor && (
+              <Button
+                onClick={() => fetchHistory(historyCursor)}
+                data-testid="history-load-more"
+                className="w-full bg-gray-800 hover:bg-gray-700 text-white px-4 py-2 rounded-lg"
+              >
+                Cargar más
+              </Button>
+            )}
           </div>
         )}
       </div>
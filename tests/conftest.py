@@ -0,0 +1,77 @@
+"""
+Shared fixtures: run the FastAPI app in-process on the in-memory storage backend
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret-key")
+os.environ["INVENTORY_SNAPSHOT_INTERVAL_HOURS"] = "0"
+os.environ["HISTORY_SPOOL_DIR"] = tempfile.mkdtemp(prefix="siriu-spool-")
+
+import httpx  # noqa: E402
+import server  # noqa: E402
+
+SUPERADMIN_EMAIL = "admin@universidad.edu"
+
+# Minimum bcrypt cost keeps logins and password changes fast in tests
+server.pwd_context.update(bcrypt__rounds=4)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def app():
+    """Fresh database with the default superadmin created by the startup hook"""
+    server.db.clear()
+    await server.app.router.startup()
+    yield server.app
+    await server.app.router.shutdown()
+    server.db.clear()
+
+
+@pytest.fixture
+async def client(app):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http_client:
+        yield http_client
+
+
+async def make_user(role: str, email: str = None) -> dict:
+    """Insert a user directly and return Authorization headers for it (skips bcrypt)"""
+    email = email or f"{role}.test@universidad.edu"
+    user = server.User(email=email, name=role.title(), role=role)
+    doc = user.model_dump()
+    doc["password"] = "not-a-valid-hash"
+    await server.db.users.insert_one(doc)
+    return auth_headers(email)
+
+
+def auth_headers(email: str) -> dict:
+    token = server.create_access_token(data={"sub": email})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+async def superadmin(app):
+    return auth_headers(SUPERADMIN_EMAIL)
+
+
+@pytest.fixture
+async def admin(app):
+    return await make_user("admin")
+
+
+@pytest.fixture
+async def user(app):
+    return await make_user("user")
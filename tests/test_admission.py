@@ -0,0 +1,110 @@
+"""
+Tests for admission control (per-route-class concurrency limits)
+"""
+import asyncio
+
+import httpx
+import pytest
+
+import admission
+import server
+from admission import AdmissionMiddleware, RouteClassLimiter, route_class
+
+pytestmark = pytest.mark.anyio
+
+
+class BlockingApp:
+    """ASGI app whose requests finish only when released, recording the order they started in"""
+
+    def __init__(self):
+        self.started = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, scope, receive, send):
+        self.started.append(dict(scope["headers"]).get(b"x-user", b"").decode())
+        await self.release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+def make_client(app, **options):
+    middleware = AdmissionMiddleware(app, identify=lambda scope: dict(scope["headers"])[b"x-user"].decode(),
+                                     **options)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=middleware), base_url="http://test"), middleware
+
+
+def test_route_classes():
+    assert route_class("/api/equipment/export/pdf") == "export"
+    assert route_class("/api/dashboard/stats") == "dashboard"
+    assert route_class("/api/auth/login") == "auth"
+    assert route_class("/api/equipment/abc") == "crud"
+    assert route_class("/api/history", b"export=ndjson&since=2024-01-01") == "export"
+    assert route_class("/api/history", b"action=updated") == "crud"
+    assert route_class("/api/changes/stream") is None and route_class("/health") is None
+    assert admission.parse_limits("export=2/4, crud=64") == {"export": (2, 4), "crud": (64, 0)}
+
+
+async def test_full_queue_and_per_user_limit_are_rejected_fast():
+    app = BlockingApp()
+    client, _ = make_client(app, limits={"export": (1, 1)}, per_user={"export": 2}, retry_after=7)
+    async with client:
+        first = asyncio.ensure_future(client.get("/api/equipment/export/pdf", headers={"x-user": "ana"}))
+        queued = asyncio.ensure_future(client.get("/api/equipment/export/pdf", headers={"x-user": "ana"}))
+        await asyncio.sleep(0.01)
+
+        over_share = await client.get("/api/equipment/export/pdf", headers={"x-user": "ana"})
+        assert over_share.status_code == 429 and over_share.headers["retry-after"] == "7"
+        full = await client.get("/api/equipment/export/pdf", headers={"x-user": "luis"})
+        assert full.status_code == 503 and full.headers["retry-after"] == "7"
+
+        app.release.set()
+        assert [(await first).status_code, (await queued).status_code] == [200, 200]
+
+
+async def test_freed_slots_rotate_between_users():
+    app = BlockingApp()
+    client, middleware = make_client(app, limits={"crud": (1, 10)}, per_user={})
+    async with client:
+        requests = []
+        for user in ["ana", "ana", "ana", "luis", "eva"]:
+            requests.append(asyncio.ensure_future(client.get("/api/equipment", headers={"x-user": user})))
+            await asyncio.sleep(0.01)
+        assert middleware.limiters["crud"].queued == 4
+        app.release.set()
+        await asyncio.gather(*requests)
+    # Ana queued first but does not get the next slots ahead of the others
+    assert app.started == ["ana", "ana", "luis", "eva", "ana"]
+    assert middleware.limiters["crud"].active == 0 and middleware.limiters["crud"].held == {}
+
+
+async def test_queue_timeout_gives_the_place_back():
+    limiter = RouteClassLimiter("dashboard", concurrency=1, queue_size=5, queue_timeout=0.01)
+    await limiter.acquire("ana")
+    with pytest.raises(admission.Rejected) as rejected:
+        await limiter.acquire("luis")
+    assert rejected.value.status_code == 503 and rejected.value.reason == "timeout"
+    assert limiter.queued == 0 and limiter.held == {"ana": 1}
+    limiter.release("ana")
+    assert limiter.active == 0
+
+
+async def test_server_keys_fairness_on_the_token_subject(client, admin):
+    await client.get("/api/dashboard/stats", headers=admin)
+    body = (await client.get("/metrics")).text
+    assert 'siriu_admission_queue_wait_seconds_count{route_class="dashboard"}' in body
+    me = (await client.get("/api/auth/me", headers=admin)).json()
+    assert server.admission_identity({"headers": [(b"authorization", admin["Authorization"].encode())]}) == me["email"]
+    assert server.admission_identity({"headers": [], "client": ("10.0.0.7", 5000)}) == "10.0.0.7"
+
+
+async def test_batch_items_are_admitted_in_their_own_class(client, admin, monkeypatch):
+    limiter = server.admission_limiters["dashboard"]
+    monkeypatch.setattr(limiter, "per_user", 1)
+    admitted = admission.admission_wait.count(("dashboard",))
+    requests = [{"path": path} for path in ["/api/dashboard/stats", "/api/dashboard/equipment-by-department",
+                                            "/api/dashboard/equipment-by-location"]]
+    response = await client.post("/api/batch", json={"requests": requests}, headers=admin)
+    # One item at a time within the user's share instead of 429s
+    assert [item["status"] for item in response.json()["responses"]] == [200, 200, 200]
+    assert admission.admission_wait.count(("dashboard",)) == admitted + 3
+    assert limiter.active == 0 and limiter.held == {}
@@ -0,0 +1,479 @@
+"""
+In-process API tests covering every endpoint on the in-memory backend
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from .conftest import SUPERADMIN_EMAIL, auth_headers
+
+pytestmark = pytest.mark.anyio
+
+EQUIPMENT = {
+    "ubicacion": "Edificio A - Piso 1 - Aula 101",
+    "resguardante": "Juan Perez",
+    "departamento": "Sistemas",
+    "tipo_bien": "computadora",
+    "numero_serie": "SN-001",
+    "numero_factura": "F-100",
+    "numero_inventario": "INV-1",
+    "marca": "Dell",
+    "modelo": "Optiplex 7090",
+    "fecha_adquisicion": "2024-01-15",
+    "estado_operativo": "asignado",
+    "observaciones": "Equipo de prueba",
+}
+
+
+async def create_equipment(client, headers, **overrides):
+    response = await client.post("/api/equipment", json={**EQUIPMENT, **overrides}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+# Health and root
+
+async def test_root_and_health(client):
+    assert (await client.get("/")).json()["status"] == "ok"
+    assert (await client.get("/health")).json()["status"] == "healthy"
+    assert (await client.get("/api/health")).json()["database"] == "connected"
+    assert "configured_origins" in (await client.get("/debug/cors-info")).json()
+
+
+# Auth
+
+async def test_login_and_me(client):
+    response = await client.post("/api/auth/login", json={"email": SUPERADMIN_EMAIL, "password": "admin123"})
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+
+    me = await client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+    assert me.json()["role"] == "superadmin"
+
+    bad = await client.post("/api/auth/login", json={"email": SUPERADMIN_EMAIL, "password": "wrong"})
+    assert bad.status_code == 401
+
+
+async def test_requests_without_token_are_rejected(client):
+    assert (await client.get("/api/equipment")).status_code == 403
+    bad = await client.get("/api/equipment", headers={"Authorization": "Bearer invalid"})
+    assert bad.status_code == 401
+
+
+async def test_register_requires_superadmin(client, superadmin, admin):
+    payload = {"email": "nuevo@universidad.edu", "name": "Nuevo", "password": "secret", "role": "user"}
+    assert (await client.post("/api/auth/register", json=payload, headers=admin)).status_code == 403
+
+    response = await client.post("/api/auth/register", json=payload, headers=superadmin)
+    assert response.status_code == 200
+    assert response.json()["email"] == "nuevo@universidad.edu"
+
+    duplicate = await client.post("/api/auth/register", json=payload, headers=superadmin)
+    assert duplicate.status_code == 400
+
+
+async def test_change_password(client, superadmin):
+    missing = await client.put("/api/auth/change-password", json={}, headers=superadmin)
+    assert missing.status_code == 400
+
+    wrong = await client.put("/api/auth/change-password",
+                             json={"current_password": "nope", "new_password": "x"}, headers=superadmin)
+    assert wrong.status_code == 400
+
+    ok = await client.put("/api/auth/change-password",
+                          json={"current_password": "admin123", "new_password": "nueva123"}, headers=superadmin)
+    assert ok.status_code == 200
+
+
+# Equipment
+
+async def test_equipment_crud_and_history(client, superadmin, admin, user):
+    assert (await client.post("/api/equipment", json=EQUIPMENT, headers=user)).status_code == 403
+
+    created = await create_equipment(client, admin)
+    equipment_id = created["id"]
+
+    fetched = await client.get(f"/api/equipment/{equipment_id}", headers=user)
+    assert fetched.json()["numero_serie"] == "SN-001"
+    assert (await client.get("/api/equipment/missing", headers=user)).status_code == 404
+
+    updated = await client.put(f"/api/equipment/{equipment_id}",
+                               json={"estado_operativo": "en_mantenimiento"}, headers=admin)
+    assert updated.status_code == 200
+    assert updated.json()["estado_operativo"] == "en_mantenimiento"
+    assert (await client.put("/api/equipment/missing", json={}, headers=admin)).status_code == 404
+
+    history = (await client.get(f"/api/history/{equipment_id}", headers=user)).json()
+    assert sorted(entry["action"] for entry in history) == ["created", "updated"]
+
+    assert (await client.delete(f"/api/equipment/{equipment_id}", headers=admin)).status_code == 403
+    assert (await client.delete(f"/api/equipment/{equipment_id}", headers=superadmin)).status_code == 200
+    assert (await client.delete(f"/api/equipment/{equipment_id}", headers=superadmin)).status_code == 404
+
+    history = (await client.get(f"/api/history/{equipment_id}", headers=user)).json()
+    assert len(history) == 3
+
+
+async def test_equipment_updates_are_version_checked(client, admin, user):
+    equipment_id = (await create_equipment(client, admin))["id"]
+    fetched = await client.get(f"/api/equipment/{equipment_id}", headers=user)
+    assert fetched.json()["version"] == 0 and fetched.headers["etag"] == '"0"'
+
+    first = await client.put(f"/api/equipment/{equipment_id}", json={"resguardante": "Ana"},
+                             headers={**admin, "If-Match": '"0"'})
+    assert first.status_code == 200
+    assert first.json()["version"] == 1 and first.headers["etag"] == '"1"'
+
+    # A second editor still holding version 0 is rejected instead of overwriting
+    stale = await client.put(f"/api/equipment/{equipment_id}", json={"resguardante": "Luis"},
+                             headers={**admin, "If-Match": '"0"'})
+    assert stale.status_code == 409
+    stale = await client.put(f"/api/equipment/{equipment_id}", json={"resguardante": "Luis", "version": 0},
+                             headers=admin)
+    assert stale.status_code == 409
+    assert (await client.get(f"/api/equipment/{equipment_id}", headers=user)).json()["resguardante"] == "Ana"
+
+    # Without a precondition the update is applied (last writer wins)
+    forced = await client.put(f"/api/equipment/{equipment_id}", json={"resguardante": "Luis"}, headers=admin)
+    assert forced.json()["version"] == 2
+    missing = await client.put("/api/equipment/missing", json={}, headers={**admin, "If-Match": "1"})
+    assert missing.status_code == 404
+    bad = await client.put(f"/api/equipment/{equipment_id}", json={}, headers={**admin, "If-Match": "abc"})
+    assert bad.status_code == 400
+
+    history = (await client.get(f"/api/history/{equipment_id}", headers=user)).json()
+    assert [entry["new_values"].get("resguardante") for entry in history[:2]] == ["Luis", "Ana"]
+    assert history[1]["old_values"]["resguardante"] == "Juan Perez"
+
+
+async def test_equipment_delta_sync(client, admin, superadmin, user):
+    ids = [(await create_equipment(client, admin, numero_serie=f"SN-{n}"))["id"] for n in range(3)]
+
+    # Initial sync, one page at a time
+    first = (await client.get("/api/equipment/changes", params={"limit": 2}, headers=user)).json()
+    assert first["has_more"] and len(first["changes"]) == 2
+    rest = (await client.get("/api/equipment/changes", params={"since": first["token"], "limit": 2},
+                             headers=user)).json()
+    assert not rest["has_more"] and rest["deleted"] == []
+    assert sorted(doc["id"] for doc in first["changes"] + rest["changes"]) == sorted(ids)
+
+    # Rewind the clock-skew window so only the writes below are newer than the token
+    for equipment_id in ids:
+        await server.db.equipment.update_one(
+            {"id": equipment_id}, {"$set": {"updated_at": datetime.now(timezone.utc) - timedelta(minutes=5)}})
+    await client.put(f"/api/equipment/{ids[0]}", json={"resguardante": "Ana"}, headers=admin)
+    await client.delete(f"/api/equipment/{ids[1]}", headers=superadmin)
+
+    delta = (await client.get("/api/equipment/changes", params={"since": rest["token"]}, headers=user)).json()
+    assert [doc["id"] for doc in delta["changes"]] == [ids[0]]
+    assert delta["changes"][0]["resguardante"] == "Ana"
+    assert [tombstone["id"] for tombstone in delta["deleted"]] == [ids[1]]
+
+    # Until migrate_datetimes runs, edits stored with a string updated_at are only found by a full pass
+    await server.db.equipment.update_one({"id": ids[2]}, {"$set": {"updated_at": "2023-01-01T00:00:00+00:00"}})
+    pages, token = [], delta["token"]
+    while True:
+        page = (await client.get("/api/equipment/changes", params={"since": token, "limit": 1}, headers=user)).json()
+        pages.append([doc["id"] for doc in page["changes"]])
+        token = page["token"]
+        if not page["has_more"]:
+            break
+    assert sorted(sum(pages, [])) == sorted([ids[0], ids[2]])
+
+    assert (await client.get("/api/equipment/changes", params={"since": "nope"}, headers=user)).status_code == 400
+    expired = server.encode_sync_token({"b": (datetime.now(timezone.utc) - timedelta(days=365)).isoformat()})
+    assert (await client.get("/api/equipment/changes", params={"since": expired}, headers=user)).status_code == 410
+
+
+async def test_equipment_filters_and_search(client, admin):
+    await create_equipment(client, admin)
+    await create_equipment(client, admin, numero_serie="SN-002", marca="HP", tipo_bien="periferico",
+                           estado_operativo="disponible", departamento="Finanzas")
+
+    all_items = (await client.get("/api/equipment", headers=admin)).json()
+    assert len(all_items) == 2
+
+    by_type = (await client.get("/api/equipment", params={"tipo_bien": "periferico"}, headers=admin)).json()
+    assert [item["numero_serie"] for item in by_type] == ["SN-002"]
+
+    by_status = (await client.get("/api/equipment", params={"estado_operativo": "asignado"}, headers=admin)).json()
+    assert [item["numero_serie"] for item in by_status] == ["SN-001"]
+
+    by_department = (await client.get("/api/equipment", params={"departamento": "Finanzas"}, headers=admin)).json()
+    assert len(by_department) == 1
+
+    by_location = (await client.get("/api/equipment", params={"ubicacion": EQUIPMENT["ubicacion"]},
+                                    headers=admin)).json()
+    assert len(by_location) == 2
+
+    search = (await client.get("/api/equipment", params={"search": "hp"}, headers=admin)).json()
+    assert [item["marca"] for item in search] == ["HP"]
+
+
+async def test_list_fast_path_matches_response_model(client, admin):
+    created = await create_equipment(client, admin)
+    # Legacy document: no version, an unknown field and a string date
+    await server.db.equipment.insert_one({**EQUIPMENT, "id": "legacy", "numero_serie": "SN-OLD", "interno": True,
+                                          "created_by": "admin@universidad.edu",
+                                          "created_at": "2023-05-01T10:00:00+00:00"})
+    listed = {item["id"]: item for item in (await client.get("/api/equipment", headers=admin)).json()}
+    assert listed[created["id"]] == (await client.get(f"/api/equipment/{created['id']}", headers=admin)).json()
+    assert listed["legacy"]["version"] == 0 and "interno" not in listed["legacy"]
+    assert set(listed["legacy"]) == set(server.Equipment.model_fields)
+
+
+async def test_equipment_sparse_fields_and_sorting(client, admin):
+    for serie, marca, departamento in [("SN-3", "HP", "Sistemas"), ("SN-1", "Dell", "Finanzas"),
+                                       ("SN-2", "Acer", "Sistemas")]:
+        await create_equipment(client, admin, numero_serie=serie, marca=marca, departamento=departamento)
+
+    params = {"fields": "numero_serie,marca", "sort": "departamento,-numero_serie"}
+    rows = (await client.get("/api/equipment", params=params, headers=admin)).json()
+    assert [row["numero_serie"] for row in rows] == ["SN-1", "SN-3", "SN-2"]
+    assert set(rows[0]) == {"id", "numero_serie", "marca"}
+
+    as_of = datetime.now(timezone.utc).isoformat()
+    rebuilt = (await client.get("/api/equipment", params={**params, "as_of": as_of}, headers=admin)).json()
+    assert [row["numero_serie"] for row in rebuilt] == ["SN-1", "SN-3", "SN-2"]
+    assert set(rebuilt[0]) == {"id", "numero_serie", "marca"}
+
+    page = (await client.get("/api/equipment", params={"sort": "numero_serie", "offset": 1, "limit": 1},
+                             headers=admin)).json()
+    assert [row["numero_serie"] for row in page] == ["SN-2"]
+
+    assert "numero_serie_1_id_1" in await server.db.equipment.index_information()
+    assert server.parse_sort("-marca", server.EQUIPMENT_SORT_FIELDS) == [("marca", -1), ("id", -1)]
+    assert (await client.get("/api/equipment", params={"fields": "precio"}, headers=admin)).status_code == 400
+    assert (await client.get("/api/equipment", params={"sort": "observaciones"}, headers=admin)).status_code == 400
+
+
+async def test_equipment_facets(client, admin):
+    for serie, tipo, departamento in [("SN-1", "computadora", "Sistemas"), ("SN-2", "periferico", "Sistemas"),
+                                      ("SN-3", "computadora", "Finanzas"), ("SN-4", "computadora", "Sistemas")]:
+        await create_equipment(client, admin, numero_serie=serie, tipo_bien=tipo, departamento=departamento)
+
+    params = {"facets": "true", "tipo_bien": "computadora", "limit": 2, "fields": "numero_serie"}
+    result = (await client.get("/api/equipment", params=params, headers=admin)).json()
+    assert result["total"] == 3
+    assert [row["id"] for row in result["items"]] == sorted(row["id"] for row in result["items"])
+    assert len(result["items"]) == 2 and set(result["items"][0]) == {"id", "numero_serie"}
+    # A facet ignores its own filter, the others apply
+    assert result["facets"]["tipo_bien"] == {"computadora": 3, "periferico": 1}
+    assert result["facets"]["departamento"] == {"Sistemas": 2, "Finanzas": 1}
+    assert result["facets"]["estado_operativo"] == {"asignado": 3}
+
+    as_of = datetime.now(timezone.utc).isoformat()
+    rebuilt = (await client.get("/api/equipment", params={**params, "as_of": as_of}, headers=admin)).json()
+    assert rebuilt["facets"] == result["facets"] and rebuilt["total"] == 3
+
+
+async def test_equipment_detail(client, admin, user):
+    location = (await client.post("/api/locations", json={"edificio": "Torre", "piso": "2", "salon_aula": "Lab 3"},
+                                  headers=admin)).json()
+    edificio = (await client.post("/api/edificios", json={"nombre": "Torre"}, headers=admin)).json()
+    department = (await client.post("/api/departments", json={
+        "nombre": "Sistemas", "ubicacion_id": location["id"], "numero_trabajadores": 1}, headers=admin)).json()
+    created = await create_equipment(client, admin, ubicacion="Torre, Piso 2, Lab 3")
+    other = await create_equipment(client, admin, numero_serie="SN-002")
+    await create_equipment(client, admin, numero_serie="SN-003", resguardante="Otra Persona")
+    for marca in ["HP", "Lenovo"]:
+        await client.put(f"/api/equipment/{created['id']}", json={"marca": marca}, headers=admin)
+
+    response = await client.get(f"/api/equipment/{created['id']}/detail", params={"history_limit": 2}, headers=user)
+    assert response.status_code == 200 and response.headers["etag"] == '"2"'
+    detail = response.json()
+    assert detail["equipment"]["marca"] == "Lenovo"
+    assert detail["location"]["id"] == location["id"] and detail["edificio"]["id"] == edificio["id"]
+    assert detail["department"]["id"] == department["id"]
+    assert [asset["id"] for asset in detail["custodian_assets"]] == [other["id"]]
+
+    history = detail["history"]
+    assert [entry["version"] for entry in history["items"]] == [3, 2] and "new_values" not in history["items"][0]
+    rest = await client.get(f"/api/history/{created['id']}", params={"cursor": history["next_cursor"]},
+                            headers=user)
+    assert [entry["version"] for entry in rest.json()] == [1]
+
+    # Free-text locations written before the catalog existed resolve to nothing
+    legacy = (await client.get(f"/api/equipment/{other['id']}/detail", headers=user)).json()
+    assert legacy["location"] is None and legacy["edificio"] is None
+    # Assets without a custodian are not grouped together
+    unassigned = [(await create_equipment(client, admin, numero_serie=f"SN-1{n}", resguardante=""))["id"]
+                  for n in range(2)]
+    unassigned_detail = (await client.get(f"/api/equipment/{unassigned[0]}/detail", headers=user)).json()
+    assert unassigned_detail["custodian_assets"] == []
+    # Nor are assets without a department matched to a department without a name
+    await server.db.departments.insert_one({"id": "sin-nombre", "ubicacion_id": location["id"]})
+    await server.db.equipment.update_one({"id": unassigned[1]}, {"$unset": {"departamento": ""}})
+    assert (await client.get(f"/api/equipment/{unassigned[1]}/detail", headers=user)).json()["department"] is None
+    assert (await client.get("/api/equipment/missing/detail", headers=user)).status_code == 404
+
+
+# Dashboards
+
+async def test_dashboards(client, admin):
+    await client.post("/api/tipos-bien", json={"nombre": "computadora"}, headers=admin)
+    await client.post("/api/edificios", json={"nombre": "Edificio A"}, headers=admin)
+    location = (await client.post("/api/locations", json={"edificio": "Edificio A", "piso": "Piso 1",
+                                                          "salon_aula": "Aula 101"}, headers=admin)).json()
+    await client.post("/api/departments", json={"nombre": "Sistemas", "ubicacion_id": location["id"],
+                                                "numero_trabajadores": 3}, headers=admin)
+    await create_equipment(client, admin)
+    await create_equipment(client, admin, numero_serie="SN-002", estado_operativo="disponible")
+
+    stats = (await client.get("/api/dashboard/stats", headers=admin)).json()
+    assert stats["total_equipment"] == 2
+    assert stats["by_type"] == {"computadora": 2}
+    assert stats["by_status"]["asignado"] == 1
+    assert stats["by_department"] == {"Sistemas": 2}
+
+    by_department = (await client.get("/api/dashboard/equipment-by-department", headers=admin)).json()
+    assert by_department[0]["department"] == "Sistemas"
+    assert by_department[0]["by_status"] == {"asignado": 1, "disponible": 1}
+
+    by_location = (await client.get("/api/dashboard/equipment-by-location", headers=admin)).json()
+    assert by_location[0]["total"] == 2
+
+    by_edificio = (await client.get("/api/dashboard/equipment-by-edificio", headers=admin)).json()
+    assert by_edificio == [{"edificio": "Edificio A", "total": 2,
+                            "by_status": {"asignado": 1, "disponible": 1}, "by_type": {"computadora": 2}}]
+
+
+# Batch
+
+async def test_batch_dispatches_sub_requests_with_one_authentication(client, admin, user, monkeypatch):
+    created = await create_equipment(client, admin)
+    lookups = []
+    original = server.user_from_token
+
+    async def counting_user_from_token(token):
+        lookups.append(token)
+        return await original(token)
+    monkeypatch.setattr(server, "user_from_token", counting_user_from_token)
+
+    requests = [
+        {"id": "stats", "path": "/api/dashboard/stats"},
+        {"id": "list", "path": "/api/equipment?fields=numero_serie", "params": {"limit": 1}},
+        {"id": "one", "path": f"/api/equipment/{created['id']}"},
+        {"id": "missing", "path": "/api/equipment/missing"},
+        {"id": "forbidden", "path": "/api/users"},
+        {"id": "stream", "path": "/api/changes/stream"},
+        {"id": "audit", "path": "/api/history", "params": {"export": "ndjson"}},
+    ]
+    response = await client.post("/api/batch", json={"requests": requests}, headers=user)
+    assert response.status_code == 200 and len(lookups) == 1
+    results = {item["id"]: item for item in response.json()["responses"]}
+    assert list(results) == [request["id"] for request in requests]
+    assert results["stats"]["body"]["total_equipment"] == 1
+    assert results["list"]["body"] == [{"id": created["id"], "numero_serie": "SN-001"}]
+    assert results["one"]["headers"]["etag"] == '"0"'
+    assert [results[key]["status"] for key in ("missing", "forbidden", "stream", "audit")] == [404, 403, 400, 400]
+
+    too_many = [{"path": "/api/auth/me"}] * (server.batch.BATCH_MAX_REQUESTS + 1)
+    assert (await client.post("/api/batch", json={"requests": too_many}, headers=user)).status_code == 413
+    assert (await client.post("/api/batch", json={"requests": []})).status_code == 403
+
+
+# Exports
+
+async def test_exports(client, admin):
+    await create_equipment(client, admin)
+
+    excel = await client.get("/api/equipment/export/excel", headers=admin)
+    assert excel.status_code == 200
+    assert excel.content[:2] == b"PK"
+
+    pdf = await client.get("/api/equipment/export/pdf", headers=admin)
+    assert pdf.status_code == 200
+    assert pdf.content[:4] == b"%PDF"
+
+
+# Catalogs
+
+async def test_locations_crud(client, admin, user):
+    payload = {"edificio": "Edificio B", "piso": "Piso 2", "salon_aula": "Lab 3"}
+    assert (await client.post("/api/locations", json=payload, headers=user)).status_code == 403
+    location = (await client.post("/api/locations", json=payload, headers=admin)).json()
+
+    assert len((await client.get("/api/locations", headers=user)).json()) == 1
+
+    updated = await client.put(f"/api/locations/{location['id']}", json={"piso": "Piso 3"}, headers=admin)
+    assert updated.json()["piso"] == "Piso 3"
+    assert (await client.put("/api/locations/missing", json={}, headers=admin)).status_code == 404
+
+    assert (await client.delete(f"/api/locations/{location['id']}", headers=admin)).status_code == 200
+    assert (await client.delete(f"/api/locations/{location['id']}", headers=admin)).status_code == 404
+
+
+async def test_departments_crud(client, admin):
+    location = (await client.post("/api/locations", json={"edificio": "A", "piso": "1", "salon_aula": "2"},
+                                  headers=admin)).json()
+    payload = {"nombre": "Finanzas", "ubicacion_id": location["id"], "numero_trabajadores": 2,
+               "trabajadores": [{"nombre": "Ana"}]}
+    bad = await client.post("/api/departments", json={**payload, "ubicacion_id": "missing"}, headers=admin)
+    assert bad.status_code == 400
+
+    department = (await client.post("/api/departments", json=payload, headers=admin)).json()
+    assert len((await client.get("/api/departments", headers=admin)).json()) == 1
+
+    updated = await client.put(f"/api/departments/{department['id']}", json={"numero_trabajadores": 5},
+                               headers=admin)
+    assert updated.json()["numero_trabajadores"] == 5
+    assert (await client.put("/api/departments/missing", json={}, headers=admin)).status_code == 404
+
+    assert (await client.delete(f"/api/departments/{department['id']}", headers=admin)).status_code == 200
+    assert (await client.delete(f"/api/departments/{department['id']}", headers=admin)).status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/api/tipos-bien", "/api/marcas", "/api/edificios"])
+async def test_named_catalog_crud(client, admin, user, path):
+    assert (await client.get(path, headers=user)).status_code == 403
+
+    created = (await client.post(path, json={"nombre": "Uno"}, headers=admin)).json()
+    assert (await client.post(path, json={"nombre": "Uno"}, headers=admin)).status_code == 400
+    await client.post(path, json={"nombre": "Dos"}, headers=admin)
+    assert len((await client.get(path, headers=admin)).json()) == 2
+
+    renamed = await client.put(f"{path}/{created['id']}", json={"nombre": "Tres"}, headers=admin)
+    assert renamed.json()["nombre"] == "Tres"
+    clash = await client.put(f"{path}/{created['id']}", json={"nombre": "Dos"}, headers=admin)
+    assert clash.status_code == 400
+    assert renamed.json()["version"] == 1
+    stale = await client.put(f"{path}/{created['id']}", json={"nombre": "Cuatro"}, headers={**admin, "If-Match": "0"})
+    assert stale.status_code == 409
+    assert (await client.put(f"{path}/missing", json={}, headers=admin)).status_code == 404
+
+    assert (await client.delete(f"{path}/{created['id']}", headers=admin)).status_code == 200
+    assert (await client.delete(f"{path}/{created['id']}", headers=admin)).status_code == 404
+
+
+# Users
+
+async def test_user_management(client, superadmin, admin):
+    assert (await client.get("/api/users", headers=admin)).status_code == 403
+
+    users = (await client.get("/api/users", headers=superadmin)).json()
+    assert {u["role"] for u in users} == {"superadmin", "admin"}
+    assert all("password" not in u for u in users)
+    admin_id = next(u["id"] for u in users if u["role"] == "admin")
+
+    updated = await client.put(f"/api/users/{admin_id}",
+                               json={"email": "admin2@universidad.edu", "name": "Admin 2",
+                                     "password": "", "role": "admin"},
+                               headers=superadmin)
+    assert updated.json()["email"] == "admin2@universidad.edu"
+
+    reset = await client.post(f"/api/users/{admin_id}/reset-password", headers=superadmin)
+    assert reset.status_code == 200
+    assert (await client.post("/api/users/missing/reset-password", headers=superadmin)).status_code == 404
+
+    me = (await client.get("/api/auth/me", headers=superadmin)).json()
+    assert (await client.delete(f"/api/users/{me['id']}", headers=superadmin)).status_code == 400
+    assert (await client.delete(f"/api/users/{admin_id}", headers=superadmin)).status_code == 200
+    assert (await client.delete(f"/api/users/{admin_id}", headers=superadmin)).status_code == 404
+
+
+async def test_deleted_user_token_is_rejected(client, superadmin):
+    headers = auth_headers("ghost@universidad.edu")
+    assert (await client.get("/api/auth/me", headers=headers)).status_code == 401
+    assert server.STORAGE_BACKEND == "memory"
@@ -0,0 +1,47 @@
+"""
+Tests for the synthetic campus generator used by the benchmarks
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+import server
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+from campus import CampusGenerator, seed_database  # noqa: E402
+
+pytestmark = pytest.mark.anyio
+
+
+def test_generator_is_deterministic():
+    first = CampusGenerator(assets=200, seed=7).generate()
+    second = CampusGenerator(assets=200, seed=7).generate()
+    assert first == second
+    assert CampusGenerator(assets=200, seed=8).generate()["equipment"] != first["equipment"]
+
+
+def test_generated_documents_match_api_models():
+    campus = CampusGenerator(assets=100, seed=1).generate()
+    assert len(campus["equipment"]) == 100
+    assert len(campus["history"]) >= 100
+    for doc in campus["equipment"]:
+        server.Equipment(**doc)
+    for doc in campus["departments"]:
+        server.Department(**doc)
+    for doc in campus["history"]:
+        server.HistoryEntry(**doc)
+
+    location_names = {f"{l['edificio']} - {l['piso']} - {l['salon_aula']}" for l in campus["locations"]}
+    assert {eq["ubicacion"] for eq in campus["equipment"]} <= location_names
+
+
+async def test_seeded_campus_is_served_by_the_api(client, admin):
+    campus = CampusGenerator(assets=50, seed=3).generate()
+    counts = await seed_database(server.db, campus)
+    assert counts["equipment"] == 50
+
+    stats = (await client.get("/api/dashboard/stats", headers=admin)).json()
+    assert stats["total_equipment"] == 50
+    assert sum(stats["by_type"].values()) == 50
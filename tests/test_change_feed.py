@@ -0,0 +1,146 @@
+"""
+Tests for the live change feed
+"""
+import asyncio
+import json
+
+import pytest
+
+import change_feed
+import server
+from change_feed import ChangeHub
+
+from .test_api import create_equipment
+
+pytestmark = pytest.mark.anyio
+
+
+def parse(chunk: str) -> dict:
+    fields = dict(line.split(": ", 1) for line in chunk.strip().splitlines() if not line.startswith(":"))
+    return {"id": fields.get("id"), "event": fields.get("event"), "data": json.loads(fields.get("data", "null"))}
+
+
+async def test_slow_subscribers_catch_up_from_the_buffer():
+    hub = ChangeHub(buffer_size=20, queue_size=2)
+    subscription = hub.subscribe(["equipment"])
+    for number in range(5):
+        hub.publish("equipment", "update", f"eq-{number}", ["estado_operativo"])
+    hub.publish("marcas", "insert", "marca-1")
+    assert subscription.lagging
+
+    received = [await subscription.next(0.01) for _ in range(5)]
+    assert [event["id"] for event in received] == [f"eq-{number}" for number in range(5)]
+    assert await subscription.next(0.01) is None
+
+    # Far behind what the buffer keeps: the client is told to refetch
+    small = ChangeHub(buffer_size=3, queue_size=1)
+    behind = small.subscribe(["equipment"])
+    for number in range(6):
+        small.publish("equipment", "update", f"eq-{number}")
+    assert [await behind.next(0.01) for _ in range(1)][0]["id"] == "eq-0"
+    reset = await behind.next(0.01)
+    assert reset == {"reset": small.latest_token}
+    assert await behind.next(0.01) is None
+
+
+async def test_resume_tokens():
+    hub = ChangeHub(buffer_size=10)
+    hub.publish("equipment", "insert", "eq-1")
+    token = hub.latest_token
+    hub.publish("equipment", "update", "eq-1", ["resguardante", "updated_at", "version"])
+    hub.publish("equipment", "delete", "eq-1")
+
+    resumed = hub.subscribe(change_feed.FEED_COLLECTIONS, last_token=token)
+    update = await resumed.next(0.01)
+    assert update["operation"] == "update" and update["changed_fields"] == ["resguardante"]
+    assert (await resumed.next(0.01))["operation"] == "delete"
+
+    for stale in ("another-boot-3", "garbage"):
+        assert "reset" in await hub.subscribe(["equipment"], last_token=stale).next(0.01)
+
+
+async def test_api_writes_reach_the_event_stream(client, admin):
+    open_before = change_feed.subscribers.value()
+    stream = change_feed.event_stream(server.db, ["equipment"], heartbeat=0.01)
+    first = parse(await stream.__anext__())
+    equipment_id = (await create_equipment(client, admin))["id"]
+    await client.put(f"/api/equipment/{equipment_id}", json={"resguardante": "Ana"}, headers=admin)
+    await client.post("/api/marcas", json={"nombre": "Dell"}, headers=admin)
+
+    created = parse(await stream.__anext__())
+    assert created["event"] == "change" and created["data"]["operation"] == "insert"
+    assert created["data"]["id"] == equipment_id
+    updated = parse(await stream.__anext__())
+    assert updated["data"]["changed_fields"] == ["resguardante"]
+    assert updated["id"] == updated["data"]["token"] != first["id"]
+    assert (await stream.__anext__()).startswith(": keepalive")
+    await stream.aclose()
+    assert change_feed.subscribers.value() == open_before
+
+    resumed = change_feed.event_stream(server.db, ["equipment"], last_token=created["id"], heartbeat=0.01)
+    await resumed.__anext__()
+    assert parse(await resumed.__anext__())["data"]["operation"] == "update"
+    await resumed.aclose()
+
+
+class FakeChangeStream:
+    """Change stream stand-in yielding the changes put on a queue"""
+
+    def __init__(self, changes: asyncio.Queue):
+        self.changes = changes
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.changes.get()
+
+
+async def test_one_change_stream_is_shared_by_every_connection(monkeypatch):
+    changes = asyncio.Queue()
+    opened = []
+
+    class Database:
+        def watch(self, pipeline, **options):
+            opened.append(options)
+            return FakeChangeStream(changes)
+
+    monkeypatch.setattr(change_feed, "hub", ChangeHub(buffer_size=10))
+    monkeypatch.setattr(change_feed, "_source", "inprocess")
+    await change_feed.configure(Database(), "mongodb", source="changestream")
+    try:
+        streams = [change_feed.event_stream(None, ["equipment"], heartbeat=0.01) for _ in range(3)]
+        for stream in streams:
+            await stream.__anext__()
+        # Writes of this process are reported by the change stream, not published twice
+        change_feed.publish("equipment", "update", "eq-1", ["marca"])
+        for number in (1, 2):
+            changes.put_nowait({"_id": {"_data": f"token-{number}"}, "operationType": "update",
+                                "ns": {"coll": "equipment"}, "documentKey": {"_id": "oid"},
+                                "fullDocument": {"id": f"eq-{number}"},
+                                "updateDescription": {"updatedFields": {"marca": "HP"}}})
+        received = [[parse(await stream.__anext__()) for _ in range(2)] for stream in streams]
+        assert len(opened) == 1
+        assert [[event["data"]["id"] for event in events] for events in received] == [["eq-1", "eq-2"]] * 3
+        first_token = received[0][0]["id"]
+        assert first_token.startswith("cs-")
+        for stream in streams:
+            await stream.aclose()
+
+        resumed = change_feed.event_stream(None, ["equipment"], last_token=first_token, heartbeat=0.01)
+        await resumed.__anext__()
+        assert parse(await resumed.__anext__())["data"]["id"] == "eq-2"
+        await resumed.aclose()
+    finally:
+        await change_feed.stop()
+
+
+async def test_stream_requires_a_token(client):
+    assert (await client.get("/api/changes/stream")).status_code == 401
+    assert (await client.get("/api/changes/stream", params={"access_token": "bad"})).status_code == 401
@@ -0,0 +1,106 @@
+"""
+Tests for native datetime storage and the string timestamp migration
+"""
+from datetime import datetime, timezone
+
+import pytest
+
+import datetime_codec
+import history_store
+import migrate_datetimes
+import server
+from memory_db import MemoryDB
+
+from .test_api import create_equipment
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_timestamps_are_stored_as_native_datetimes(client, admin):
+    created = await create_equipment(client, admin)
+    await client.put(f"/api/equipment/{created['id']}", json={"marca": "HP"}, headers=admin)
+    await history_store.flush_pending()
+
+    stored = await server.db.equipment.find_one({"id": created["id"]})
+    assert isinstance(stored["created_at"], datetime) and stored["created_at"].tzinfo is not None
+    assert isinstance(stored["updated_at"], datetime)
+    entry = await server.db.history.find_one({"equipment_id": created["id"], "version": 1})
+    assert isinstance(entry["timestamp"], datetime)
+
+    fetched = (await client.get(f"/api/equipment/{created['id']}", headers=admin)).json()
+    assert datetime.fromisoformat(fetched["updated_at"]) >= datetime.fromisoformat(fetched["created_at"])
+
+
+async def test_tz_aware_memory_engine_and_type_queries():
+    db = MemoryDB(tz_aware=True)
+    await db.items.insert_one({"id": "1", "at": datetime(2024, 1, 1, 12, 0, 0, 123456)})
+    await db.items.insert_one({"id": "2", "at": "2024-01-01T12:00:00"})
+    stored = await db.items.find_one({"id": "1"})
+    assert stored["at"] == datetime(2024, 1, 1, 12, 0, 0, 123000, tzinfo=timezone.utc)
+    assert [doc["id"] for doc in await db.items.find({"at": {"$type": "string"}}).to_list(None)] == ["2"]
+    assert [doc["id"] for doc in await db.items.find({"at": {"$type": "date"}}).to_list(None)] == ["1"]
+
+
+async def test_migration_converts_string_timestamps_in_batches():
+    db = MemoryDB(tz_aware=True)
+    for i in range(5):
+        await db.equipment.insert_one({"id": f"eq-{i}", "created_at": f"2024-01-0{i + 1}T08:00:00+00:00",
+                                       "updated_at": datetime(2024, 2, 1, tzinfo=timezone.utc)})
+    await db.users.insert_one({"id": "u-1", "created_at": "no es una fecha"})
+    await db.history.insert_one({"id": "h-1", "timestamp": "2024-01-01T08:00:00",
+                                 "new_values": {"created_at": "2024-01-01T08:00:00+00:00", "marca": "HP"}})
+
+    report = await migrate_datetimes.migrate_datetimes(db, batch_size=2)
+    assert report["equipment"] == {"scanned": 5, "converted": 5, "unparseable": 0}
+    assert report["users"]["unparseable"] == 1
+
+    equipment = await db.equipment.find({}, {"_id": 0}).sort("id", 1).to_list(None)
+    assert [doc["created_at"].day for doc in equipment] == [1, 2, 3, 4, 5]
+    entry = await db.history.find_one({"id": "h-1"})
+    assert entry["timestamp"] == datetime(2024, 1, 1, 8, tzinfo=timezone.utc)
+    assert entry["new_values"] == {"created_at": datetime(2024, 1, 1, 8, tzinfo=timezone.utc), "marca": "HP"}
+
+    # Resumable: a second run only revisits what could not be converted
+    again = await migrate_datetimes.migrate_datetimes(db, batch_size=2)
+    assert again["equipment"]["scanned"] == 0 and again["users"] == {"scanned": 1, "converted": 0, "unparseable": 1}
+
+
+async def test_validators_are_switched_to_dates_before_converting():
+    commands = []
+
+    class Collections:
+        def __init__(self, infos):
+            self.infos = iter(infos)
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            try:
+                return next(self.infos)
+            except StopIteration:
+                raise StopAsyncIteration
+
+    class Database:
+        async def list_collections(self, filter=None):
+            schema = {"bsonType": "object", "properties": {"id": {"bsonType": "string"},
+                                                            "timestamp": {"bsonType": "string"}}}
+            return Collections([{"name": "history", "options": {"validator": {"$jsonSchema": schema}}},
+                                {"name": "marcas", "options": {}}])
+
+        async def command(self, name, value, **kwargs):
+            commands.append((name, value, kwargs))
+
+    assert await migrate_datetimes.update_validators(Database()) == ["history"]
+    [(name, collection, options)] = commands
+    assert (name, collection, options["validationLevel"]) == ("collMod", "history", "moderate")
+    properties = options["validator"]["$jsonSchema"]["properties"]
+    assert properties == {"id": {"bsonType": "string"}, "timestamp": {"bsonType": "date"}}
+    assert await migrate_datetimes.update_validators(MemoryDB()) == []
+
+
+def test_blob_codec_round_trips_dates_and_reads_legacy_strings():
+    moment = datetime(2024, 3, 1, 10, 30, tzinfo=timezone.utc)
+    assert datetime_codec.loads(datetime_codec.dumps({"timestamp": moment})) == {"timestamp": moment}
+    legacy = datetime_codec.loads('{"timestamp": "2024-03-01T10:30:00+00:00"}')
+    assert datetime_codec.decode(legacy) == {"timestamp": moment}
@@ -0,0 +1,417 @@
+"""
+Tests for the equipment history endpoints
+"""
+from datetime import datetime, timedelta, timezone
+import asyncio
+import csv
+import json
+
+import pytest
+
+import history_archive
+import history_store
+import history_writer
+import server
+from history_writer import HistoryWriter
+
+from .test_api import create_equipment
+
+pytestmark = pytest.mark.anyio
+
+EQUIPMENT_ID = "eq-history"
+START = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+
+async def seed_history(count: int = 7):
+    """Entries one hour apart, alternating actions and authors"""
+    for i in range(count):
+        entry = server.HistoryEntry(
+            id=f"h{i:02d}",
+            equipment_id=EQUIPMENT_ID,
+            action="created" if i == 0 else "updated",
+            changed_by="ana@universidad.edu" if i % 2 else "luis@universidad.edu",
+            timestamp=START + timedelta(hours=i),
+            old_values={"estado_operativo": "disponible"},
+            new_values={"estado_operativo": "asignado", "_id": "dropped"},
+        ).model_dump()
+        await server.db.history.insert_one(entry)
+    entry.pop("_id")
+    await server.db.history.insert_one({**entry, "id": "other", "equipment_id": "another"})
+
+
+async def test_history_is_paginated_newest_first(client, user):
+    await seed_history()
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = await client.get(f"/api/history/{EQUIPMENT_ID}", params=params, headers=user)
+        assert response.status_code == 200
+        pages.append([entry["id"] for entry in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert pages == [["h06", "h05", "h04"], ["h03", "h02", "h01"], ["h00"]]
+
+    entry = (await client.get(f"/api/history/{EQUIPMENT_ID}", params={"limit": 1}, headers=user)).json()[0]
+    assert entry["new_values"] == {"estado_operativo": "asignado"}
+    assert entry["timestamp"] == (START + timedelta(hours=6)).isoformat()
+
+
+async def test_history_filters_and_summary(client, user):
+    await seed_history()
+    params = {
+        "action": "updated",
+        "changed_by": "ana@universidad.edu",
+        "since": (START + timedelta(hours=2)).isoformat(),
+        "until": "2024-03-01T06:00:00",
+        "summary": "true",
+    }
+    response = await client.get(f"/api/history/{EQUIPMENT_ID}", params=params, headers=user)
+    assert response.status_code == 200
+    entries = response.json()
+    assert [entry["id"] for entry in entries] == ["h05", "h03"]
+    assert "old_values" not in entries[0] and "new_values" not in entries[0]
+    assert "X-Next-Cursor" not in response.headers
+
+
+async def test_history_rejects_bad_cursor(client, user):
+    response = await client.get(f"/api/history/{EQUIPMENT_ID}", params={"cursor": "not-a-cursor"}, headers=user)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Cursor de historial inválido"
+
+
+async def test_history_query_uses_compound_index(client, user):
+    await seed_history()
+    plan = server.db.history.explain({"equipment_id": EQUIPMENT_ID})
+    assert plan["queryPlanner"]["winningPlan"]["stage"] == "FETCH"
+    assert "equipment_id_1_timestamp_-1_id_-1" in await server.db.history.index_information()
+
+
+async def test_updates_store_diffs_and_versions_can_be_rebuilt(client, admin, superadmin, user, monkeypatch):
+    monkeypatch.setattr(history_store, "HISTORY_CHECKPOINT_INTERVAL", 3)
+    equipment_id = (await create_equipment(client, admin))["id"]
+    states = ["disponible", "en_mantenimiento", "asignado", "en_resguardo"]
+    for estado in states:
+        response = await client.put(f"/api/equipment/{equipment_id}", json={"estado_operativo": estado}, headers=admin)
+        assert response.status_code == 200
+    await client.delete(f"/api/equipment/{equipment_id}", headers=superadmin)
+
+    await history_store.flush_pending()
+    stored = await server.db.history.find({"equipment_id": equipment_id}).sort("version", 1).to_list(None)
+    assert [entry["version"] for entry in stored] == [1, 2, 3, 4, 5, 6]
+    assert stored[1]["old_values"]["estado_operativo"] == "asignado"
+    assert set(stored[1]["new_values"]) == {"estado_operativo", "updated_at", "version"}
+    assert [entry["checkpoint"] for entry in stored] == [True, False, True, False, False, False]
+    assert stored[2]["snapshot"]["estado_operativo"] == "en_mantenimiento"
+    assert stored[5]["old_values"] == {} and stored[5]["new_values"] == {}
+
+    for version, estado in enumerate(["asignado"] + states, start=1):
+        response = await client.get(f"/api/history/{equipment_id}/versions/{version}", headers=user)
+        assert response.status_code == 200
+        rebuilt = response.json()
+        assert rebuilt["version"] == version and not rebuilt["deleted"]
+        assert rebuilt["document"]["estado_operativo"] == estado
+        assert rebuilt["document"]["numero_serie"] == "SN-001"
+
+    deleted = (await client.get(f"/api/history/{equipment_id}/versions/6", headers=user)).json()
+    assert deleted["deleted"] and deleted["document"] is None
+    assert (await client.get(f"/api/history/{equipment_id}/versions/7", headers=user)).status_code == 404
+
+
+async def test_concurrent_updates_get_distinct_versions(client, admin, superadmin, user):
+    equipment_id = (await create_equipment(client, admin))["id"]
+    await history_store.flush_pending()
+    responses = await asyncio.gather(*[
+        client.put(f"/api/equipment/{equipment_id}", json={"resguardante": f"Persona {n}"}, headers=admin)
+        for n in range(5)])
+    assert [response.status_code for response in responses] == [200] * 5
+    await client.delete(f"/api/equipment/{equipment_id}", headers=superadmin)
+
+    await history_store.flush_pending()
+    stored = await server.db.history.find({"equipment_id": equipment_id}).sort("version", 1).to_list(None)
+    assert [entry["version"] for entry in stored] == [1, 2, 3, 4, 5, 6, 7]
+    for version in range(2, 7):
+        rebuilt = (await client.get(f"/api/history/{equipment_id}/versions/{version}", headers=user)).json()
+        assert rebuilt["document"]["version"] == version - 1
+    assert (await client.get(f"/api/history/{equipment_id}/versions/7", headers=user)).json()["deleted"]
+
+
+async def test_migration_rewrites_full_document_history(app, monkeypatch):
+    monkeypatch.setattr(history_store, "HISTORY_CHECKPOINT_INTERVAL", 3)
+    document = {"id": "legacy", "numero_serie": "SN-9", "estado_operativo": "disponible", "marca": "Dell",
+                "observaciones": "Equipo asignado al laboratorio de redes " * 4}
+    legacy = [
+        ("created", {}, dict(document)),
+        ("updated", dict(document), {"estado_operativo": "asignado"}),
+        ("updated", {**document, "estado_operativo": "asignado"}, {"marca": "HP"}),
+        ("deleted", {**document, "estado_operativo": "asignado", "marca": "HP"}, {}),
+    ]
+    for i, (action, old_values, new_values) in enumerate(legacy):
+        await server.db.history.insert_one({
+            "id": f"legacy-{i}", "equipment_id": "legacy", "action": action, "changed_by": "ana@universidad.edu",
+            "timestamp": (START + timedelta(minutes=i)).isoformat(),
+            "old_values": old_values, "new_values": new_values,
+        })
+
+    report = await history_store.migrate_history(server.db, batch_size=3)
+    assert report["converted"] == 4 and report["equipment"] == 1
+    assert report["bytes_after"] < report["bytes_before"]
+
+    entries = await server.db.history.find({"equipment_id": "legacy"}, {"_id": 0}).sort("version", 1).to_list(None)
+    assert entries[1]["old_values"] == {"estado_operativo": "disponible"}
+    assert entries[2]["snapshot"] == {**document, "estado_operativo": "asignado", "marca": "HP"}
+    assert entries[1]["snapshot"] is None
+    assert entries[3]["old_values"] == {}
+
+    rebuilt = await history_store.reconstruct(server.db, "legacy", version=2)
+    assert rebuilt["document"] == {**document, "estado_operativo": "asignado"}
+    assert (await history_store.reconstruct(server.db, "legacy", version=4))["deleted"]
+
+    # Already migrated: nothing left to do
+    assert (await history_store.migrate_history(server.db))["entries"] == 0
+
+
+async def test_archived_history_is_paged_transparently(client, user, superadmin):
+    await seed_history()
+    expected = (await client.get(f"/api/history/{EQUIPMENT_ID}", headers=user)).json()
+
+    response = await client.post("/api/admin/history/archive", params={"older_than_days": 365}, headers=superadmin)
+    report = response.json()
+    assert report["entries"] == 6 and report["equipment"] == 1
+    assert report["bytes_reclaimed"] == report["bytes_before"] - report["bytes_after"] > 0
+    assert await server.db.history.count_documents({"equipment_id": EQUIPMENT_ID}) == 1
+
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = await client.get(f"/api/history/{EQUIPMENT_ID}", params=params, headers=user)
+        pages.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert pages == expected
+
+    params = {"changed_by": "ana@universidad.edu", "until": "2024-03-01T04:00:00", "summary": "true"}
+    filtered = (await client.get(f"/api/history/{EQUIPMENT_ID}", params=params, headers=user)).json()
+    assert [entry["id"] for entry in filtered] == ["h03", "h01"]
+
+
+async def test_archiving_keeps_versions_and_as_of_replayable(client, admin, user, superadmin):
+    equipment_id = (await create_equipment(client, admin))["id"]
+    for estado in ["disponible", "en_mantenimiento", "en_resguardo"]:
+        await client.put(f"/api/equipment/{equipment_id}", json={"estado_operativo": estado}, headers=admin)
+    await history_store.flush_pending()
+    for version in (1, 2, 3):
+        await server.db.history.update_one(
+            {"equipment_id": equipment_id, "version": version},
+            {"$set": {"timestamp": datetime(2020, 1, version, tzinfo=timezone.utc)}})
+
+    report = await history_archive.archive_history(server.db, older_than_days=365)
+    assert report["entries"] == 3
+
+    kept = await server.db.history.find_one({"equipment_id": equipment_id, "version": 4})
+    assert kept["checkpoint"] and kept["snapshot"]["estado_operativo"] == "en_resguardo"
+    rebuilt = (await client.get(f"/api/history/{equipment_id}/versions/4", headers=user)).json()
+    assert rebuilt["document"]["estado_operativo"] == "en_resguardo"
+    # Archived versions are rebuilt from the segments
+    archived = (await client.get(f"/api/history/{equipment_id}/versions/2", headers=user)).json()
+    assert archived["version"] == 2 and archived["document"]["estado_operativo"] == "disponible"
+    assert (await client.get(f"/api/history/{equipment_id}/versions/9", headers=user)).status_code == 404
+
+    listing = (await client.get("/api/equipment", params={"as_of": "2020-01-02T12:00:00"}, headers=user)).json()
+    assert [eq["estado_operativo"] for eq in listing] == ["disponible"]
+
+
+async def test_interrupted_archival_does_not_duplicate_entries(app, monkeypatch):
+    await seed_history()
+    history = server.db.history
+
+    class Crash(Exception):
+        pass
+
+    async def crash(query):
+        raise Crash()
+    with monkeypatch.context() as patch, pytest.raises(Crash):
+        patch.setattr(history, "delete_many", crash)
+        await history_archive.archive_history(server.db, older_than_days=365, segment_size=4)
+
+    report = await history_archive.archive_history(server.db, older_than_days=365, segment_size=4)
+    assert report["entries"] == 0
+    assert await server.db.history.count_documents({"equipment_id": EQUIPMENT_ID}) == 1
+    archived = [entry["id"] async for entry in history_archive.iter_archived(server.db, EQUIPMENT_ID)]
+    assert archived == ["h05", "h04", "h03", "h02", "h01", "h00"]
+
+
+async def test_global_audit_log_filters_and_pages(client, admin, user):
+    await seed_history()
+    assert (await client.get("/api/history", headers=user)).status_code == 403
+
+    first = (await client.get("/api/history", params={"changed_by": "ana@universidad.edu", "limit": 2},
+                              headers=admin))
+    assert [entry["id"] for entry in first.json()] == ["h05", "h03"]
+    second = await client.get("/api/history", params={"changed_by": "ana@universidad.edu", "limit": 2,
+                                                      "cursor": first.headers["X-Next-Cursor"]}, headers=admin)
+    assert [entry["id"] for entry in second.json()] == ["h01"]
+    assert "X-Next-Cursor" not in second.headers
+
+    window = {"since": "2024-03-01T02:00:00Z", "until": "2024-03-01T04:00:00Z", "action": "updated"}
+    assert [e["id"] for e in (await client.get("/api/history", params=window, headers=admin)).json()] == ["h03", "h02"]
+
+
+async def test_audit_log_field_filter_and_streaming_export(client, admin, monkeypatch):
+    equipment_id = (await create_equipment(client, admin))["id"]
+    await client.put(f"/api/equipment/{equipment_id}", json={"resguardante": "Ana"}, headers=admin)
+    await client.put(f"/api/equipment/{equipment_id}", json={"estado_operativo": "disponible"}, headers=admin)
+
+    touched = (await client.get("/api/history", params={"field": "resguardante"}, headers=admin)).json()
+    assert [entry["action"] for entry in touched] == ["updated", "created"]
+    assert "resguardante" in touched[0]["changed_fields"]
+
+    monkeypatch.setattr(server, "AUDIT_EXPORT_BATCH_SIZE", 2)
+    response = await client.get("/api/history", params={"export": "ndjson"}, headers=admin)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["version"] for line in lines] == [3, 2, 1]
+
+    response = await client.get("/api/history", params={"export": "csv", "summary": "true"}, headers=admin)
+    rows = list(csv.reader(response.text.splitlines()))
+    assert rows[0] == server.AUDIT_EXPORT_COLUMNS
+    assert [row[2] for row in rows[1:]] == ["updated", "updated", "created"]
+
+
+async def test_audit_log_merges_archived_entries(client, admin):
+    await seed_history()
+    await history_archive.archive_history(server.db, older_than_days=365)
+    params = {"changed_by": "luis@universidad.edu"}
+    hot_only = (await client.get("/api/history", params=params, headers=admin)).json()
+    # "other" shares h06's timestamp and wins the id tiebreak
+    assert [entry["id"] for entry in hot_only] == ["other", "h06"]
+    merged = (await client.get("/api/history", params={**params, "include_archived": "true"}, headers=admin)).json()
+    assert [entry["id"] for entry in merged] == ["other", "h06", "h04", "h02", "h00"]
+
+
+async def test_audit_log_reads_archive_segments_lazily(client, admin, monkeypatch):
+    await seed_history()
+    await history_archive.archive_history(server.db, older_than_days=365, segment_size=2)
+    decoded = []
+    original = history_archive._decode
+
+    def counting_decode(data):
+        entries = original(data)
+        decoded.append([entry["id"] for entry in entries])
+        return entries
+    monkeypatch.setattr(history_archive, "_decode", counting_decode)
+
+    params = {"include_archived": "true", "limit": 2}
+    first = await client.get("/api/history", params=params, headers=admin)
+    assert [entry["id"] for entry in first.json()] == ["other", "h06"]
+    # Only the newest of the three segments was needed to find the next entry
+    assert decoded == [["h04", "h05"]]
+
+    rest = await client.get("/api/history", params={**params, "limit": 10, "cursor": first.headers["X-Next-Cursor"]},
+                            headers=admin)
+    assert [entry["id"] for entry in rest.json()] == ["h05", "h04", "h03", "h02", "h01", "h00"]
+
+
+class FailingHistory:
+    """History collection stand-in whose writes fail (database outage)"""
+
+    def find(self, query, projection=None):
+        return server.db.history.find(query, projection)
+
+    async def insert_many(self, documents, ordered=True):
+        raise ConnectionError("database unavailable")
+
+
+async def test_history_writer_batches_and_survives_outages(app, tmp_path):
+    entries = [{"id": f"w{n}", "equipment_id": "eq-writer", "version": n} for n in range(1, 4)]
+    writer = HistoryWriter(FailingHistory(), tmp_path, batch_size=2, flush_interval=3600)
+    await writer.start()
+    for entry in entries:
+        writer.enqueue(dict(entry))
+    assert writer.depth == 3
+    assert history_writer.queue_depth.value() == 3
+
+    await writer.stop()
+    assert writer.depth == 3
+    assert list(tmp_path.glob("history-spool*.jsonl"))
+    assert await server.db.history.count_documents({"equipment_id": "eq-writer"}) == 0
+
+    # The next process replays the spool before accepting entries
+    await server.db.history.insert_one(dict(entries[0]))
+    replay = HistoryWriter(server.db.history, tmp_path, batch_size=2)
+    await replay.start()
+    stored = await server.db.history.find({"equipment_id": "eq-writer"}, {"_id": 0}).to_list(None)
+    assert sorted(entry["id"] for entry in stored) == ["w1", "w2", "w3"]
+    await replay.stop()
+    assert not [path for path in tmp_path.glob("history-spool*.jsonl") if path.stat().st_size]
+
+
+async def test_workers_only_replay_the_spool_of_stopped_processes(app, tmp_path):
+    first = HistoryWriter(FailingHistory(), tmp_path, flush_interval=3600)
+    await first.start()
+    first.enqueue({"id": "p1", "equipment_id": "eq-workers", "version": 1})
+
+    # A second worker starting next to a running one leaves its spool alone
+    second = HistoryWriter(server.db.history, tmp_path, flush_interval=3600)
+    await second.start()
+    assert await server.db.history.count_documents({"equipment_id": "eq-workers"}) == 0
+    second.enqueue({"id": "p2", "equipment_id": "eq-workers", "version": 2})
+    assert first._current_path != second._current_path
+
+    await first.stop()
+    third = HistoryWriter(server.db.history, tmp_path, flush_interval=3600)
+    await third.start()
+    stored = await server.db.history.find({"equipment_id": "eq-workers"}, {"_id": 0, "id": 1}).to_list(None)
+    assert [entry["id"] for entry in stored] == ["p1"]
+    await second.stop()
+    await third.stop()
+    assert await server.db.history.count_documents({"equipment_id": "eq-workers"}) == 2
+    assert not list(tmp_path.glob("history-spool*"))
+
+
+class SlowHistory:
+    """History collection whose inserts wait for a signal"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+
+    def find(self, query, projection=None):
+        return server.db.history.find(query, projection)
+
+    async def insert_many(self, documents, ordered=True):
+        await self.release.wait()
+        await server.db.history.insert_many(documents, ordered=ordered)
+
+
+async def test_reads_wait_for_a_flush_in_progress(app, tmp_path, monkeypatch):
+    collection = SlowHistory()
+    writer = HistoryWriter(collection, tmp_path, flush_interval=3600)
+    await writer.start()
+    monkeypatch.setattr(history_store, "_writer", writer)
+    writer.enqueue({"id": "slow", "equipment_id": "eq-slow", "version": 1})
+    background = asyncio.create_task(writer.flush())
+    await asyncio.sleep(0.01)
+    # The entry left the buffer but is not stored yet
+    assert writer.depth == 1
+
+    read = asyncio.create_task(history_store.flush_pending())
+    await asyncio.sleep(0.01)
+    assert not read.done()
+    collection.release.set()
+    await read
+    assert await server.db.history.count_documents({"equipment_id": "eq-slow"}) == 1
+    await background
+    assert writer.depth == 0
+    await writer.stop()
+
+
+async def test_shutdown_drains_queued_history(client, admin):
+    equipment_id = (await create_equipment(client, admin))["id"]
+    await client.put(f"/api/equipment/{equipment_id}", json={"resguardante": "Ana"}, headers=admin)
+    assert server.history_writer.depth == 2
+    assert await server.db.history.count_documents({"equipment_id": equipment_id}) == 0
+
+    await server.app.router.shutdown()
+    assert await server.db.history.count_documents({"equipment_id": equipment_id}) == 2
+    await server.app.router.startup()
@@ -0,0 +1,75 @@
+"""
+Tests for point-in-time inventory queries
+"""
+from datetime import datetime, timezone
+from io import BytesIO
+import time
+
+import openpyxl
+import pytest
+
+import inventory_snapshots
+import server
+
+from .test_api import create_equipment
+
+pytestmark = pytest.mark.anyio
+
+
+def now() -> str:
+    moment = datetime.now(timezone.utc)
+    # Stored dates have millisecond precision: later writes must not share the millisecond
+    time.sleep(0.002)
+    return moment.isoformat()
+
+
+async def test_as_of_listing_dashboard_and_export(client, admin, superadmin):
+    first = await create_equipment(client, admin)
+    after_first = now()
+
+    snapshot = (await client.post("/api/admin/inventory-snapshots", headers=superadmin)).json()
+    assert snapshot["equipment_count"] == 1 and snapshot["chunks"] == 1
+
+    second = await create_equipment(client, admin, numero_serie="SN-002", departamento="Finanzas")
+    await client.put(f"/api/equipment/{first['id']}", json={"estado_operativo": "en_mantenimiento"}, headers=admin)
+    after_update = now()
+    await client.delete(f"/api/equipment/{second['id']}", headers=superadmin)
+
+    # Before the snapshot: rebuilt from history alone
+    listing = (await client.get("/api/equipment", params={"as_of": after_first}, headers=admin)).json()
+    assert [(eq["numero_serie"], eq["estado_operativo"]) for eq in listing] == [("SN-001", "asignado")]
+
+    # After the snapshot: snapshot plus the changes recorded since
+    listing = (await client.get("/api/equipment", params={"as_of": after_update}, headers=admin)).json()
+    assert [(eq["numero_serie"], eq["estado_operativo"]) for eq in listing] == [
+        ("SN-001", "en_mantenimiento"), ("SN-002", "asignado")]
+    filtered = (await client.get("/api/equipment", params={"as_of": after_update, "departamento": "Finanzas"},
+                                 headers=admin)).json()
+    assert [eq["numero_serie"] for eq in filtered] == ["SN-002"]
+    assert len((await client.get("/api/equipment", params={"as_of": now()}, headers=admin)).json()) == 1
+
+    stats = (await client.get("/api/dashboard/stats", params={"as_of": after_update}, headers=admin)).json()
+    assert stats["total_equipment"] == 2
+    assert stats["by_status"]["en_mantenimiento"] == 1
+    assert stats["by_department"] == {"Sistemas": 1, "Finanzas": 1}
+
+    response = await client.get("/api/equipment/export/excel", params={"as_of": after_update}, headers=admin)
+    assert response.status_code == 200
+    assert f"inventario_{after_update[:10]}.xlsx" in response.headers["content-disposition"]
+    rows = list(openpyxl.load_workbook(BytesIO(response.content)).active.values)
+    assert sorted(row[5] for row in rows[1:]) == ["SN-001", "SN-002"]
+
+
+async def test_snapshots_are_compressed_and_admin_only(client, admin, superadmin):
+    for i in range(5):
+        await create_equipment(client, admin, numero_serie=f"SN-{i:03d}")
+    assert (await client.post("/api/admin/inventory-snapshots", headers=admin)).status_code == 403
+
+    header = await inventory_snapshots.take_snapshot(server.db, chunk_size=2)
+    assert header["chunks"] == 3
+    chunk = await server.db.inventory_snapshot_chunks.find_one({"snapshot_id": header["id"], "number": 0})
+    assert isinstance(chunk["data"], bytes)
+    assert len(await inventory_snapshots.load_snapshot(server.db, header)) == 5
+
+    listed = (await client.get("/api/admin/inventory-snapshots", headers=admin)).json()
+    assert [snapshot["id"] for snapshot in listed] == [header["id"]]
@@ -0,0 +1,144 @@
+"""
+Unit tests for the in-memory storage engine
+"""
+from datetime import datetime, timezone, timedelta
+
+import pytest
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from memory_db import MemoryDB
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def db():
+    database = MemoryDB()
+    await database.items.insert_many([
+        {"id": "1", "tipo": "laptop", "marca": "Dell", "precio": 10, "tags": ["a", "b"]},
+        {"id": "2", "tipo": "laptop", "marca": "HP", "precio": 30},
+        {"id": "3", "tipo": "monitor", "marca": "Dell", "precio": 20, "extra": {"color": "negro"}},
+    ])
+    return database
+
+
+async def test_insert_adds_object_id_like_pymongo(db):
+    document = {"id": "4"}
+    result = await db.items.insert_one(document)
+    assert document["_id"] == result.inserted_id
+    stored = await db.items.find_one({"id": "4"})
+    assert stored["_id"] == result.inserted_id
+
+
+async def test_query_operators(db):
+    async def ids(query):
+        return [doc["id"] for doc in await db.items.find(query).to_list(None)]
+
+    assert await ids({"tipo": "laptop"}) == ["1", "2"]
+    assert await ids({"precio": {"$gte": 20}}) == ["2", "3"]
+    assert await ids({"precio": {"$gt": 10, "$lt": 30}}) == ["3"]
+    assert await ids({"id": {"$in": ["1", "3"]}}) == ["1", "3"]
+    assert await ids({"marca": {"$ne": "Dell"}}) == ["2"]
+    assert await ids({"extra": {"$exists": True}}) == ["3"]
+    assert await ids({"extra.color": "negro"}) == ["3"]
+    assert await ids({"tags": "b"}) == ["1"]
+    assert await ids({"$or": [{"marca": {"$regex": "hp", "$options": "i"}}, {"precio": 20}]}) == ["2", "3"]
+
+
+async def test_projection_sort_skip_limit(db):
+    docs = await db.items.find({}, {"_id": 0, "id": 1, "precio": 1}).sort("precio", -1).skip(1).limit(1).to_list(10)
+    assert docs == [{"id": "3", "precio": 20}]
+
+    docs = await db.items.find({"id": "3"}, {"_id": 0, "extra": 0, "tags": 0}).to_list(10)
+    assert docs == [{"id": "3", "tipo": "monitor", "marca": "Dell", "precio": 20}]
+
+    ordered = await db.items.find({}).sort([("marca", 1), ("precio", -1)]).to_list(None)
+    assert [doc["id"] for doc in ordered] == ["3", "1", "2"]
+
+
+async def test_returned_documents_are_copies(db):
+    doc = await db.items.find_one({"id": "1"})
+    doc["tags"].append("c")
+    assert (await db.items.find_one({"id": "1"}))["tags"] == ["a", "b"]
+
+
+async def test_update_and_delete(db):
+    result = await db.items.update_one({"id": "1"}, {"$set": {"precio": 15}, "$inc": {"ventas": 2}})
+    assert (result.matched_count, result.modified_count) == (1, 1)
+    assert (await db.items.find_one({"id": "1"}, {"_id": 0, "precio": 1, "ventas": 1})) == {"precio": 15, "ventas": 2}
+
+    result = await db.items.update_many({"marca": "Dell"}, {"$unset": {"tags": ""}})
+    assert result.modified_count == 1
+
+    await db.items.update_one({"id": "9"}, {"$set": {"tipo": "nuevo"}}, upsert=True)
+    assert (await db.items.find_one({"id": "9"}))["tipo"] == "nuevo"
+
+    assert (await db.items.delete_one({"id": "missing"})).deleted_count == 0
+    assert (await db.items.delete_many({"marca": "Dell"})).deleted_count == 2
+    assert await db.items.count_documents({}) == 2
+
+
+async def test_find_one_and_update_returns_before_and_after(db):
+    before = await db.items.find_one_and_update({"id": "2"}, {"$inc": {"precio": 5}}, projection={"_id": 0})
+    assert before["precio"] == 30
+    after = await db.items.find_one_and_update({"id": "2"}, {"$inc": {"precio": 5}},
+                                               return_document=ReturnDocument.AFTER)
+    assert after["precio"] == 40
+    assert await db.items.find_one_and_update({"id": "missing"}, {"$set": {"x": 1}}) is None
+
+
+async def test_indexes_are_maintained_on_update(db):
+    await db.items.create_index("marca")
+    await db.items.update_one({"id": "2"}, {"$set": {"marca": "Lenovo"}})
+    assert await db.items.count_documents({"marca": "HP"}) == 0
+    assert await db.items.count_documents({"marca": "Lenovo"}) == 1
+    assert await db.items.count_documents({"marca": {"$in": ["Dell", "Lenovo"]}}) == 3
+
+
+async def test_array_fields_are_indexed_per_element(db):
+    await db.items.create_index("tags")
+    assert db.items.explain({"tags": "b"})["queryPlanner"]["winningPlan"]["stage"] == "FETCH"
+    assert [doc["id"] for doc in await db.items.find({"tags": "b"}).to_list(None)] == ["1"]
+    await db.items.update_one({"id": "1"}, {"$pull": {"tags": "b"}})
+    assert await db.items.count_documents({"tags": "b"}) == 0
+    assert await db.items.count_documents({"tags": ["a"]}) == 1
+
+
+async def test_unique_index(db):
+    await db.items.create_index("id", unique=True)
+    with pytest.raises(DuplicateKeyError):
+        await db.items.insert_one({"id": "1"})
+    with pytest.raises(DuplicateKeyError):
+        await db.items.update_one({"id": "2"}, {"$set": {"id": "1"}})
+    assert await db.items.count_documents({"id": "2"}) == 1
+
+
+async def test_distinct_and_aggregate(db):
+    assert sorted(await db.items.distinct("marca")) == ["Dell", "HP"]
+    assert await db.items.distinct("tipo", {"marca": "HP"}) == ["laptop"]
+
+    pipeline = [
+        {"$match": {"precio": {"$gte": 10}}},
+        {"$group": {"_id": "$marca", "count": {"$sum": 1}, "precios": {"$push": "$precio"},
+                    "maximo": {"$max": "$precio"}}},
+        {"$sort": {"count": -1}},
+    ]
+    result = await db.items.aggregate(pipeline).to_list(length=100)
+    assert result == [
+        {"_id": "Dell", "count": 2, "precios": [10, 20], "maximo": 20},
+        {"_id": "HP", "count": 1, "precios": [30], "maximo": 30},
+    ]
+
+
+async def test_datetimes_are_stored_as_naive_utc_milliseconds():
+    db = MemoryDB()
+    moment = datetime(2024, 5, 1, 12, 0, 0, 123456, tzinfo=timezone(timedelta(hours=-6)))
+    await db.events.insert_one({"id": "1", "at": moment})
+    stored = await db.events.find_one({"id": "1"})
+    assert stored["at"] == datetime(2024, 5, 1, 18, 0, 0, 123000)
+    assert await db.events.count_documents({"at": {"$gte": moment - timedelta(seconds=1)}}) == 1
+
+
+async def test_ping_command():
+    assert (await MemoryDB().command("ping"))["ok"] == 1.0
@@ -0,0 +1,71 @@
+"""
+Tests for the Prometheus metrics endpoint
+"""
+import pytest
+
+import metrics
+import server
+from db_monitoring import MongoCommandListener, add_listener, remove_listener
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_metrics_endpoint_reports_routes_and_db_operations(client, admin):
+    equipment_id = "00000000-0000-0000-0000-000000000000"
+    await client.get(f"/api/equipment/{equipment_id}", headers=admin)
+    await client.get("/api/equipment", headers=admin)
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+
+    assert 'siriu_http_requests_total{method="GET",route="/api/equipment/{equipment_id}",status="404"}' in body
+    assert 'siriu_http_request_duration_seconds_bucket{method="GET",route="/api/equipment",le="+Inf"}' in body
+    assert 'siriu_http_response_size_bytes_count{method="GET",route="/api/equipment"}' in body
+    assert "# TYPE siriu_http_requests_in_flight gauge" in body
+    assert 'siriu_db_operations_total{collection="equipment",operation="find",status="ok"}' in body
+    assert 'siriu_db_operation_duration_seconds_count{collection="users",operation="find"}' in body
+    assert equipment_id not in body
+
+
+async def test_metrics_token(client, monkeypatch):
+    monkeypatch.setattr(server, "METRICS_TOKEN", "scrape-secret")
+    assert (await client.get("/metrics")).status_code == 401
+    response = await client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+
+
+def test_histogram_rendering():
+    histogram = metrics.Histogram("demo_seconds", "Demo", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(("/a",), 0.05)
+    histogram.observe(("/a",), 0.5)
+    histogram.observe(("/a",), 5)
+    lines = histogram.render().splitlines()
+    assert 'demo_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{route="/a",le="1"} 2' in lines
+    assert 'demo_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'demo_seconds_count{route="/a"} 3' in lines
+
+
+def test_mongo_command_listener_translates_events():
+    class Event:
+        connection_id = ("localhost", 27017)
+        request_id = 7
+        command_name = "find"
+        command = {"find": "equipment", "filter": {"tipo_bien": "computadora"}}
+        duration_micros = 1500
+
+    seen = []
+
+    def listener(*args):
+        seen.append(args)
+
+    add_listener(listener)
+    try:
+        mongo_listener = MongoCommandListener()
+        mongo_listener.started(Event())
+        mongo_listener.succeeded(Event())
+    finally:
+        remove_listener(listener)
+    assert seen == [("equipment", "find", 0.0015, True, {"tipo_bien": "computadora"})]
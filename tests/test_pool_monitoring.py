@@ -0,0 +1,69 @@
+"""
+Tests for the MongoDB pool configuration, warm-up and pool metrics
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import pool_monitoring
+import storage
+
+pytestmark = pytest.mark.anyio
+
+SERVER = ("db-1", 27017)
+
+
+async def test_client_options_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "20")
+    monkeypatch.setenv("MONGO_MIN_POOL_SIZE", "4")
+    monkeypatch.setenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000")
+    monkeypatch.setenv("MONGO_COMPRESSORS", "zlib")
+    monkeypatch.setenv("MONGO_SOCKET_TIMEOUT_MS", " ")
+    options = storage.mongo_client_options()
+    assert options == {"maxPoolSize": 20, "minPoolSize": 4, "waitQueueTimeoutMS": 2000, "compressors": "zlib"}
+
+    client = AsyncIOMotorClient("mongodb://db-1", connect=False, **options)
+    try:
+        pool = client.options.pool_options
+        assert (pool.max_pool_size, pool.min_pool_size, pool.wait_queue_timeout) == (20, 4, 2.0)
+    finally:
+        client.close()
+
+
+async def test_warm_up_opens_connections_concurrently():
+    in_flight = []
+    peak = []
+
+    class Database:
+        async def command(self, name):
+            in_flight.append(name)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+            return {"ok": 1}
+
+    assert await storage.warm_up(Database(), 4) == 4
+    assert max(peak) == 4
+    assert await storage.warm_up(Database(), 0) == 0
+
+
+def test_pool_listener_tracks_utilization_and_checkout_wait():
+    listener = pool_monitoring.PoolMetricsListener()
+    labels = ("db-1:27017",)
+    waits = pool_monitoring.pool_checkout_wait.count(labels)
+    listener.pool_created(SimpleNamespace(address=SERVER, options={"maxPoolSize": 10}))
+    for _ in range(2):
+        listener.connection_created(SimpleNamespace(address=SERVER))
+        listener.connection_check_out_started(SimpleNamespace(address=SERVER))
+        listener.connection_checked_out(SimpleNamespace(address=SERVER))
+    listener.connection_checked_in(SimpleNamespace(address=SERVER))
+    listener.connection_check_out_started(SimpleNamespace(address=SERVER))
+    listener.connection_check_out_failed(SimpleNamespace(address=SERVER, reason="timeout"))
+
+    assert pool_monitoring.pool_max_size.value(labels) == 10
+    assert pool_monitoring.pool_connections.value(labels) >= 2
+    assert pool_monitoring.pool_checked_out.value(labels) >= 1
+    assert pool_monitoring.pool_checkout_wait.count(labels) == waits + 3
+    assert pool_monitoring.pool_checkout_failures_total.value(("db-1:27017", "timeout")) >= 1
@@ -0,0 +1,67 @@
+"""
+Tests for the on-demand sampling profiler
+"""
+import asyncio
+
+import pytest
+
+import profiler
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_single_request_profile_is_superadmin_only(client, superadmin, admin):
+    response = await client.get("/api/equipment", headers={**admin, "X-Profile": "collapsed",
+                                                           "Origin": "http://localhost:3000"})
+    assert response.status_code == 403
+    # The refusal carries the CORS headers, so the page can read it
+    assert response.headers["access-control-allow-origin"] == "http://localhost:3000"
+
+    response = await client.get("/api/equipment", headers={**superadmin, "X-Profile": "collapsed"})
+    assert response.status_code == 200
+    assert response.headers["X-Profiled-Status"] == "200"
+    lines = response.text.splitlines()
+    assert any(line.startswith("GET /api/equipment;[db] equipment.find ") for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) >= 0 for line in lines)
+    assert not profiler._active()
+
+
+async def test_single_request_profile_via_query_flag_returns_speedscope(client, superadmin):
+    response = await client.get("/api/equipment?_profile=speedscope", headers=superadmin)
+    assert response.status_code == 200
+    profile = response.json()
+    assert profile["$schema"] == profiler.SPEEDSCOPE_SCHEMA
+    frames = [frame["name"] for frame in profile["shared"]["frames"]]
+    assert "[db] equipment.find" in frames
+    sampled = profile["profiles"][0]
+    assert sampled["type"] == "sampled"
+    assert len(sampled["samples"]) == len(sampled["weights"])
+
+
+async def test_timed_profile_samples_concurrent_requests(client, superadmin, user):
+    async def traffic():
+        await asyncio.sleep(0.02)
+        for _ in range(5):
+            await client.get("/api/dashboard/stats", headers=user)
+
+    response, _ = await asyncio.gather(
+        client.get("/api/admin/profile", params={"seconds": 0.2, "format": "collapsed"}, headers=superadmin),
+        traffic(),
+    )
+    assert response.status_code == 200
+    assert "GET /api/dashboard/stats;[db] equipment.aggregate" in response.text
+    assert not profiler._active()
+
+
+async def test_timed_profile_requires_superadmin(client, admin):
+    response = await client.get("/api/admin/profile", params={"seconds": 0.01}, headers=admin)
+    assert response.status_code == 403
+
+
+def test_frame_stack_is_root_first():
+    def inner():
+        import sys
+        return profiler._frame_stack(sys._getframe())
+
+    stack = inner()
+    assert stack[-1].startswith("test_frame_stack_is_root_first.<locals>.inner (tests/test_profiler.py:")
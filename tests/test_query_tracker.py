@@ -0,0 +1,63 @@
+"""
+Tests for per-request query tracking, the slow-request log and query budgets
+"""
+import asyncio
+import json
+import logging
+
+import pytest
+
+import query_tracker
+from query_tracker import QueryBudgetExceeded, assert_query_budget, query_shape
+
+pytestmark = pytest.mark.anyio
+
+
+def test_query_shape_redacts_values():
+    query = {"tipo_bien": "computadora", "$or": [{"marca": {"$regex": "dell", "$options": "i"}}],
+             "id": {"$in": ["a", "b"]}}
+    assert query_shape(query) == {"tipo_bien": "?", "$or": [{"marca": {"$regex": "?", "$options": "?"}}],
+                                  "id": {"$in": ["?"]}}
+
+    pipeline = [{"$match": {"departamento": "Sistemas"}}, {"$group": {"_id": "$departamento"}}]
+    assert query_shape(pipeline, in_pipeline=True) == [{"$match": {"departamento": "?"}},
+                                                        {"$group": {"_id": "$departamento"}}]
+
+
+async def test_query_budget_counts_request_operations(client, admin):
+    with assert_query_budget(2) as log:
+        await client.get("/api/equipment", headers=admin)
+    # one user lookup for authentication and one equipment find
+    assert [(collection, operation) for collection, operation, _, _ in log.operations] == [
+        ("users", "find"), ("equipment", "find")]
+
+
+async def test_query_budget_fails_on_n_plus_one(client, admin):
+    for nombre in ["computadora", "periferico", "impresora"]:
+        await client.post("/api/tipos-bien", json={"nombre": nombre}, headers=admin)
+
+    with pytest.raises(QueryBudgetExceeded) as error:
+        with assert_query_budget(3):
+            await client.get("/api/dashboard/stats", headers=admin)
+    assert 'equipment.aggregate {"tipo_bien": "?"}' in str(error.value)
+
+
+async def test_slow_requests_are_logged_with_collscans(client, admin, monkeypatch, caplog):
+    monkeypatch.setattr(query_tracker, "SLOW_REQUEST_QUERIES", 2)
+    caplog.set_level(logging.WARNING, logger="siriu.slow_requests")
+
+    await client.get("/api/equipment", params={"search": "computadora"}, headers=admin)
+    for _ in range(20):
+        if caplog.records:
+            break
+        await asyncio.sleep(0.01)
+
+    report = json.loads(caplog.records[-1].getMessage())
+    assert report["route"] == "/api/equipment"
+    assert report["db_operations"] == 2
+    assert "computadora" not in caplog.text
+    collscans = {finding["shape"]: finding["winning_plan"] for finding in report["collscans"]}
+    # Filters on the sortable fields use their (field, id) indexes; the search regexes cannot
+    [search_plan] = [plan for shape, plan in collscans.items() if shape.startswith('equipment.find {"$or"')]
+    assert search_plan["stage"] == "COLLSCAN"
+    assert search_plan["filter"]["$or"][0] == {"numero_serie": {"$regex": "?", "$options": "?"}}
@@ -0,0 +1,52 @@
+"""
+Tests for read-preference routing of heavy reads
+"""
+from types import SimpleNamespace
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import metrics
+import read_routing
+from memory_db import MemoryDB
+
+pytestmark = pytest.mark.anyio
+
+
+def test_parse_read_preferences():
+    assert read_routing.parse_read_preferences("bi=secondaryPreferred:120, export=nearest") == {
+        "bi": ("secondaryPreferred", 120), "export": ("nearest", None)}
+    assert read_routing.parse_read_preferences("") == {}
+    for invalid in ["bi=secundario", "bi=secondaryPreferred:30", "bi=primary:120"]:
+        with pytest.raises(ValueError):
+            read_routing.parse_read_preferences(invalid)
+
+
+async def test_route_reads_applies_the_workload_preference():
+    preferences = read_routing.parse_read_preferences("bi=secondaryPreferred:120")
+    client = AsyncIOMotorClient("mongodb://db-1,db-2,db-3/?replicaSet=rs0", connect=False)
+    try:
+        bi = read_routing.route_reads(client.siriu, "bi", preferences)
+        assert bi.read_preference.mongos_mode == "secondaryPreferred" and bi.read_preference.max_staleness == 120
+        assert read_routing.route_reads(client.siriu, "crud", preferences).read_preference.mongos_mode == "primary"
+    finally:
+        client.close()
+
+    memory = MemoryDB()
+    assert read_routing.route_reads(memory, "bi", preferences) is memory
+
+
+def test_listener_counts_the_serving_replica_per_route():
+    listener = read_routing.RoutedReadListener()
+    token = metrics._current_route.set("/api/dashboard/stats")
+    try:
+        listener.started(SimpleNamespace(command={"find": "equipment", "$readPreference": {"mode": "secondaryPreferred"}},
+                                         connection_id=("db-2", 27017)))
+        # Primary reads carry no $readPreference and are not counted
+        listener.started(SimpleNamespace(command={"find": "equipment"}, connection_id=("db-1", 27017)))
+    finally:
+        metrics._current_route.reset(token)
+    body = read_routing.routed_reads_total.render()
+    assert ('siriu_db_routed_reads_total{route="/api/dashboard/stats",read_preference="secondaryPreferred",'
+            'server="db-2:27017"} 1') in body
+    assert 'server="db-1:27017"' not in body
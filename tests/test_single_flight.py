@@ -0,0 +1,78 @@
+"""
+Tests for request coalescing of expensive reads
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import server
+import single_flight
+from single_flight import SingleFlight, request_key
+
+from .test_api import create_equipment
+
+pytestmark = pytest.mark.anyio
+
+
+class SlowComputation:
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return {"calls": self.calls}
+
+
+async def test_identical_requests_share_one_computation():
+    flight = SingleFlight()
+    compute = SlowComputation()
+    key = request_key("dashboard_stats", "admin", {"as_of": None})
+    waiters = [asyncio.ensure_future(flight.run(key, compute)) for _ in range(10)]
+    other_scope = asyncio.ensure_future(flight.run(request_key("dashboard_stats", "user", {}), compute))
+    await asyncio.sleep(0)
+    compute.release.set()
+
+    results = await asyncio.gather(*waiters)
+    assert all(result is results[0] for result in results)
+    assert (await other_scope)["calls"] == 2 and compute.calls == 2
+    # Without a TTL nothing is kept once the computation is over
+    await flight.run(key, compute)
+    assert compute.calls == 3
+
+
+async def test_ttl_stale_while_revalidate_and_invalidation(monkeypatch):
+    clock = [100.0]
+    # Only single_flight's clock: the event loop keeps the real one
+    monkeypatch.setattr(single_flight, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+    flight = SingleFlight(ttl=5, stale=10)
+    compute = SlowComputation()
+    compute.release.set()
+    key = request_key("export_pdf", "admin", {})
+
+    assert await flight.run(key, compute) == {"calls": 1}
+    clock[0] += 4
+    assert await flight.run(key, compute) == {"calls": 1} and compute.calls == 1
+
+    # Stale: the old result is returned at once and refreshed in the background
+    clock[0] += 3
+    assert await flight.run(key, compute) == {"calls": 1}
+    await asyncio.sleep(0.01)
+    assert compute.calls == 2 and await flight.run(key, compute) == {"calls": 2}
+
+    clock[0] += 20
+    assert await flight.run(key, compute) == {"calls": 3}
+    flight.invalidate()
+    assert await flight.run(key, compute) == {"calls": 4}
+
+
+async def test_writes_invalidate_cached_dashboards(client, admin, monkeypatch):
+    monkeypatch.setattr(server.read_coalescer, "ttl", 60)
+    await create_equipment(client, admin)
+    assert (await client.get("/api/dashboard/stats", headers=admin)).json()["total_equipment"] == 1
+
+    await create_equipment(client, admin, numero_serie="SN-002")
+    assert (await client.get("/api/dashboard/stats", headers=admin)).json()["total_equipment"] == 2
+    server.read_coalescer.invalidate()